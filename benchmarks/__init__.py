@@ -0,0 +1 @@
+# -*- coding:Utf8 -*-
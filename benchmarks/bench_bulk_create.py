@@ -0,0 +1,55 @@
+# -*- coding:Utf8 -*-
+
+"""
+    Compare ingest throughput of looping over POST /api/v1/tasks/ with a
+    single POST /api/v1/tasks/bulk holding the same tasks.
+
+    Usage: python -m benchmarks.bench_bulk_create [tasks]
+"""
+
+import json
+import sys
+import time
+
+from benchmarks.common import app, db
+from project import bcrypt
+from project.models import User
+
+
+########################
+#    Main Program :    #
+########################
+
+
+def tasks(count):
+    return [{'name': 'Bulk benchmark task {0}'.format(i),
+             'due_date': '22/09/2055',
+             'priority': i % 10 + 1} for i in range(count)]
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    db.create_all()
+    if not User.query.filter_by(name='bulkbench').first():
+        db.session.add(User('bulkbench', 'bulkbench@bench.fr',
+                            bcrypt.generate_password_hash('bulkbench')))
+        db.session.commit()
+    client = app.test_client()
+
+    start = time.time()
+    for task in tasks(count):
+        task.update({'user_name': 'bulkbench', 'password': 'bulkbench'})
+        assert client.post('/api/v1/tasks/', data=task).status_code == 201
+    single = time.time() - start
+
+    start = time.time()
+    response = client.post('/api/v1/tasks/bulk', content_type='application/json',
+                           data=json.dumps({'user_name': 'bulkbench',
+                                            'password': 'bulkbench',
+                                            'tasks': tasks(count)}))
+    assert response.status_code == 201
+    bulk = time.time() - start
+
+    print("{0} tasks one by one: {1:.0f} tasks/s".format(count, count / single))
+    print("{0} tasks in bulk:    {1:.0f} tasks/s".format(count, count / bulk))
+    print("Speedup: {0:.0f}x".format(single / bulk))
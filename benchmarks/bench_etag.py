@@ -0,0 +1,66 @@
+# -*- coding:Utf8 -*-
+
+"""
+    Compare full reads of the task api with conditional ones answered by 304.
+    Count rows fetched and statements executed on each path to show that a
+    304 only reads a version row.
+
+    Usage: python -m benchmarks.bench_etag [rows]
+"""
+
+import sys
+
+from sqlalchemy import event
+from sqlalchemy.engine.result import ResultProxy
+
+from benchmarks.common import app, db, seed_tasks, timed
+
+
+########################
+#    Main Program :    #
+########################
+
+
+counters = {'rows': 0, 'statements': 0}
+
+
+def count_rows(process_rows):
+    """
+        Wrap the result fetch: the api reads columns, not Task entities.
+    """
+    def wrapper(self, rows):
+        rows = process_rows(self, rows)
+        counters['rows'] += len(rows)
+        return rows
+    return wrapper
+
+
+def count_statement(*args):
+    counters['statements'] += 1
+
+
+def measure(client, url, headers, expected):
+    def call():
+        assert client.get(url, headers=headers).status_code == expected
+    counters.update(rows=0, statements=0)
+    call()
+    rows, statements = counters['rows'], counters['statements']
+    return timed(call, repeat=50), rows, statements
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    seed_tasks(rows)
+    ResultProxy.process_rows = count_rows(ResultProxy.process_rows)
+    event.listen(db.engine, 'before_cursor_execute', count_statement)
+    client = app.test_client()
+    print("{0:<28} | {1:>9} | {2:>9} | {3:>10}".format(
+        'demand', 'time (ms)', 'rows read', 'statements'))
+    for name, url in (('collection', '/api/v1/tasks/?limit=100'),
+                      ('resource', '/api/v1/tasks/1')):
+        etag = client.get(url).headers['ETag']
+        for label, headers, expected in (('full', {}, 200),
+                                         ('If-None-Match', {'If-None-Match': etag}, 304)):
+            print("{0:<28} | {1:>9.2f} | {2:>9} | {3:>10}".format(
+                '{0} {1}'.format(name, label),
+                *measure(client, url, headers, expected)))
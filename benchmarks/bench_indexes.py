@@ -0,0 +1,89 @@
+# -*- coding:Utf8 -*-
+
+"""
+    Show query plans and timings of the hot task queries without then with
+    the tasks indexes built by db_migrate_indexes.py.
+    Plans must switch from full table scans (plus temporary b-tree sorts) to
+    index searches.
+
+    Usage: python -m benchmarks.bench_indexes [rows]
+"""
+
+import sys
+
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from benchmarks.common import db, seed_tasks, timed
+from db_migrate_indexes import create_indexes
+from project.models import Task, User
+
+
+########################
+#    Main Program :    #
+########################
+
+
+class Explain(Executable, ClauseElement):
+
+    """
+        EXPLAIN of a query, parameters bound like the query itself.
+    """
+
+    def __init__(self, query):
+        self.statement = query.statement
+
+
+@compiles(Explain)
+def compile_explain(element, compiler, **kw):
+    if compiler.dialect.name == 'postgresql':
+        prefix = 'EXPLAIN ANALYZE '
+    else:
+        prefix = 'EXPLAIN QUERY PLAN '
+    return prefix + compiler.process(element.statement, **kw)
+
+
+def hot_queries():
+    """
+        Queries of the tasks page, ownership checks, per user counts and login.
+    """
+    session = db.session
+    page = 51
+    return [
+        ('open tasks page', session.query(Task).filter(Task.status == 1).order_by(
+            Task.due_date.asc(), Task.task_id.asc()).limit(page)),
+        ('closed tasks page', session.query(Task).filter(Task.status == 0).order_by(
+            Task.due_date.asc(), Task.task_id.asc()).limit(page)),
+        ('user open tasks', session.query(Task.task_id).filter(
+            Task.user_id == 7, Task.status == 1)),
+        ('user counts', session.query(Task.status, db.func.count()).filter(
+            Task.user_id == 7).group_by(Task.status)),
+        ('login', session.query(User).filter_by(name='bench7')),
+    ]
+
+
+def report(title):
+    print("\n== {0} ==".format(title))
+    db.session.execute('ANALYZE')
+    for name, query in hot_queries():
+        print("{0}: {1:.2f} ms".format(name, timed(query.all)))
+        # Plan lines do not match columns of the explained query: read them
+        # straight from the DBAPI cursor.
+        for row in db.session.execute(Explain(query)).cursor.fetchall():
+            print("    {0}".format(row[-1]))
+
+
+def drop_indexes():
+    for index in Task.__table__.indexes:
+        db.session.execute('DROP INDEX IF EXISTS {0}'.format(index.name))
+    db.session.commit()
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    seed_tasks(rows)
+    drop_indexes()
+    report('without indexes')
+    db.session.commit()
+    create_indexes(db.engine)
+    report('with indexes')
@@ -0,0 +1,47 @@
+# -*- coding:Utf8 -*-
+
+"""
+    Compare OFFSET paging with keyset (cursor) paging on GET /api/v1/tasks/.
+    Seed one million tasks then fetch pages at growing depths.
+    Keyset timings must stay flat while OFFSET ones grow with the depth.
+
+    Usage: python -m benchmarks.bench_pagination [rows]
+"""
+
+import sys
+
+from benchmarks.common import db, seed_tasks, timed
+from project.api.views import export_columns, tasks_page
+from project.models import Task
+
+
+########################
+#    Main Program :    #
+########################
+
+
+LIMIT = 20
+
+
+def offset_page(page):
+    columns = [getattr(Task, name) for name in export_columns]
+    return db.session.query(*columns).order_by(
+        Task.due_date.asc(), Task.task_id.asc()).limit(LIMIT).offset(page * LIMIT).all()
+
+
+def keyset_page(after):
+    return tasks_page(LIMIT, after).all()
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    seed_tasks(rows)
+    print("{0:>8} | {1:>12} | {2:>12}".format('page', 'offset (ms)', 'keyset (ms)'))
+    for page in (1, 10, 100, 1000, 10000, 49999):
+        if page * LIMIT >= rows:
+            break
+        # Key of the last row of the previous page, as a client cursor holds it.
+        last = offset_page(page - 1)[-1]
+        after = (last.due_date, last.task_id)
+        print("{0:>8} | {1:>12.2f} | {2:>12.2f}".format(
+            page, timed(lambda: offset_page(page)), timed(lambda: keyset_page(after))))
@@ -0,0 +1,49 @@
+# -*- coding:Utf8 -*-
+
+"""
+    Per request cost of validating a task creation: a RequestParser built for
+    every request (as flask_restful resources did in their __init__) versus
+    the schema declared once in project/api/schemas.py.
+
+    Usage: python -m benchmarks.bench_schemas [requests]
+"""
+
+import sys
+
+from flask_restful import reqparse
+
+from benchmarks.common import app, timed
+from project.api.schemas import task_create_schema
+
+
+########################
+#    Main Program :    #
+########################
+
+
+FORM = {"name": "Benchmark task", "user_name": "Tester", "password": "python",
+        "due_date": "22/09/2055", "priority": "2"}
+
+
+def before():
+    parser = reqparse.RequestParser()
+    parser.add_argument('name', type=str, required=True,
+                        help='A task need a task name.')
+    parser.add_argument('user_name', type=str, required=True)
+    parser.add_argument('password', type=str, required=True)
+    parser.add_argument('due_date', type=str, required=True,
+                        help='Use this format: DD/MM/YYYY')
+    parser.add_argument('priority', type=int, required=True)
+    return parser.parse_args()
+
+
+def after():
+    return task_create_schema.parse()
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    with app.test_request_context('/api/v1/tasks/', method='POST', data=FORM):
+        for label, func in (('before', before), ('after', after)):
+            total = timed(lambda: [func() for _ in range(count)], repeat=3)
+            print("{0:<7}: {1:6.2f} us per request".format(label, total * 1000 / count))
@@ -0,0 +1,53 @@
+# -*- coding:Utf8 -*-
+
+"""
+    Per row cost of serializing a 10k rows tasks response, before (Task
+    entities turned into dicts by hand) and after (column tuples and a
+    precomputed FieldPlan).
+
+    Usage: python -m benchmarks.bench_serializer [rows]
+"""
+
+import json
+import sys
+
+from benchmarks.common import app, db, seed_tasks, timed
+from project.api.serializers import dumps, plan_for
+from project.api.views import collection_labels, export_columns
+from project.models import Task
+
+
+########################
+#    Main Program :    #
+########################
+
+
+def before(rows):
+    results = []
+    for result in db.session.query(Task).limit(rows):
+        results.append({'task_id': result.task_id,
+                        'task name': result.name,
+                        'due date': str(result.due_date),
+                        'priority': result.priority,
+                        'posted date': str(result.posted_date),
+                        'status': result.status,
+                        'user id': result.user_id
+                        })
+    return json.dumps(results)
+
+
+def after(rows):
+    plan = plan_for(export_columns, collection_labels)
+    return dumps(plan.rows(db.session.query(*plan.columns).limit(rows).all()))
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    seed_tasks(rows)
+    with app.app_context():
+        assert len(json.loads(before(rows))) == len(json.loads(after(rows))) == rows
+        for label, func in (('before', before), ('after', after)):
+            # Expire identity map to always build entities again.
+            total = timed(lambda: (func(rows), db.session.expunge_all()), repeat=10)
+            print("{0:<7}: {1:8.2f} ms for {2} rows, {3:6.2f} us per row".format(
+                label, total, rows, total * 1000 / rows))
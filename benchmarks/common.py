@@ -0,0 +1,73 @@
+# -*- coding:Utf8 -*-
+
+"""
+    Shared helpers for benchmarks.
+    Benchmarks run against their own database (`BENCH_DATABASE_URL`, sqlite
+    file by default) to never touch the development one.
+    Run them from the repository root: python -m benchmarks.<name>
+"""
+
+import datetime
+import os
+import random
+import time
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+
+os.environ.setdefault('APP_SETTINGS', 'project._config.BaseConfig')
+os.environ['DATABASE_URL'] = os.environ.get(
+    'BENCH_DATABASE_URL', 'sqlite:///' + os.path.join(basedir, 'bench.db'))
+
+from project import app, db  # noqa
+from project.models import Task, User  # noqa
+
+
+########################
+#    Main Program :    #
+########################
+
+
+def seed_tasks(count, users=100, chunk=10000):
+    """
+        Fill database with `count` random tasks spread over `users` users.
+        Nothing is done if the tasks table already holds enough rows.
+    """
+    db.create_all()
+    existing = db.session.query(db.func.count(Task.task_id)).scalar()
+    if existing >= count:
+        return existing
+    if not db.session.query(User).count():
+        db.session.execute(User.__table__.insert(), [
+            {'name': 'bench{0}'.format(i), 'email': 'bench{0}@bench.fr'.format(i),
+             'password': 'not a hash', 'role': 'user'} for i in range(users)])
+    user_ids = [row[0] for row in db.session.query(User.user_id)]
+    rand = random.Random(42)
+    start = datetime.date(2015, 1, 1)
+    today = datetime.date.today()
+    insert = Task.__table__.insert()
+    for first in range(existing, count, chunk):
+        rows = []
+        for _ in range(first, min(first + chunk, count)):
+            rows.append({'name': 'Benchmark task {0}'.format(rand.random()),
+                         'due_date': start + datetime.timedelta(rand.randint(0, 3650)),
+                         'priority': rand.randint(1, 10),
+                         'posted_date': today,
+                         'status': 1 if rand.random() < 0.1 else 0,
+                         'user_id': rand.choice(user_ids)})
+        # One executemany per chunk keeps seeding fast.
+        db.session.execute(insert, rows)
+        db.session.commit()
+    return count
+
+
+def timed(func, repeat=5):
+    """
+        Return best wall time in milliseconds of `repeat` calls to func.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = (time.time() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
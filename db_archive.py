@@ -0,0 +1,22 @@
+# -*- coding:Utf8 -*-
+
+
+import datetime
+import sys
+
+from project import app
+from project.tasks.queries import archive_closed_tasks
+
+########################
+#    Main Program :    #
+########################
+
+
+# Move tasks closed for a long time into tasks_archive. Run it from cron.
+# Usage: python db_archive.py [days]
+if __name__ == '__main__':
+    days = int(sys.argv[1]) if len(sys.argv) > 1 \
+        else app.config['TASKS_ARCHIVE_AFTER_DAYS']
+    before = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    archived = archive_closed_tasks(before, app.config['TASKS_ARCHIVE_BATCH'])
+    print("{0} tasks archived.".format(archived))
@@ -1,7 +1,7 @@
 # -*- coding:Utf8 -*-
 
 
-from project import db, bcrypt
+from project import db, passwords
 from project.models import User
 
 ########################
@@ -15,7 +15,7 @@ if __name__ == '__main__':
 
     # Add administrateur user
     new_user = User(name="administrateur", email="admin@monMail.com",
-                    password=bcrypt.generate_password_hash("administrateur"),
+                    password=passwords.hash("administrateur"),
                     role="admin")
     db.session.add(new_user)
 
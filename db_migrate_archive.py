@@ -0,0 +1,29 @@
+# -*- coding:Utf8 -*-
+
+
+from project import db
+from project.models import (TaskArchive, postgresql_change_triggers,
+                            postgresql_stats_triggers, replace_triggers,
+                            sqlite_change_triggers, sqlite_stats_triggers)
+
+########################
+#    Main Program :    #
+########################
+
+
+# Add tasks_archive to an existing database, then replace tasks triggers
+# with the ones telling archived tasks from deleted ones.
+if __name__ == '__main__':
+    TaskArchive.__table__.create(db.engine, checkfirst=True)
+    with db.engine.begin() as connection:
+        if db.engine.dialect.name == 'postgresql':
+            # Replacing trigger functions is enough.
+            replace_triggers(connection, [
+                trigger for trigger in postgresql_change_triggers + [
+                    trigger for _, trigger in postgresql_stats_triggers]
+                if 'FUNCTION' in trigger.statement])
+        else:
+            replace_triggers(connection, [
+                trigger for trigger in sqlite_change_triggers + [
+                    trigger for _, trigger in sqlite_stats_triggers]
+                if 'AFTER DELETE' in trigger.statement])
@@ -0,0 +1,52 @@
+# -*- coding:Utf8 -*-
+
+
+from sqlalchemy.schema import CreateTable
+
+from project import db
+from project.models import (Task, TaskArchive, sqlite_change_triggers,
+                            sqlite_search_ddl, sqlite_stats_triggers)
+
+########################
+#    Main Program :    #
+########################
+
+
+# Rebuild an existing SQLite tasks table with AUTOINCREMENT ids, so ids of
+# deleted or archived tasks are never given to new tasks. SQLite can not
+# alter a primary key: tasks are copied into a new table, then its indexes
+# and triggers are created again. PostgreSQL sequences never reuse ids.
+if __name__ == '__main__':
+    if db.engine.dialect.name != 'sqlite':
+        print("Nothing to do: ids are only reused on SQLite.")
+    else:
+        # Read by tasks triggers and below.
+        TaskArchive.__table__.create(db.engine, checkfirst=True)
+        tasks = Task.__table__
+        columns = ', '.join(column.name for column in tasks.c)
+        with db.engine.begin() as connection:
+            connection.execute(str(CreateTable(tasks).compile(
+                dialect=db.engine.dialect)).replace(
+                'CREATE TABLE tasks ', 'CREATE TABLE tasks_autoincrement ', 1))
+            connection.execute(
+                "INSERT INTO tasks_autoincrement ({0}) SELECT {0} FROM tasks"
+                .format(columns))
+            # Drops indexes and triggers of tasks too.
+            connection.execute("DROP TABLE tasks")
+            connection.execute(
+                "ALTER TABLE tasks_autoincrement RENAME TO tasks")
+            for index in tasks.indexes:
+                index.create(connection)
+            for trigger in sqlite_change_triggers + sqlite_search_ddl + [
+                    trigger for table, trigger in sqlite_stats_triggers
+                    if table is tasks]:
+                connection.execute(trigger)
+            connection.execute(
+                "INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')")
+            # Ids of archived tasks are taken too.
+            connection.execute(
+                "DELETE FROM sqlite_sequence WHERE name = 'tasks'")
+            connection.execute(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT 'tasks', "
+                "max(coalesce((SELECT max(task_id) FROM tasks), 0), "
+                "coalesce((SELECT max(task_id) FROM tasks_archive), 0))")
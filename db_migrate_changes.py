@@ -0,0 +1,24 @@
+# -*- coding:Utf8 -*-
+
+
+from project import db
+from project.models import (TaskArchive, TaskChange,
+                            postgresql_change_triggers, replace_triggers,
+                            sqlite_change_triggers)
+
+########################
+#    Main Program :    #
+########################
+
+
+# Add task_changes log and its triggers to an existing tasks table.
+# The delete trigger reads tasks_archive: it is created if missing.
+if __name__ == '__main__':
+    TaskArchive.__table__.create(db.engine, checkfirst=True)
+    TaskChange.__table__.create(db.engine, checkfirst=True)
+    if db.engine.dialect.name == 'postgresql':
+        triggers = postgresql_change_triggers
+    else:
+        triggers = sqlite_change_triggers
+    with db.engine.begin() as connection:
+        replace_triggers(connection, triggers)
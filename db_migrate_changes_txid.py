@@ -0,0 +1,35 @@
+# -*- coding:Utf8 -*-
+
+
+from sqlalchemy import inspect
+
+from project import db
+from project.models import TaskChange, postgresql_change_triggers
+
+########################
+#    Main Program :    #
+########################
+
+
+# Add transaction ids to an existing task_changes log. Entries logged
+# before get txid 0: they are all settled. A log created from the current
+# model (db_migrate_changes.py) already has them: only the trigger function
+# is replaced.
+if __name__ == '__main__':
+    inspector = inspect(db.engine)
+    columns = [column['name']
+               for column in inspector.get_columns('task_changes')]
+    indexes = [index['name']
+               for index in inspector.get_indexes('task_changes')]
+    with db.engine.begin() as connection:
+        if 'txid' not in columns:
+            connection.execute(
+                "ALTER TABLE task_changes ADD COLUMN txid BIGINT")
+            if db.engine.dialect.name == 'postgresql':
+                connection.execute("UPDATE task_changes SET txid = 0")
+        if db.engine.dialect.name == 'postgresql':
+            # Replace trigger function only: trigger itself is unchanged.
+            connection.execute(postgresql_change_triggers[0])
+    for index in TaskChange.__table__.indexes:
+        if index.name not in indexes:
+            index.create(db.engine)
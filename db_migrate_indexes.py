@@ -0,0 +1,33 @@
+# -*- coding:Utf8 -*-
+
+
+from project import db
+from project.models import Task
+
+########################
+#    Main Program :    #
+########################
+
+
+def create_indexes(engine, table=Task.__table__):
+    """
+        Build indexes declared on table which do not exist yet.
+        On PostgreSQL they are built CONCURRENTLY: writes are not blocked
+        while they are built, but it can not run inside a transaction.
+    """
+    concurrently = engine.dialect.name == 'postgresql'
+    connection = engine.connect()
+    if concurrently:
+        connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+    try:
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            connection.execute("CREATE INDEX {0}IF NOT EXISTS {1} ON {2} ({3})".format(
+                'CONCURRENTLY ' if concurrently else '', index.name, table.name,
+                ', '.join(column.name for column in index.columns)))
+    finally:
+        connection.close()
+
+
+# Add tasks indexes to an existing database.
+if __name__ == '__main__':
+    create_indexes(db.engine)
@@ -0,0 +1,29 @@
+# -*- coding:Utf8 -*-
+
+
+from project import db
+from project.models import replace_triggers, sqlite_search_ddl
+
+########################
+#    Main Program :    #
+########################
+
+
+# Add the full-text index of task names to an existing tasks table.
+if __name__ == '__main__':
+    if db.engine.dialect.name == 'postgresql':
+        # Built CONCURRENTLY: writes go on while existing names are indexed.
+        connection = db.engine.connect().execution_options(
+            isolation_level='AUTOCOMMIT')
+        try:
+            connection.execute(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tasks_name_fts "
+                "ON tasks USING gin (to_tsvector('simple', name))")
+        finally:
+            connection.close()
+    else:
+        with db.engine.begin() as connection:
+            replace_triggers(connection, sqlite_search_ddl)
+            # Index names of tasks written before the triggers existed.
+            connection.execute(
+                "INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')")
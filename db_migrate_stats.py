@@ -0,0 +1,28 @@
+# -*- coding:Utf8 -*-
+
+
+from project import db
+from project.models import (TaskArchive, UserTaskStats,
+                            postgresql_stats_triggers, replace_triggers,
+                            sqlite_stats_triggers)
+from project.tasks.queries import rebuild_task_stats
+
+########################
+#    Main Program :    #
+########################
+
+
+# Add user_task_stats counters and their triggers to an existing database,
+# then fill counters from existing tasks. Triggers and counters read
+# tasks_archive: it is created if missing.
+if __name__ == '__main__':
+    TaskArchive.__table__.create(db.engine, checkfirst=True)
+    UserTaskStats.__table__.create(db.engine, checkfirst=True)
+    if db.engine.dialect.name == 'postgresql':
+        triggers = postgresql_stats_triggers
+    else:
+        triggers = sqlite_stats_triggers
+    with db.engine.begin() as connection:
+        replace_triggers(connection, [trigger for _, trigger in triggers])
+    rebuild_task_stats()
+    db.session.commit()
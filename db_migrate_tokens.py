@@ -0,0 +1,15 @@
+# -*- coding:Utf8 -*-
+
+
+from project import db
+
+########################
+#    Main Program :    #
+########################
+
+
+# Add api tokens generation counter to an existing users table.
+if __name__ == '__main__':
+    with db.engine.begin() as connection:
+        connection.execute("""ALTER TABLE users
+                           ADD COLUMN token_generation INTEGER NOT NULL DEFAULT 0""")
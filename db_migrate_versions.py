@@ -0,0 +1,21 @@
+# -*- coding:Utf8 -*-
+
+
+from project import db
+from project.models import Task
+
+########################
+#    Main Program :    #
+########################
+
+
+# Add version columns to an existing tasks table (api ETags and Last-Modified).
+# The collection version is read from task_changes (db_migrate_changes.py).
+if __name__ == '__main__':
+    with db.engine.begin() as connection:
+        connection.execute("""ALTER TABLE tasks
+                           ADD COLUMN version INTEGER NOT NULL DEFAULT 1""")
+        connection.execute("""ALTER TABLE tasks ADD COLUMN updated_at TIMESTAMP""")
+        # Existing tasks were last modified at the migration time at least.
+        connection.execute(Task.__table__.update().values(
+            updated_at=db.func.current_timestamp(), version=1))
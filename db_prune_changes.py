@@ -0,0 +1,22 @@
+# -*- coding:Utf8 -*-
+
+
+import datetime
+import sys
+
+from project import app
+from project.tasks.queries import prune_task_changes
+
+########################
+#    Main Program :    #
+########################
+
+
+# Delete old entries of the task changes log. Run it from cron.
+# Usage: python db_prune_changes.py [days]
+if __name__ == '__main__':
+    days = int(sys.argv[1]) if len(sys.argv) > 1 \
+        else app.config['TASK_CHANGES_RETENTION_DAYS']
+    before = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    pruned = prune_task_changes(before)
+    print("{0} task changes pruned.".format(pruned))
@@ -0,0 +1,16 @@
+# -*- coding:Utf8 -*-
+
+
+from project import db
+from project.tasks.queries import rebuild_task_stats
+
+########################
+#    Main Program :    #
+########################
+
+
+# Rebuild users open and closed tasks counters from the tasks table, in case
+# they drifted (tasks changed while triggers were missing, manual fixes...).
+if __name__ == '__main__':
+    rebuild_task_stats()
+    db.session.commit()
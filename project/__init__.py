@@ -1,19 +1,45 @@
 # -*- coding:Utf8 -*-
 
-from flask import Flask, render_template, request
-from flask.ext.sqlalchemy import SQLAlchemy
+from flask import Flask, render_template
 from flask.ext.bcrypt import Bcrypt
 
 # Api with library
 from flask_restful import Api
 
-import datetime
 import os
 
 app = Flask(__name__)
 bcrypt = Bcrypt(app)
 app.config.from_object(os.environ['APP_SETTINGS'])
-db = SQLAlchemy(app)
+
+# Reads of read-only requests go to the replica, if any
+from project.routing import RoutingSQLAlchemy
+db = RoutingSQLAlchemy(app)
+
+# Failed requests logged from a background thread
+from project.errorlog import ErrorLog
+errors = ErrorLog(app)
+
+# Latency, status and in flight requests exposed on /metrics
+from project.metrics import RequestMetrics
+metrics = RequestMetrics(app)
+
+# Statements of each request counted and timed, if turned on
+from project.profiler import SQLProfiler
+profiler = SQLProfiler(app)
+
+# Bcrypt calls run inside a bounded pool, whose load is exposed on /metrics
+from project.passwords import PasswordService
+passwords = PasswordService(app, bcrypt)
+passwords.register_metrics(metrics)
+
+# Rendered task tables shared between page views
+from project.fragments import FragmentCache
+fragments = FragmentCache(app)
+
+# Task changes pushed to open pages
+from project.live import ChangeBroadcaster
+live = ChangeBroadcaster(app)
 
 from project.users.views import users_blueprint
 from project.tasks.views import tasks_blueprint
@@ -26,23 +52,27 @@ from project.tasks.views import tasks_blueprint
 app.register_blueprint(users_blueprint)
 app.register_blueprint(tasks_blueprint)
 
-from project.api.views import ApiTasks, ApiTaskId
+from project.api.views import (ApiPoolStats, ApiTasks, ApiTasksBulk,
+                               ApiTasksChanges, ApiTasksExport, ApiTasksSearch,
+                               ApiTaskId, ApiTokens)
 
 # Add api
 api = Api(app)
 api.add_resource(ApiTasks, '/api/v1/tasks/', endpoint='tasks')
+api.add_resource(ApiTasksBulk, '/api/v1/tasks/bulk', endpoint='tasks_bulk')
+api.add_resource(ApiTasksChanges, '/api/v1/tasks/changes', endpoint='tasks_changes')
+api.add_resource(ApiTasksSearch, '/api/v1/tasks/search', endpoint='tasks_search')
+api.add_resource(ApiTasksExport, '/api/v1/tasks/export', endpoint='tasks_export')
 api.add_resource(ApiTaskId, '/api/v1/tasks/<int:task_id>', endpoint='task')
+api.add_resource(ApiTokens, '/api/v1/tokens', endpoint='tokens')
+api.add_resource(ApiPoolStats, '/api/v1/internal/pools', endpoint='internal_pools')
 
 
 # Add error handler
 @app.errorhandler(404)
 def page_not_found(error):
     if not app.debug:
-        now = datetime.datetime.now()
-        r = request.url
-        with open('error.log', 'a') as f:
-            current_timestamp = now.strftime("%d-%m-%Y %H:%M:%S")
-            f.write("\n404 error at {}: {}".format(current_timestamp, r))
+        errors.log_request(404)
     return render_template('404.html'), 404
 
 
@@ -50,9 +80,5 @@ def page_not_found(error):
 def internal_error(error):
     db.session.rollback()
     if not app.debug:
-        now = datetime.datetime.now()
-        r = request.url
-        with open('error.log', 'a') as f:
-            current_timestamp = now.strftime("%d-%m-%Y %H:%M:%S")
-            f.write("\n500 error at {}: {}".format(current_timestamp, r))
+        errors.log_request(500, error)
     return render_template('500.html'), 500
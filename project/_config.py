@@ -20,6 +20,88 @@ class BaseConfig(object):
     WTF_CSRF_ENABLED = True
     SQLALCHEMY_DATABASE_URI = os.environ['DATABASE_URL']
     print(SQLALCHEMY_DATABASE_URI)
+    # Read replica: read-only requests read from it, if set. A client which
+    # wrote reads from the primary for this many seconds (replication lag).
+    SQLALCHEMY_REPLICA_URI = os.environ.get('DATABASE_REPLICA_URL')
+    SQLALCHEMY_REPLICA_STICKY = 10
+    # Connection pools of primary and replica: connections kept open,
+    # extra ones allowed under load, seconds to wait for one and seconds
+    # before one is replaced. None keeps the driver default (SQLite files
+    # open one connection per checkout).
+    SQLALCHEMY_POOL_SIZE = None
+    SQLALCHEMY_MAX_OVERFLOW = None
+    SQLALCHEMY_POOL_TIMEOUT = None
+    SQLALCHEMY_POOL_RECYCLE = None
+    # Test connections when checked out, replacing the ones the database
+    # closed (restart, idle timeout) instead of failing the request.
+    SQLALCHEMY_POOL_PRE_PING = True
+    # Error log of 404 and 500 answers, written as JSON lines by a
+    # background thread: file (nothing logged if None), size in bytes and
+    # age in seconds at which it is rotated, rotated files kept, lines
+    # written at once and lines waiting before new ones are dropped.
+    ERROR_LOG = 'error.log'
+    ERROR_LOG_MAX_BYTES = 10 * 1024 * 1024
+    ERROR_LOG_ROTATE_SECONDS = 24 * 3600
+    ERROR_LOG_BACKUPS = 5
+    ERROR_LOG_BATCH = 100
+    ERROR_LOG_QUEUE_SIZE = 10000
+    # Request metrics (/metrics): directory where gunicorn workers share
+    # their metrics (per process if unset), seconds between two writes of a
+    # worker and latency buckets in seconds.
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = 5
+    METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75,
+                       1.0, 2.5, 5.0, 7.5, 10.0)
+    # SQL profiler: count and time statements of each request (sent inside
+    # a Server-Timing header), log statement shapes run this many times by
+    # one request (likely N+1) and statements slower than this many ms,
+    # into this file if set.
+    SQL_PROFILER = False
+    SQL_PROFILER_REPEATED = 5
+    SQL_PROFILER_SLOW_MS = 100
+    SQL_SLOW_QUERY_LOG = None
+    # Tasks page: number of open or closed tasks shown per page.
+    TASKS_PER_PAGE = 50
+    # Archive job: closed tasks unchanged for this many days move to
+    # tasks_archive, by batches of this many tasks.
+    TASKS_ARCHIVE_AFTER_DAYS = 30
+    TASKS_ARCHIVE_BATCH = 1000
+    # Prune job: task changes logged more than this many days ago are
+    # deleted, sync clients with an older cursor read tasks again.
+    TASK_CHANGES_RETENTION_DAYS = 30
+    # Tasks page: rendered tables kept in process, or inside redis if a
+    # host is given (shared by all workers).
+    FRAGMENT_CACHE_SIZE = 256
+    FRAGMENT_CACHE_TIMEOUT = 300
+    FRAGMENT_CACHE_REDIS_HOST = None
+    # Tasks page live feed: off by default, a stream holds its worker (turn
+    # it on with threaded or gevent gunicorn workers). Seconds between two
+    # reads of the change log, between two keepalives and before a stream
+    # is closed (below gunicorn worker timeout, 30 seconds by default), and
+    # changes queued for a slow client before it is dropped.
+    LIVE_FEED = False
+    LIVE_FEED_POLL_INTERVAL = 2
+    LIVE_FEED_KEEPALIVE = 10
+    LIVE_FEED_TIMEOUT = 20
+    LIVE_FEED_BACKLOG = 100
+    # Api pagination: default and maximum number of tasks per page.
+    API_TASKS_PER_PAGE = 20
+    API_TASKS_MAX_PER_PAGE = 100
+    # Api bulk creation: maximum number of tasks per demand.
+    API_TASKS_MAX_BULK = 1000
+    # Api export: number of rows fetched and sent at once.
+    API_EXPORT_CHUNK = 1000
+    # Api tokens: lifetime in seconds.
+    API_TOKEN_EXPIRATION = 3600
+    # Api changes feed: longest long poll wait in seconds. A waiting
+    # request holds its worker: keep it well below gunicorn worker timeout
+    # (30 seconds by default).
+    API_CHANGES_MAX_WAIT = 10
+    # Passwords: bcrypt cost factor, hashes computed at the same time and
+    # demands allowed to wait before answering 503.
+    BCRYPT_LOG_ROUNDS = 12
+    PASSWORD_HASH_WORKERS = 2
+    PASSWORD_HASH_MAX_QUEUE = 8
 
 
 class TestConfig(BaseConfig):
@@ -27,6 +109,8 @@ class TestConfig(BaseConfig):
     TESTING = True
     WTF_CSRF_ENABLED = False
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, TEST_DB)
+    SQLALCHEMY_REPLICA_URI = None
+    METRICS_DIR = None
 
 
 class DevelopmentConfig(BaseConfig):
@@ -0,0 +1,148 @@
+# -*- coding:Utf8 -*-
+# project/api/schemas.py
+
+
+"""
+    Request validation for the task api.
+    Schemas are declared once at import time, unlike a RequestParser which
+    flask_restful resources would build again for every request.
+    They validate JSON bodies, form data and plain dicts (bulk items) alike.
+"""
+
+import datetime
+
+from flask import request
+from flask_restful import abort
+
+
+MISSING = u"Missing required parameter in the JSON body or the post body or the query string"
+
+
+# Converters: return the python value or raise ValueError with the message
+# sent back to the client.
+def text(value):
+    if not isinstance(value, (type(u''), type(''))):
+        raise ValueError(u"error: Must be a string.")
+    return value
+
+
+def task_name(value):
+    if not isinstance(value, (type(u''), type(''))) or not value.strip():
+        raise ValueError(u"error: A task need a task name.")
+    return value
+
+
+def day(value):
+    try:
+        return datetime.datetime.strptime(value, '%d/%m/%Y').date()
+    except (TypeError, ValueError):
+        raise ValueError(u"error: Use this format: DD/MM/YYYY")
+
+
+def integer_between(low, high, message):
+    """
+        Build a converter accepting integers (or their string form) between
+        low and high included.
+    """
+    def convert(value):
+        try:
+            if isinstance(value, bool) or isinstance(value, float):
+                raise ValueError(value)
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(message)
+        if value < low or value > high:
+            raise ValueError(message)
+        return value
+    return convert
+
+
+priority = integer_between(1, 10, u"error: priority must be between 1 and 10 included")
+status = integer_between(0, 1, u"error: status must be 0 (closed) or 1 (open)")
+
+
+class Field(object):
+
+    """
+        One declared field: its name, converter and if it is required.
+        help is put before the error message, like reqparse does.
+    """
+
+    def __init__(self, name, convert=text, required=False, help=None):
+        self.name = name
+        self.convert = convert
+        self.required = required
+        self.help = help
+
+    def error(self, message):
+        if self.help:
+            return u"({0}) {1}".format(self.help, message)
+        return message
+
+
+class Schema(object):
+
+    """
+        Set of fields validated together.
+    """
+
+    def __init__(self, *fields):
+        self.fields = fields
+        self.names = frozenset(field.name for field in fields)
+
+    def load(self, data, allow_unknown=True):
+        """
+            Validate a mapping.
+            Return (values, errors): values only holds fields found inside
+            data, errors maps field names to their message.
+        """
+        values, errors = {}, {}
+        if not allow_unknown:
+            for name in set(data) - self.names:
+                errors[name] = u"error: Field `{0}` can not be updated.".format(name)
+        for field in self.fields:
+            value = data.get(field.name)
+            if value is None:
+                if field.required:
+                    errors[field.name] = field.error(MISSING)
+                continue
+            try:
+                values[field.name] = field.convert(value)
+            except ValueError as error:
+                errors[field.name] = field.error(error.args[0])
+        return values, errors
+
+    def parse(self):
+        """
+            Validate current request JSON body, or its form data and query
+            string if body is not a JSON object.
+            Abort api demand with all errors found.
+        """
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            data = request.values
+        values, errors = self.load(data)
+        if errors:
+            abort(400, message=errors)
+        return values
+
+
+# Schemas used by the task api.
+task_item_schema = Schema(
+    Field('name', task_name, required=True),
+    Field('due_date', day, required=True, help='Use this format: DD/MM/YYYY'),
+    Field('priority', priority, required=True))
+
+# Credentials are only required without api token.
+task_create_schema = Schema(
+    *task_item_schema.fields + (Field('user_name'), Field('password')))
+
+credentials_schema = Schema(
+    Field('user_name', required=True),
+    Field('password', required=True))
+
+task_update_schema = Schema(
+    Field('name', task_name),
+    Field('due_date', day, help='Use this format: DD/MM/YYYY'),
+    Field('priority', priority),
+    Field('status', status))
@@ -0,0 +1,128 @@
+# -*- coding:Utf8 -*-
+# project/api/serializers.py
+
+
+"""
+    Shared serializer for tasks sent by the api.
+    A FieldPlan is computed once per set of fields: columns to select, output
+    keys and encoders. Rows are then serialized straight from column tuples,
+    without building any Task entity.
+    ujson is used to encode big responses if installed.
+"""
+
+import datetime
+import json
+
+from flask import current_app
+from sqlalchemy import Date, DateTime
+
+from project.models import Task
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def dumps(data):
+    """
+        Encode data as compact JSON with the fastest encoder available.
+    """
+    if ujson is not None:
+        return ujson.dumps(data)
+    return json.dumps(data, separators=(',', ':'))
+
+
+def json_response(data, code=200, headers=None):
+    """
+        Build a JSON response by hand, skipping flask_restful encoding.
+    """
+    response = current_app.response_class(dumps(data), status=code,
+                                          mimetype='application/json')
+    for key, value in (headers or {}).items():
+        response.headers[key] = value
+    return response
+
+
+class FieldPlan(object):
+
+    """
+        Precomputed plan to serialize tasks fields.
+        Rows must start with plan columns, in plan order. Extra trailing
+        columns (like keyset ones) are ignored.
+    """
+
+    def __init__(self, fields, labels=None):
+        self.fields = tuple(fields)
+        self.keys = tuple(labels[name] if labels else name for name in fields)
+        self.columns = [getattr(Task, name) for name in fields]
+        # Positions and encoders of date columns, sent as ISO strings.
+        self.dates = []
+        for index, name in enumerate(fields):
+            column_type = Task.__table__.c[name].type
+            if isinstance(column_type, DateTime):
+                self.dates.append((index, encode_datetime))
+            elif isinstance(column_type, Date):
+                self.dates.append((index, encode_date))
+
+    def rows(self, rows):
+        """
+            Serialize column tuples. A date shared by many rows is encoded once.
+        """
+        keys, dates, size = self.keys, self.dates, len(self.keys)
+        encoded = dict((index, {None: None}) for index, _ in dates)
+        results = []
+        for row in rows:
+            values = list(row[:size])
+            for index, encode in dates:
+                value, cache = values[index], encoded[index]
+                if value not in cache:
+                    cache[value] = encode(value)
+                values[index] = cache[value]
+            results.append(dict(zip(keys, values)))
+        return results
+
+    def row(self, row):
+        return self.rows((row,))[0]
+
+    def mappings(self, tasks):
+        """
+            Serialize dicts or database rows holding at least plan fields.
+        """
+        return self.rows([[task[name] for name in self.fields] for task in tasks])
+
+    def mapping(self, task):
+        """
+            Serialize one dict or database row. A missing task gives null fields.
+        """
+        if task is None:
+            return dict.fromkeys(self.keys)
+        return self.mappings((task,))[0]
+
+
+def encode_date(value):
+    """
+        Encode date as ISO string. Datetimes stored in Date columns keep
+        their date part only.
+    """
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    return value.isoformat()
+
+
+def encode_datetime(value):
+    return value.isoformat()
+
+
+# Plans computed once.
+_plans = {}
+
+
+def plan_for(fields, labels=None):
+    """
+        Return the plan for fields, computed on first demand only.
+    """
+    key = (tuple(fields), tuple(sorted(labels.items())) if labels else None)
+    if key not in _plans:
+        _plans[key] = FieldPlan(fields, labels)
+    return _plans[key]
@@ -0,0 +1,53 @@
+# -*- coding:Utf8 -*-
+# project/api/tokens.py
+
+
+"""
+    Signed and expiring api tokens.
+    Credentials are checked (slow bcrypt) once to issue a token, then the
+    token signature is checked in microseconds on every demand.
+    A token holds the user token generation: bumping it revokes all tokens
+    of the user.
+"""
+
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from project import db
+from project.models import User
+
+
+def serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'],
+                                  salt='api-token')
+
+
+def issue_token(user):
+    """
+        Return a new token for user.
+    """
+    return serializer().dumps({'id': user.user_id, 'gen': user.token_generation})
+
+
+def user_from_token(token):
+    """
+        Return user owning token, None if token is forged, expired or revoked.
+    """
+    try:
+        data = serializer().loads(token,
+                                  max_age=current_app.config['API_TOKEN_EXPIRATION'])
+    except BadSignature:
+        return None
+    user = db.session.query(User).get(data['id'])
+    if user is None or user.token_generation != data['gen']:
+        return None
+    return user
+
+
+def revoke_tokens(user):
+    """
+        Revoke all tokens issued to user. Nothing is committed.
+    """
+    db.session.query(User).filter_by(user_id=user.user_id).update(
+        {'token_generation': User.token_generation + 1},
+        synchronize_session=False)
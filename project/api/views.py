@@ -3,27 +3,51 @@
 
 
 from functools import wraps
+import base64
 import datetime
+import hashlib
+import json
 
 # Api by hands using blueprint.
 # from flask import flash, redirect, jsonify, session, url_for, Blueprint, make_response
 
 # Api using flask_restful
-from flask import session
-from flask_restful import Resource, reqparse, abort, fields, marshal
-
-from project import db, bcrypt
-from project.models import Task, User
-
-
-# Return only defined field inside this dict using marshal and fields modules.
-task_fields = {
-    'name': fields.String,
-    'posted_date': fields.String,
-    'due_date': fields.String,
-    'priority': fields.Integer,
-    'status': fields.Integer
-}
+from flask import current_app, request, session, stream_with_context, url_for
+from flask_restful import Resource, abort
+from sqlalchemy import or_
+from werkzeug.http import http_date, quote_etag
+
+from project import db, live, passwords
+from project.api.schemas import (credentials_schema, task_create_schema,
+                                 task_item_schema, task_update_schema)
+from project.api.serializers import dumps, json_response, plan_for
+from project.api.tokens import issue_token, revoke_tokens, user_from_token
+from project.models import Task, TaskArchive, User
+from project.tasks.queries import (bump_tasks_version, change_expired,
+                                   changes_since, delete_task, delete_tasks,
+                                   insert_tasks, search_tasks, search_words,
+                                   tasks_history, tasks_version, update_task,
+                                   update_tasks)
+
+
+# Columns sent by tasks export, in this order.
+export_columns = ('task_id', 'name', 'due_date', 'priority', 'posted_date',
+                  'status', 'user_id')
+
+# Labels of tasks collection fields.
+collection_labels = {'task_id': 'task_id',
+                     'name': 'task name',
+                     'due_date': 'due date',
+                     'priority': 'priority',
+                     'posted_date': 'posted date',
+                     'status': 'status',
+                     'user_id': 'user id'}
+
+# Sort keys accepted by tasks collection, all backed by an index.
+sort_columns = frozenset(['due_date', 'task_id'])
+
+# Fields sent for a single task, in this order.
+task_fields = ('name', 'posted_date', 'due_date', 'priority', 'status')
 
 
 # Tools
@@ -41,11 +65,11 @@ def login_required(test):
     return wrapper
 
 
-def abort_if_task_doesnt_exist(task_id, task):
+def abort_if_task_doesnt_exist(task):
     """
         Abort api demand if task_id does not exist.
     """
-    if not task or task_id != task.task_id:
+    if task is None:
         abort(404, message="error: Element does not exist")
 
 
@@ -54,25 +78,332 @@ def abort_if_user_doesnt_exist(user, password):
         Abort api demand if user name does not exist or if user name and
         password do not match an existing account.
     """
-    if user is None or not bcrypt.check_password_hash(user.password, password):
+    if user is None or not passwords.check(user.password, password):
         abort(401, message="error: User does not exist or user name and password do not match.")
 
 
-def abort_if_wrong_priority(priority):
+def bearer_token():
+    """
+        Return api token sent inside the Authorization header, if any.
+    """
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        return header[len('Bearer '):].strip()
+    return None
+
+
+def authenticate(user_name, password):
+    """
+        Return user sending the api demand: owner of the bearer token if
+        any, else user matching user_name and password (slow bcrypt check).
+        Abort api demand if they do not match an account.
+    """
+    token = bearer_token()
+    if token is not None:
+        user = user_from_token(token)
+        if user is None:
+            abort(401, message="error: Token is invalid, expired or revoked.")
+        return user
+    if user_name is None or password is None:
+        # Abort with missing credentials.
+        credentials_schema.parse()
+    user = db.session.query(User).filter_by(name=user_name).first()
+    abort_if_user_doesnt_exist(user, password)
+    return user
+
+
+def abort_if_write_failed(status):
+    """
+        Abort api demand if a conditional write did not match its task.
+    """
+    if status == 404:
+        abort(404, message="error: Element does not exist")
+    if status == 403:
+        abort(403, message="error: A user can only update or delete it own tasks.")
+
+
+def cache_headers(etag, last_modified):
+    """
+        Return validators headers of a response.
+    """
+    headers = {'ETag': quote_etag(etag)}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+
+def not_modified(etag, last_modified):
     """
-        Abort api demand if wrong priority number.
+        True if the copy cached by client is still fresh.
+        If-None-Match takes precedence over If-Modified-Since.
     """
-    if type(priority) != int or priority > 10 or priority < 1:
-        abort(400, message="error: priority must be between 1 and 10 included")
+    if 'If-None-Match' in request.headers:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified is not None:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
 
 
-def abort_if_wrong_user(user_id, task_user_id):
+def not_modified_response(headers):
     """
-        Abort api demand if wrong user ask access.
+        Empty 304 response: nothing is read nor serialized.
     """
-    if session['role'] != "admin":
-        if user_id != task_user_id:
-            abort(403, message="error: A user can only update or delete it own tasks.")
+    response = current_app.response_class(status=304)
+    for key, value in headers.items():
+        response.headers[key] = value
+    return response
+
+
+def task_etag(task_id, version, updated_at):
+    """
+        Version restarts at 1 for each task: the last write time tells apart
+        two tasks which had the same id (reused before ids were
+        AUTOINCREMENT on SQLite).
+    """
+    return 'task-{0}-{1}-{2}'.format(
+        task_id, version,
+        updated_at.strftime('%Y%m%d%H%M%S%f') if updated_at else 0)
+
+
+def encode_cursor(sort, value, task_id):
+    """
+        Build an opaque cursor pointing just after the (value, task_id) key
+        of a page sorted by `sort`.
+    """
+    if isinstance(value, datetime.date):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, task_id]).encode('utf-8')
+    # Padding is useless inside an url.
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort):
+    """
+        Return the (value, task_id) key hidden inside a cursor.
+        Abort api demand if cursor is not one of ours or was built for
+        another sort.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(str(cursor + '=' * (-len(cursor) % 4)))
+        cursor_sort, value, task_id = json.loads(raw.decode('utf-8'))
+        if cursor_sort != sort:
+            raise ValueError(cursor_sort)
+        if sort.lstrip('-') == 'due_date':
+            value = datetime.datetime.strptime(value, '%Y-%m-%d').date()
+        return value, int(task_id)
+    except (TypeError, ValueError):
+        abort(400, message="error: Invalid pagination cursor.")
+
+
+def page_limit(limit):
+    """
+        Return page size asked, capped to the server side maximum.
+        Abort api demand if limit is not a positive number.
+    """
+    if limit is None:
+        return current_app.config['API_TASKS_PER_PAGE']
+    if limit < 1:
+        abort(400, message="error: limit must be a positive number")
+    return min(limit, current_app.config['API_TASKS_MAX_PER_PAGE'])
+
+
+def sort_arg():
+    """
+        Return `sort` query string argument, `due_date` if not given.
+        Abort api demand if tasks can not be sorted on it using an index.
+    """
+    sort = request.args.get('sort', 'due_date')
+    if sort.lstrip('-') not in sort_columns:
+        abort(400, message="error: sort must be one of: {0} (prefix with - "
+                           "for descending order)".format(', '.join(sorted(sort_columns))))
+    return sort
+
+
+def fields_arg():
+    """
+        Return columns asked by `fields` query string argument, all if not given.
+        Abort api demand if an unknown field is asked.
+    """
+    fields_asked = request.args.get('fields')
+    if not fields_asked:
+        return list(export_columns)
+    fields_asked = fields_asked.split(',')
+    unknown = set(fields_asked) - set(export_columns)
+    if unknown:
+        abort(400, message="error: Unknown fields: {0}".format(', '.join(sorted(unknown))))
+    return [column for column in export_columns if column in fields_asked]
+
+
+def task_source():
+    """
+        Return entity to read tasks from: live tasks, or live and archived
+        tasks together if `history` query string argument is set.
+    """
+    return tasks_history() if int_arg('history') else Task
+
+
+def task_criteria(source=Task):
+    """
+        Return WHERE criteria asked by query string arguments: status,
+        user_id, priority_min, priority_max, due_after and due_before.
+    """
+    criteria = []
+    for column in ('status', 'user_id'):
+        value = int_arg(column)
+        if value is not None:
+            criteria.append(getattr(source, column) == value)
+    priority_min, priority_max = int_arg('priority_min'), int_arg('priority_max')
+    if priority_min is not None:
+        criteria.append(source.priority >= priority_min)
+    if priority_max is not None:
+        criteria.append(source.priority <= priority_max)
+    due_after, due_before = day_arg('due_after'), day_arg('due_before')
+    if due_after is not None:
+        criteria.append(source.due_date >= due_after)
+    if due_before is not None:
+        criteria.append(source.due_date <= due_before)
+    return criteria
+
+
+def tasks_page(limit, after=None, sort='due_date', criteria=(),
+               columns=export_columns, source=Task):
+    """
+        Query for one page of tasks columns ordered by (sort, task_id).
+        Seek directly after the `after` key instead of using OFFSET: each
+        page costs the same index range scan whatever its depth.
+        One extra row is fetched to know if a next page exists.
+        source is Task, or tasks_history() to read archived tasks too.
+    """
+    descending = sort.startswith('-')
+    key = sort.lstrip('-')
+    column = getattr(source, key)
+    order = [column] if key == 'task_id' else [column, source.task_id]
+    query = db.session.query(*[getattr(source, name) for name in columns]) \
+        .filter(*criteria) \
+        .order_by(*[col.desc() if descending else col.asc() for col in order])
+    if after is not None:
+        value, task_id = after
+        if key == 'task_id':
+            query = query.filter(source.task_id < task_id if descending
+                                 else source.task_id > task_id)
+        # First criterion is redundant but let any planner use the index.
+        elif descending:
+            query = query.filter(column <= value,
+                                 or_(column < value, source.task_id < task_id))
+        else:
+            query = query.filter(column >= value,
+                                 or_(column > value, source.task_id > task_id))
+    return query.limit(limit + 1)
+
+
+def bulk_task_ids(data):
+    """
+        Return task ids list of a bulk demand.
+        Abort api demand if ids are missing, malformed or too many.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('ids'), list):
+        abort(400, message="error: Send a JSON object holding an `ids` list.")
+    ids = data['ids']
+    if not ids or any(type(task_id) != int for task_id in ids):
+        abort(400, message="error: `ids` must be a non empty list of task ids.")
+    if len(ids) > current_app.config['API_TASKS_MAX_BULK']:
+        abort(400, message="error: Too many tasks, send at most {0} task ids.".format(
+            current_app.config['API_TASKS_MAX_BULK']))
+    return ids
+
+
+def rejected_tasks(ids, changed):
+    """
+        Tell why tasks of a bulk demand were left unchanged, using a single
+        query. Only run when some were.
+    """
+    changed = set(changed)
+    unchanged = [task_id for task_id in ids if task_id not in changed]
+    if not unchanged:
+        return []
+    existing = set(row.task_id for row in db.session.query(Task.task_id)
+                   .filter(Task.task_id.in_(unchanged)))
+    return [{'task_id': task_id,
+             'message': "error: A user can only update or delete it own tasks."
+             if task_id in existing else "error: Element does not exist"}
+            for task_id in unchanged]
+
+
+def int_arg(name):
+    """
+        Return integer query string argument or None if not given.
+        Abort api demand if argument is not an integer.
+    """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        abort(400, message="error: {0} must be an integer".format(name))
+
+
+def day_arg(name):
+    """
+        Return date query string argument (DD/MM/YYYY) or None if not given.
+        Abort api demand if argument is not a date.
+    """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return datetime.datetime.strptime(value, '%d/%m/%Y').date()
+    except ValueError:
+        abort(400, message="error: {0} must use this format: DD/MM/YYYY".format(name))
+
+
+def ndjson_lines(plan, rows):
+    return u''.join(dumps(task) + u'\n' for task in plan.rows(rows))
+
+
+def csv_lines(plan, rows):
+    """
+        Encode rows as CSV lines, quoting only fields which need it.
+    """
+    lines = []
+    for task in plan.rows(rows):
+        cells = []
+        for key in plan.keys:
+            value = task[key]
+            value = u'' if value is None else u'{0}'.format(value)
+            if any(char in value for char in u',"\r\n'):
+                value = u'"{0}"'.format(value.replace(u'"', u'""'))
+            cells.append(value)
+        lines.append(u','.join(cells) + u'\r\n')
+    return u''.join(lines)
+
+
+def task_changes(since, limit):
+    """
+        Return (changes, last change id read, True if more entries may
+        follow) for at most `limit` log entries after `since`.
+        Changes of a same task are merged into its last one, which holds the
+        current task (null for a deletion tombstone or an archived task).
+    """
+    log = changes_since(since, limit)
+    if not log:
+        return [], since, False
+    last = {}
+    for change_id, task_id, kind in log:
+        last.pop(task_id, None)
+        last[task_id] = (change_id, kind)
+    plan = plan_for(export_columns)
+    alive = [task_id for task_id, (_, kind) in last.items()
+             if kind not in ('deleted', 'archived')]
+    tasks = {}
+    if alive:
+        for row in db.session.query(*plan.columns).filter(Task.task_id.in_(alive)):
+            tasks[row.task_id] = plan.row(row)
+    changes = [{'change_id': change_id, 'task_id': task_id, 'change': kind,
+                'task': tasks.get(task_id)}
+               for task_id, (change_id, kind) in sorted(
+                   last.items(), key=lambda item: item[1][0])]
+    return changes, log[-1][0], len(log) == limit
 
 
 # Routes
@@ -84,69 +415,349 @@ class ApiTasks(Resource):
         Support for GET and POST.
     """
 
-    def __init__(self):
-        # Parser for add a new task.
-        self.parser = reqparse.RequestParser()
-        self.parser.add_argument('name', type=str, required=True,
-                                 help='A task need a task name.')
-        self.parser.add_argument('user_name', type=str, required=True)
-        self.parser.add_argument('password', type=str, required=True)
-        self.parser.add_argument('due_date', type=str, required=True,
-                                 help='Use this format: DD/MM/YYYY')
-        self.parser.add_argument('priority', type=int, required=True)
-        super(ApiTasks, self).__init__()
-
     def get(self):
-        results = db.session.query(Task).limit(20).offset(0).all()
-        json_results = []
-        for result in results:
-            data = {'task_id': result.task_id,
-                    'task name': result.name,
-                    'due date': str(result.due_date),
-                    'priority': result.priority,
-                    'posted date': str(result.posted_date),
-                    'status': result.status,
-                    'user id': result.user_id
-                    }
-            json_results.append(data)
-        # Call of jsonify() by flask_restful.
-        return json_results, 200
+        """
+            Add Rest operation: GET.
+            Paginated using `limit` and the opaque `cursor` given inside the
+            `Link` header of the previous page.
+            Filtered by status, user_id, priority_min, priority_max, due_after
+            and due_before, sorted by `sort` and restricted to `fields`: all
+            are part of the SQL query, only asked columns are read.
+            Archived tasks are included with `history=1`.
+        """
+        limit = page_limit(request.args.get('limit', type=int))
+        sort = sort_arg()
+        fields_asked = fields_arg()
+        source = task_source()
+        criteria = task_criteria(source)
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor, sort) if cursor else None
+        # Any write bumps the collection version: a page is fresh as long as
+        # version and query string are the same.
+        version, updated_at = tasks_version()
+        etag = 'tasks-{0}-{1}'.format(
+            version, hashlib.sha1(request.query_string).hexdigest()[:16])
+        headers = cache_headers(etag, updated_at)
+        if not_modified(etag, updated_at):
+            return not_modified_response(headers)
+        # Keyset columns are needed to build the next cursor.
+        plan = plan_for(fields_asked, collection_labels)
+        key = sort.lstrip('-')
+        columns = fields_asked + [column for column in (key, 'task_id')
+                                  if column not in fields_asked]
+        results = tasks_page(limit, after, sort, criteria, columns, source).all()
+        if len(results) > limit:
+            results = results[:limit]
+            last = results[-1]
+            args = request.args.to_dict()
+            args.update(limit=limit,
+                        cursor=encode_cursor(sort, getattr(last, key), last.task_id))
+            next_url = url_for('tasks', _external=True, **args)
+            headers['Link'] = '<{0}>; rel="next"'.format(next_url)
+        return json_response(plan.rows(results), 200, headers)
 
     def post(self):
         """
             Add Rest operation: POST.
             Implemented to allow posting whithout have to log in, but need to pass
-            password and user_name as arguments.
+            an api token (Authorization: Bearer <token>) or password and
+            user_name as arguments.
         """
-        # Recup arguments.
-        args = self.parser.parse_args()
-        # Recup user and password.
-        user = db.session.query(User).filter_by(name=args['user_name']).first()
-        password = args['password']
-        # Test if user and password match.
-        abort_if_user_doesnt_exist(user, password)
-        # Convert date to correct datetime.date type.
-        date = datetime.datetime.strptime(args['due_date'], '%d/%m/%Y')
-        # Check priority and avoid priority > 10 or smaller than 1.
-        priority = args["priority"]
-        abort_if_wrong_priority(priority)
+        # Recup arguments, already converted and checked.
+        args = task_create_schema.parse()
+        # Recup user from token or test if user and password match.
+        user = authenticate(args.get('user_name'), args.get('password'))
 
         # Create dict of parameters for Task creator.
         dict_task = {'name': args["name"],
-                     'due_date': date,
+                     'due_date': args['due_date'],
                      'posted_date': datetime.datetime.utcnow(),
-                     'priority': priority,
+                     'priority': args['priority'],
                      'status': 1,
                      'user_id': user.user_id
                      }
         # Create new task.
         new_task = Task(**dict_task)
         db.session.add(new_task)
+        bump_tasks_version()
         db.session.commit()
-        task = {data: dict_task[data] if "date" not in data
-                else str(dict_task[data]) for data in dict_task}
         # Display new task.
-        return {'Task created': marshal(task, task_fields)}, 201
+        return {'Task created': plan_for(task_fields).mapping(dict_task)}, 201
+
+
+class ApiTasksChanges(Resource):
+
+    """
+        Overload Api base class Resource.
+        Tasks created, updated or deleted after a cursor, for sync clients.
+        Support for GET.
+    """
+
+    def get(self):
+        """
+            Add Rest operation: GET.
+            `since` is the `cursor` of the previous answer (0 for the whole
+            log), `limit` caps log entries read. `more` tells if the next
+            page can be asked at once.
+            With `wait` (seconds), an empty answer is delayed until a change
+            is logged or wait expires (long polling).
+            A cursor older than the kept log answers 410: tasks must be read
+            again.
+        """
+        since = int_arg('since') or 0
+        if change_expired(since):
+            abort(410, message="error: since is older than the changes log, "
+                               "read tasks again.")
+        limit = page_limit(request.args.get('limit', type=int))
+        wait = min(int_arg('wait') or 0,
+                   current_app.config['API_CHANGES_MAX_WAIT'])
+        subscription = live.subscribe() if wait > 0 else None
+        try:
+            changes, cursor, more = task_changes(since, limit)
+            if not changes and subscription is not None:
+                # Give database connection back while waiting.
+                db.session.remove()
+                if subscription.get(wait) is not None:
+                    changes, cursor, more = task_changes(since, limit)
+        finally:
+            if subscription is not None:
+                live.unsubscribe(subscription)
+        return json_response({'changes': changes, 'cursor': cursor,
+                              'more': more}, 200)
+
+
+class ApiTasksSearch(Resource):
+
+    """
+        Overload Api base class Resource.
+        Full text search over task names.
+        Support for GET.
+    """
+
+    def get(self):
+        """
+            Add Rest operation: GET.
+            Tasks whose name holds every word of `q`, best ranked first.
+            Paginated using `limit` and `offset`, next page url is given
+            inside the `Link` header.
+        """
+        words = search_words(request.args.get('q', u''))
+        if not words:
+            abort(400, message="error: q must hold at least one word.")
+        limit = page_limit(request.args.get('limit', type=int))
+        offset = int_arg('offset') or 0
+        if offset < 0:
+            abort(400, message="error: offset must be a positive number")
+        plan = plan_for(export_columns, collection_labels)
+        results = search_tasks(words, *plan.columns) \
+            .limit(limit + 1).offset(offset).all()
+        headers = {}
+        if len(results) > limit:
+            results = results[:limit]
+            args = request.args.to_dict()
+            args.update(limit=limit, offset=offset + limit)
+            headers['Link'] = '<{0}>; rel="next"'.format(
+                url_for('tasks_search', _external=True, **args))
+        return json_response(plan.rows(results), 200, headers)
+
+
+class ApiTasksBulk(Resource):
+
+    """
+        Overload Api base class Resource.
+        Api on many tasks at once.
+        Support for POST, PUT and DELETE.
+    """
+
+    def post(self):
+        """
+            Add Rest operation: POST.
+            Create all tasks of a JSON body like
+            {"user_name": ..., "password": ..., "tasks": [{...}, ...]}
+            (credentials are useless with an api token)
+            inside a single transaction: user is checked once, every task is
+            validated, then all are inserted by one INSERT and one commit.
+            Nothing is created if any task is invalid.
+        """
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('tasks'), list):
+            abort(400, message="error: Send a JSON object holding a `tasks` list.")
+        items = data['tasks']
+        if not items:
+            abort(400, message="error: `tasks` must be a non empty list of tasks.")
+        if len(items) > current_app.config['API_TASKS_MAX_BULK']:
+            abort(400, message="error: Too many tasks, send at most {0} tasks.".format(
+                current_app.config['API_TASKS_MAX_BULK']))
+        # Recup user from token or test if user and password match, only once.
+        user = authenticate(data.get('user_name'), data.get('password'))
+        # Validate every task before touching the database.
+        posted_date = datetime.datetime.utcnow()
+        tasks, rejected = [], []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                rejected.append({'index': index,
+                                 'message': "error: A task must be a JSON object."})
+                continue
+            values, errors = task_item_schema.load(item)
+            if errors:
+                rejected.append({'index': index, 'message': errors})
+                continue
+            values.update({'posted_date': posted_date,
+                           'status': 1,
+                           'user_id': user.user_id})
+            tasks.append(values)
+        if rejected:
+            return {'message': "error: No task created, some tasks are invalid.",
+                    'Tasks rejected': rejected}, 400
+        for task, task_id in zip(tasks, insert_tasks(tasks)):
+            task['task_id'] = task_id
+        db.session.commit()
+        # Display new tasks with their ids in the order they were sent.
+        return {'Tasks created': plan_for(('task_id',) + task_fields).mappings(
+            tasks)}, 201
+
+    @login_required
+    def put(self):
+        """
+            Add Rest operation: PUT.
+            Apply the same fields on many tasks using a JSON body like
+            {"ids": [...], "patch": {"status": 0}}.
+            One UPDATE applies it to the tasks the logged user can change,
+            changed ids are the ones it matched.
+        """
+        data = request.get_json(silent=True)
+        ids = bulk_task_ids(data)
+        patch = data.get('patch')
+        if not isinstance(patch, dict) or not patch:
+            abort(400, message="error: Send a `patch` object with fields to update.")
+        values, errors = task_update_schema.load(patch, allow_unknown=False)
+        if errors:
+            abort(400, message=errors)
+        updated = update_tasks(ids, values, session['user_id'],
+                               session['role'] == "admin")
+        db.session.commit()
+        return {'Tasks updated': updated,
+                'Tasks rejected': rejected_tasks(ids, updated)}, 200
+
+    @login_required
+    def delete(self):
+        """
+            Add Rest operation: DELETE.
+            Delete many tasks using a JSON body like {"ids": [...]}.
+            One DELETE applies it to the tasks the logged user can change,
+            changed ids are the ones it matched.
+        """
+        ids = bulk_task_ids(request.get_json(silent=True))
+        deleted = delete_tasks(ids, session['user_id'],
+                               session['role'] == "admin")
+        db.session.commit()
+        return {'Tasks deleted': deleted,
+                'Tasks rejected': rejected_tasks(ids, deleted)}, 200
+
+
+class ApiTasksExport(Resource):
+
+    """
+        Overload Api base class Resource.
+        Stream all tasks as NDJSON (default) or CSV.
+        Support for GET.
+    """
+
+    formats = {'ndjson': ('application/x-ndjson', ndjson_lines),
+               'csv': ('text/csv', csv_lines)}
+
+    def get(self):
+        """
+            Add Rest operation: GET.
+            Filters: status, user_id, priority_min, priority_max, due_after and
+            due_before (DD/MM/YYYY). Archived tasks are included with `history=1`.
+            Rows come from a server side cursor and are sent by chunks while
+            read: memory does not depend on the number of tasks exported.
+        """
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in self.formats:
+            abort(400, message="error: format must be one of: {0}".format(
+                ', '.join(sorted(self.formats))))
+        mimetype, encode = self.formats[export_format]
+        source = task_source()
+        criteria = task_criteria(source)
+        chunk = current_app.config['API_EXPORT_CHUNK']
+        plan = plan_for(export_columns)
+        query = db.session.query(*[getattr(source, name) for name in plan.fields]) \
+            .filter(*criteria).order_by(source.task_id.asc()) \
+            .execution_options(stream_results=True).yield_per(chunk)
+
+        def generate():
+            if export_format == 'csv':
+                yield u','.join(export_columns) + u'\r\n'
+            rows = []
+            for row in query:
+                rows.append(row)
+                if len(rows) >= chunk:
+                    yield encode(plan, rows)
+                    rows = []
+            if rows:
+                yield encode(plan, rows)
+
+        response = current_app.response_class(stream_with_context(generate()),
+                                              mimetype=mimetype)
+        response.headers['Content-Disposition'] = \
+            'attachment; filename=tasks.{0}'.format(export_format)
+        return response
+
+
+class ApiTokens(Resource):
+
+    """
+        Overload Api base class Resource.
+        Api tokens avoid checking password on every demand.
+        Support for POST and DELETE.
+    """
+
+    def post(self):
+        """
+            Add Rest operation: POST.
+            Exchange user_name and password (or a still valid token) for a
+            new token.
+        """
+        args = {} if bearer_token() else credentials_schema.parse()
+        user = authenticate(args.get('user_name'), args.get('password'))
+        return {'token': issue_token(user),
+                'expires_in': current_app.config['API_TOKEN_EXPIRATION']}, 201
+
+    def delete(self):
+        """
+            Add Rest operation: DELETE.
+            Revoke all tokens of the token owner.
+        """
+        token = bearer_token()
+        user = user_from_token(token) if token else None
+        if user is None:
+            abort(401, message="error: Token is invalid, expired or revoked.")
+        revoke_tokens(user)
+        db.session.commit()
+        return {'message': "All tokens revoked."}, 200
+
+
+class ApiPoolStats(Resource):
+
+    """
+        Overload Api base class Resource.
+        Internal statistics of the database connection pools of this
+        process, to size pools against database connection limits.
+        Support for GET.
+    """
+
+    @login_required
+    def get(self):
+        """
+            Add Rest operation: GET.
+            Only admins can read them.
+        """
+        if session['role'] != "admin":
+            abort(403, message="error: Only admins can read pool statistics.")
+        return json_response(dict((name, stats.snapshot())
+                                  for name, stats in db.pool_stats.items()))
 
 
 class ApiTaskId(Resource):
@@ -157,63 +768,71 @@ class ApiTaskId(Resource):
         Support for GET, PUT, and DELETE.
     """
 
-    def __init__(self):
-        # Parser for update a task.
-        self.parser = reqparse.RequestParser()
-        self.parser.add_argument('name', type=str)
-        self.parser.add_argument('due_date', type=str)
-        self.parser.add_argument('priority', type=int)
-        self.parser.add_argument('status', type=int)
-        super(ApiTaskId, self).__init__()
-
     def get(self, task_id):
-        task = db.session.query(Task).filter_by(task_id=task_id).first()
-        abort_if_task_doesnt_exist(task_id, task)
-        json_result = {'task_id': task.task_id,
-                       'name': task.name,
-                       'due_date': str(task.due_date),
-                       'priority': task.priority,
-                       'posted_date': str(task.posted_date),
-                       'status': task.status,
-                       'user_id': task.user_id
-                       }
+        """
+            Add Rest operation: GET.
+            On conditional demands only task version is read first: a still
+            fresh task is answered by a 304 without loading nor serializing it.
+        """
+        if 'If-None-Match' in request.headers or request.if_modified_since:
+            row = db.session.query(Task.version, Task.updated_at).filter_by(
+                task_id=task_id).first()
+            if row is not None:
+                etag = task_etag(task_id, row.version, row.updated_at)
+                headers = cache_headers(etag, row.updated_at)
+                if not_modified(etag, row.updated_at):
+                    return not_modified_response(headers)
+        plan = plan_for(task_fields)
+        task = db.session.query(*plan.columns + [Task.version, Task.updated_at]) \
+            .filter_by(task_id=task_id).first()
+        if task is None:
+            # Archived tasks are still readable, only from their id.
+            task = db.session.query(*[getattr(TaskArchive, name) for name in
+                                      plan.fields + ('version', 'updated_at')]) \
+                .filter_by(task_id=task_id).first()
+        abort_if_task_doesnt_exist(task)
+        headers = cache_headers(
+            task_etag(task_id, task.version, task.updated_at), task.updated_at)
         # Call of jsonify by flask_restful.
-        return {'Corresponding Task': marshal(json_result, task_fields)}, 200
+        return {'Corresponding Task': plan.row(task)}, 200, headers
 
     @login_required
     def put(self, task_id):
-        # Recup arguments.
-        args = self.parser.parse_args()
-        # Check if task exists.
-        task = db.session.query(Task).filter_by(task_id=task_id)
-        abort_if_task_doesnt_exist(task_id, task.first())
-        # Check if user logged_in is the task owner (or admin)
-        abort_if_wrong_user(session['user_id'], task.first().user_id)
-        # Test priority field value.
-        abort_if_wrong_priority(args['priority'])
-        # Update task with new fields.
-        for key, value in args.items():
-            if value is not None:
-                # Convert date to correct datetime.date type.
-                if key == 'due_date':
-                    value = datetime.datetime.strptime(value, '%d/%m/%Y')
-                task.update({key: value})
+        """
+            Add Rest operation: PUT.
+            Update task with one UPDATE restricted to tasks the logged user
+            owns (any task for admin). Task is only read again when database
+            can not send it back inside the UPDATE itself.
+        """
+        # Recup fields to update, already converted and checked.
+        values = task_update_schema.parse()
+        if not values:
+            abort(400, message="error: Nothing to update.")
+        # Update task if it exists and user logged_in is the owner (or admin).
+        status, task = update_task(task_id, values, session['user_id'],
+                                   session['role'] == "admin")
+        abort_if_write_failed(status)
         db.session.commit()
+        plan = plan_for(task_fields)
+        if task is None:
+            task = db.session.query(*plan.columns).filter_by(task_id=task_id).first()
+            return {'Task updated': plan.row(task)}, 200
         # Display task updated.
-        return {'Task updated': marshal(task.first(), task_fields)}, 200
+        return {'Task updated': plan.mapping(task)}, 200
 
     @login_required
     def delete(self, task_id):
-        # Check if task exists.
-        task = db.session.query(Task).filter_by(task_id=task_id)
-        abort_if_task_doesnt_exist(task_id, task.first())
-        # Check if user logged_in is the task owner (or admin)
-        abort_if_wrong_user(session['user_id'], task.first().user_id)
-        # Delete task.
-        task.delete()
+        """
+            Add Rest operation: DELETE.
+            Delete task with one DELETE restricted to tasks the logged user
+            owns (any task for admin).
+        """
+        status, task = delete_task(task_id, session['user_id'],
+                                   session['role'] == "admin")
+        abort_if_write_failed(status)
         db.session.commit()
-        # Display task deleted.
-        return {'Task deleted': marshal(task.first(), task_fields)}, 200
+        # Display task deleted (only known if database supports RETURNING).
+        return {'Task deleted': plan_for(task_fields).mapping(task)}, 200
 
 
 ################################################################################
@@ -0,0 +1,260 @@
+# -*- coding:Utf8 -*-
+
+
+"""
+    Error log written by a background thread.
+    Request threads only put records on a bounded queue (records are
+    dropped and counted if it is full): they never wait for the disk. One
+    thread per process writes them as JSON lines by batches, one write and
+    one flush per batch, and rotates the file once it is too big or too
+    old. Workers sharing the file reopen it when another one rotated it.
+    Configuration:
+        ERROR_LOG: path of the log file, nothing is logged if unset.
+        ERROR_LOG_MAX_BYTES: size at which the file is rotated.
+        ERROR_LOG_ROTATE_SECONDS: age at which the file is rotated.
+        ERROR_LOG_BACKUPS: rotated files kept (error.log.1 is the newest).
+        ERROR_LOG_BATCH: records written at once at most.
+        ERROR_LOG_QUEUE_SIZE: records waiting to be written at most.
+"""
+
+import atexit
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import queue
+except ImportError:  # Python2
+    import Queue as queue
+
+from flask import g, request
+
+try:
+    from logging.handlers import QueueHandler
+except ImportError:  # Python2
+    class QueueHandler(logging.Handler):
+
+        """
+            Put records on a queue, formatted in the calling thread.
+        """
+
+        def __init__(self, queue):
+            logging.Handler.__init__(self)
+            self.queue = queue
+
+        def enqueue(self, record):
+            self.queue.put_nowait(record)
+
+        def prepare(self, record):
+            record.msg = record.message = self.format(record)
+            record.args = None
+            record.exc_info = None
+            return record
+
+        def emit(self, record):
+            try:
+                self.enqueue(self.prepare(record))
+            except Exception:
+                self.handleError(record)
+
+
+class DroppingQueueHandler(QueueHandler):
+
+    """
+        Queue handler dropping records instead of waiting when the queue is
+        full.
+    """
+
+    def __init__(self, queue):
+        QueueHandler.__init__(self, queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def json_line(record):
+    """
+        Format one record as a JSON line, with its request details.
+    """
+    data = {'time': datetime.datetime.utcfromtimestamp(
+        record.created).isoformat() + 'Z',
+        'level': record.levelname,
+        'message': record.getMessage()}
+    data.update(getattr(record, 'request_info', {}))
+    return json.dumps(data, sort_keys=True) + '\n'
+
+
+class RotatingWriter(object):
+
+    """
+        Append lines to a file rotated by size and by age. Only used by the
+        writer thread.
+    """
+
+    def __init__(self):
+        self.file = None
+        self.path = None
+        self.opened_at = 0
+
+    def write(self, path, lines, max_bytes, rotate_seconds, backups):
+        if path != self.path or self.rotated_elsewhere():
+            self.close()
+        if self.file is None:
+            self.open(path)
+        if self.file.tell() and (
+                self.file.tell() >= max_bytes or
+                time.time() - self.opened_at >= rotate_seconds):
+            self.rotate(backups)
+        self.file.write(''.join(lines))
+        self.file.flush()
+
+    def open(self, path):
+        self.path = path
+        self.file = open(path, 'a')
+        self.file.seek(0, os.SEEK_END)
+        # Like TimedRotatingFileHandler, age of an existing file is counted
+        # from its last write.
+        self.opened_at = time.time()
+        if self.file.tell():
+            self.opened_at = os.path.getmtime(path)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def rotated_elsewhere(self):
+        """
+            True if another worker renamed the file being written.
+        """
+        if self.file is None:
+            return False
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self.file.fileno()).st_ino
+        except OSError:
+            return True
+
+    def rotate(self, backups):
+        path = self.path
+        self.close()
+        for index in range(backups - 1, 0, -1):
+            if os.path.exists('{0}.{1}'.format(path, index)):
+                os.rename('{0}.{1}'.format(path, index),
+                          '{0}.{1}'.format(path, index + 1))
+        if backups:
+            os.rename(path, path + '.1')
+        else:
+            os.remove(path)
+        self.file = open(path, 'a')
+        self.opened_at = time.time()
+
+
+class ErrorLog(object):
+
+    """
+        Log failed requests through a queue emptied by a writer thread.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._pid = None
+        self.logger = logging.getLogger('project.errors')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.writer = RotatingWriter()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('ERROR_LOG', 'error.log')
+        app.config.setdefault('ERROR_LOG_MAX_BYTES', 10 * 1024 * 1024)
+        app.config.setdefault('ERROR_LOG_ROTATE_SECONDS', 24 * 3600)
+        app.config.setdefault('ERROR_LOG_BACKUPS', 5)
+        app.config.setdefault('ERROR_LOG_BATCH', 100)
+        app.config.setdefault('ERROR_LOG_QUEUE_SIZE', 10000)
+        self.queue = queue.Queue(app.config['ERROR_LOG_QUEUE_SIZE'])
+        self.handler = DroppingQueueHandler(self.queue)
+        self.logger.addHandler(self.handler)
+        atexit.register(self.stop)
+
+    def log_request(self, status, error=None):
+        """
+            Queue a record of the current request answered by status.
+        """
+        if not self.app.config['ERROR_LOG']:
+            return
+        self.start()
+        start = getattr(g, 'metrics_start', None)
+        info = {'status': status,
+                'method': request.method,
+                'url': request.url,
+                'endpoint': request.endpoint,
+                'remote_addr': request.remote_addr,
+                'latency_ms': round(1000 * (time.time() - start), 3)
+                if start is not None else None}
+        level = logging.ERROR if status >= 500 else logging.WARNING
+        message = '{0} error'.format(status)
+        if error is not None:
+            message += ': {0!r}'.format(error)
+        self.logger.log(level, message, extra={'request_info': info})
+
+    def start(self):
+        with self._lock:
+            # Threads do not survive a fork: start one in each worker.
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                thread = threading.Thread(target=self._run)
+                thread.daemon = True
+                thread.start()
+
+    def _run(self):
+        while True:
+            records = [self.queue.get()]
+            while records[-1] is not None and \
+                    len(records) < self.app.config['ERROR_LOG_BATCH']:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = records[-1] is None
+            try:
+                lines = [json_line(record) for record in records
+                         if record is not None]
+                if lines:
+                    config = self.app.config
+                    self.writer.write(config['ERROR_LOG'], lines,
+                                      config['ERROR_LOG_MAX_BYTES'],
+                                      config['ERROR_LOG_ROTATE_SECONDS'],
+                                      config['ERROR_LOG_BACKUPS'])
+            except Exception:
+                self.app.logger.exception('Error log can not be written')
+            finally:
+                for record in records:
+                    self.queue.task_done()
+            if stop:
+                self.writer.close()
+                return
+
+    def flush(self):
+        """
+            Wait until queued records are written.
+        """
+        if self._pid == os.getpid():
+            self.queue.join()
+
+    def stop(self):
+        """
+            Write queued records then stop writer thread.
+        """
+        if self._pid == os.getpid():
+            self._pid = None
+            self.queue.put(None)
+            self.queue.join()
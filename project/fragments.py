@@ -0,0 +1,108 @@
+# -*- coding:Utf8 -*-
+
+
+"""
+    Cache of rendered HTML fragments.
+    Keys hold the tasks collection version: every write bumps it, so old
+    fragments are never read again and simply age out of the backend.
+    Backends follow the werkzeug.contrib.cache interface: an in process LRU
+    by default, or any shared werkzeug cache (redis, memcached) so all
+    workers reuse the same fragments.
+    Configuration:
+        FRAGMENT_CACHE_SIZE: fragments kept by the LRU backend.
+        FRAGMENT_CACHE_TIMEOUT: lifetime in seconds inside shared backends.
+        FRAGMENT_CACHE_REDIS_HOST: use a redis shared backend if set.
+"""
+
+import threading
+from collections import OrderedDict
+
+from werkzeug.contrib.cache import BaseCache, RedisCache
+
+
+class LRUCache(BaseCache):
+
+    """
+        In process cache dropping least recently used fragments first.
+        Timeouts are ignored: versioned keys are never stale.
+    """
+
+    def __init__(self, threshold=256, default_timeout=300):
+        BaseCache.__init__(self, default_timeout)
+        self._threshold = threshold
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return None
+            self._items[key] = value
+            return value
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self._threshold:
+                self._items.popitem(last=False)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            return self._items.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+        return True
+
+
+class FragmentCache(object):
+
+    """
+        Return fragments from backend, render and store them on misses.
+        Count hits and misses of this process.
+    """
+
+    def __init__(self, app=None, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FRAGMENT_CACHE_SIZE', 256)
+        app.config.setdefault('FRAGMENT_CACHE_TIMEOUT', 300)
+        app.config.setdefault('FRAGMENT_CACHE_REDIS_HOST', None)
+        if self.backend is not None:
+            return
+        if app.config['FRAGMENT_CACHE_REDIS_HOST']:
+            self.backend = RedisCache(
+                host=app.config['FRAGMENT_CACHE_REDIS_HOST'],
+                default_timeout=app.config['FRAGMENT_CACHE_TIMEOUT'],
+                key_prefix='fragments:')
+        else:
+            self.backend = LRUCache(app.config['FRAGMENT_CACHE_SIZE'],
+                                    app.config['FRAGMENT_CACHE_TIMEOUT'])
+
+    def get_or_render(self, key, render):
+        """
+            Return fragment stored under key, else call render() and store
+            its result.
+        """
+        value = self.backend.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = render()
+        self.backend.set(key, value)
+        return value
+
+    def clear(self):
+        self.backend.clear()
+        self.hits = self.misses = 0
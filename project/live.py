@@ -0,0 +1,186 @@
+# -*- coding:Utf8 -*-
+
+
+"""
+    Live feed of task changes.
+    One broadcaster per process reads the task_changes log and fans new
+    changes out to every subscribed page. Reading the database log (instead
+    of only local writes) lets changes made by other workers reach clients
+    too, for one query per poll whatever the number of clients.
+    Local commits touching tasks wake the broadcaster at once.
+    An open stream holds a whole sync worker: the tasks page feed is off
+    unless LIVE_FEED is set, which needs workers serving many requests at
+    once (gunicorn --worker-class gthread --threads n, or gevent). Streams
+    are closed before the worker timeout, clients then reconnect.
+    Configuration:
+        LIVE_FEED: stream task changes to the tasks page.
+        LIVE_FEED_POLL_INTERVAL: seconds between two reads of the log.
+        LIVE_FEED_KEEPALIVE: seconds between two keepalive comments.
+        LIVE_FEED_TIMEOUT: seconds before a stream is closed (clients
+            reconnect with Last-Event-ID), below gunicorn worker timeout.
+        LIVE_FEED_BACKLOG: changes queued for a slow client before it is
+            dropped.
+"""
+
+import json
+import os
+import threading
+import time
+
+try:
+    import queue
+except ImportError:  # Python2
+    import Queue as queue
+
+from flask.ext.sqlalchemy import SignallingSession
+from sqlalchemy import event
+
+from project.tasks.queries import changes_since, last_change_id
+
+
+class Subscription(object):
+
+    """
+        Changes waiting to be sent to one client.
+    """
+
+    def __init__(self, backlog):
+        self.changes = queue.Queue(backlog)
+        self.closed = False
+
+    def get(self, timeout):
+        """
+            Return next list of changes, None if nothing came before timeout
+            or if subscription was dropped.
+        """
+        if self.closed:
+            return None
+        try:
+            return self.changes.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class ChangeBroadcaster(object):
+
+    """
+        Poll task_changes from a single thread and fan changes out to
+        subscriptions of this process.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._subscriptions = set()
+        self._pid = None
+        self.last_id = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('LIVE_FEED', False)
+        app.config.setdefault('LIVE_FEED_POLL_INTERVAL', 2)
+        app.config.setdefault('LIVE_FEED_KEEPALIVE', 10)
+        app.config.setdefault('LIVE_FEED_TIMEOUT', 20)
+        app.config.setdefault('LIVE_FEED_BACKLOG', 100)
+
+        # Wake broadcaster when a transaction which bumped tasks version
+        # is committed.
+        @event.listens_for(SignallingSession, 'after_commit')
+        def after_commit(session):
+            if session.info.pop('tasks_changed', False):
+                self.notify()
+
+        @event.listens_for(SignallingSession, 'after_rollback')
+        def after_rollback(session):
+            session.info.pop('tasks_changed', None)
+
+    def notify(self):
+        self._wake.set()
+
+    def subscribe(self):
+        with self._lock:
+            # Threads do not survive a fork: start one in each worker.
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self.last_id = last_change_id()
+                thread = threading.Thread(target=self._run)
+                thread.daemon = True
+                thread.start()
+            elif not self._subscriptions:
+                # Nobody listened: skip changes nobody will ask for.
+                self.last_id = last_change_id()
+            subscription = Subscription(self.app.config['LIVE_FEED_BACKLOG'])
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+        subscription.closed = True
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.app.config['LIVE_FEED_POLL_INTERVAL'])
+            self._wake.clear()
+            if self._subscriptions:
+                self.poll()
+
+    def poll(self):
+        """
+            Read changes logged since the last poll and queue them for every
+            subscription. Slow clients whose queue is full are dropped.
+        """
+        try:
+            with self.app.app_context():
+                changes = changes_since(self.last_id)
+        except Exception:
+            self.app.logger.exception('Live feed can not read task changes')
+            return
+        if not changes:
+            return
+        self.last_id = changes[-1][0]
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            try:
+                subscription.changes.put_nowait(changes)
+            except queue.Full:
+                self.unsubscribe(subscription)
+
+    def stream(self, subscription, backlog=()):
+        """
+            Yield Server-Sent Events of a subscription, after backlog changes
+            (missed by a reconnecting client).
+        """
+        config = self.app.config
+        deadline = time.time() + config['LIVE_FEED_TIMEOUT']
+        # Change ids are not ordered on PostgreSQL (see TaskChange): skip
+        # changes both in backlog and in the subscription by id.
+        sent = set()
+        try:
+            # Ask client to reconnect after 3 seconds when stream ends.
+            yield 'retry: 3000\n\n'
+            for change in backlog:
+                yield event_message(change)
+                sent.add(change[0])
+            while time.time() < deadline and not subscription.closed:
+                changes = subscription.get(config['LIVE_FEED_KEEPALIVE'])
+                if changes is None:
+                    yield ': keepalive\n\n'
+                    continue
+                for change in changes:
+                    if change[0] not in sent:
+                        yield event_message(change)
+        finally:
+            self.unsubscribe(subscription)
+
+
+def event_message(change):
+    """
+        Format one (change_id, task_id, kind) change as a Server-Sent Event.
+    """
+    change_id, task_id, kind = change
+    return 'id: {0}\nevent: {1}\ndata: {2}\n\n'.format(
+        change_id, kind, json.dumps({'task_id': task_id}))
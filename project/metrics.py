@@ -0,0 +1,408 @@
+# -*- coding:Utf8 -*-
+
+
+"""
+    Request metrics in Prometheus text format.
+    Every request is timed into a latency histogram by endpoint and
+    method, counted by endpoint, method and status code, and counted as in
+    flight while it runs. Other parts of the application register their
+    own counters and gauges, read when a snapshot is taken. GET /metrics
+    exposes them all.
+    Each worker process keeps its own metrics. With a metrics directory,
+    a thread of each worker writes a snapshot of them there every flush
+    interval (and when asked for /metrics), named by pid and start time so
+    a worker reusing the pid of an exited one never overwrites its file.
+    /metrics sums the snapshots of every worker. Snapshots of exited
+    workers are merged into metrics_exited.json then removed: their
+    counters are kept so totals never go back, their in flight requests
+    and gauges are dropped, and the directory holds one file per worker.
+    Configuration:
+        METRICS_DIR: directory shared by the workers of one host, metrics
+            are per process if unset.
+        METRICS_FLUSH_INTERVAL: seconds between two snapshots of a worker.
+        METRICS_BUCKETS: upper bounds in seconds of histogram buckets.
+"""
+
+import atexit
+import bisect
+import contextlib
+import errno
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from flask import g, request
+
+# Buckets of the Prometheus clients.
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75,
+                   1.0, 2.5, 5.0, 7.5, 10.0)
+
+# Snapshot of exited workers, inside metrics directory.
+EXITED = 'metrics_exited.json'
+
+
+class RequestMetrics(object):
+
+    """
+        Latency histograms, status counters and in flight gauges of the
+        requests answered by this process.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._started = None
+        self.buckets = default_buckets
+        self.values = {}
+        self.clear()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('METRICS_DIR', None)
+        app.config.setdefault('METRICS_FLUSH_INTERVAL', 5)
+        app.config.setdefault('METRICS_BUCKETS', default_buckets)
+        self.buckets = tuple(app.config['METRICS_BUCKETS'])
+        app.before_request(self.start)
+        app.after_request(self.record_status)
+        app.teardown_request(self.finish)
+        app.add_url_rule('/metrics', 'metrics', self.expose)
+        atexit.register(self.stop)
+
+    def clear(self):
+        with self._lock:
+            self.requests = {}
+            self.durations = {}
+            self.in_flight = {}
+
+    def register(self, name, kind, description, read):
+        """
+            Expose read() of this process as a counter or a gauge (kind).
+        """
+        self.values[name] = (kind, description, read)
+
+    # Instrumentation
+
+    def start(self):
+        if self.app.config['METRICS_DIR']:
+            self.start_flusher()
+        g.metrics_start = time.time()
+        g.metrics_endpoint = request.endpoint or 'unmatched'
+        with self._lock:
+            self.in_flight[g.metrics_endpoint] = \
+                self.in_flight.get(g.metrics_endpoint, 0) + 1
+
+    def record_status(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def finish(self, exception=None):
+        start = getattr(g, 'metrics_start', None)
+        if start is None:
+            return
+        endpoint = g.metrics_endpoint
+        with self._lock:
+            self.in_flight[endpoint] = self.in_flight.get(endpoint, 1) - 1
+        # Unhandled exceptions skip after_request: they are answered by 500.
+        self.observe(endpoint, request.method,
+                     getattr(g, 'metrics_status', 500), time.time() - start)
+
+    def observe(self, endpoint, method, status, seconds):
+        """
+            Count one answered request and add its duration to histogram.
+        """
+        key = (endpoint, method)
+        with self._lock:
+            counts = self.durations.get(key)
+            if counts is None:
+                counts = self.durations[key] = [0] * (len(self.buckets) + 1)
+                counts.append(0.0)
+            # Buckets, then +Inf bucket, then sum of durations.
+            counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            counts[-1] += seconds
+            key = (endpoint, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    # Aggregation
+
+    def snapshot(self):
+        with self._lock:
+            return {'buckets': list(self.buckets),
+                    'requests': [list(key) + [count] for key, count
+                                 in self.requests.items()],
+                    'durations': [list(key) + [list(counts)] for key, counts
+                                  in self.durations.items()],
+                    'in_flight': [[endpoint, count] for endpoint, count
+                                  in self.in_flight.items()],
+                    'values': [[name, kind, description, read()]
+                               for name, (kind, description, read)
+                               in self.values.items()]}
+
+    def start_flusher(self):
+        """
+            Start the thread writing snapshots of this process.
+        """
+        # Threads do not survive a fork: start one in each worker.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._started = time.time()
+                thread = threading.Thread(target=self._run)
+                thread.daemon = True
+                thread.start()
+
+    def _run(self):
+        pid = self._pid
+        while self._pid == pid:
+            time.sleep(self.app.config['METRICS_FLUSH_INTERVAL'])
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Metrics can not be written')
+
+    def stop(self):
+        """
+            Write last snapshot of a process which answered requests.
+        """
+        if self._pid == os.getpid():
+            self.flush()
+
+    def flush(self):
+        """
+            Write snapshot of this process inside metrics directory.
+            Written aside then renamed, so readers never see half a file.
+        """
+        directory = getattr(self, 'app', None) and \
+            self.app.config['METRICS_DIR']
+        if not directory:
+            return
+        self.start_flusher()
+        name = 'metrics_{0}_{1:.0f}.json'.format(self._pid,
+                                                 1000 * self._started)
+        write_snapshot(os.path.join(directory, name), self.snapshot())
+
+    def collect(self):
+        """
+            Return snapshots to expose: the one of this process, or the
+            ones of every worker if metrics directory is set.
+        """
+        directory = self.app.config['METRICS_DIR']
+        if not directory:
+            return [self.snapshot()]
+        self.flush()
+        with locked(directory) as merging:
+            workers = worker_files(directory)
+            gone = exited(workers)
+            if merging and gone:
+                self.merge_exited(directory, gone)
+                workers = dict((name, worker) for name, worker
+                               in workers.items() if name not in gone)
+            snapshots = []
+            for name in sorted(workers) + [EXITED]:
+                snapshot = read_snapshot(os.path.join(directory, name))
+                if snapshot is None:
+                    continue
+                if name in gone:
+                    snapshot = without_gauges(snapshot)
+                snapshots.append(snapshot)
+        return snapshots
+
+    def merge_exited(self, directory, names):
+        """
+            Add snapshots of exited workers to the exited one and remove
+            their files. Only run while holding the directory lock.
+        """
+        snapshots = [read_snapshot(os.path.join(directory, name))
+                     for name in [EXITED] + sorted(names)]
+        snapshots = snapshots[:1] + [without_gauges(snapshot)
+                                     for snapshot in snapshots[1:]]
+        write_snapshot(os.path.join(directory, EXITED),
+                       merge([snapshot for snapshot in snapshots
+                              if snapshot is not None], self.buckets))
+        for name in names:
+            os.remove(os.path.join(directory, name))
+
+    # Exposition
+
+    def expose(self):
+        return self.app.response_class(
+            render(self.collect(), self.buckets),
+            mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        return error.errno == errno.EPERM
+    return True
+
+
+def write_snapshot(path, snapshot):
+    with open(path + '.tmp', 'w') as snapshot_file:
+        json.dump(snapshot, snapshot_file)
+    os.rename(path + '.tmp', path)
+
+
+def read_snapshot(path):
+    """
+        Return snapshot written at path, None if there is none.
+    """
+    try:
+        with open(path) as snapshot_file:
+            return json.load(snapshot_file)
+    except (IOError, ValueError):
+        return None
+
+
+def without_gauges(snapshot):
+    """
+        Return snapshot of an exited worker: only its counters still count.
+    """
+    if snapshot is None:
+        return None
+    snapshot['in_flight'] = []
+    snapshot['values'] = [value for value in snapshot.get('values', [])
+                          if value[1] != 'gauge']
+    return snapshot
+
+
+@contextlib.contextmanager
+def locked(directory):
+    """
+        Hold the lock of metrics directory. Yield False if the platform
+        has no file locks: snapshots of exited workers are then kept.
+    """
+    if fcntl is None:
+        yield False
+        return
+    with open(os.path.join(directory, 'metrics.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def worker_files(directory):
+    """
+        Return {file name: (pid, start time)} of worker snapshots inside
+        directory.
+    """
+    workers = {}
+    for name in os.listdir(directory):
+        if not (name.startswith('metrics_') and name.endswith('.json')) or \
+                name == EXITED:
+            continue
+        try:
+            parts = [int(part) for part
+                     in name[len('metrics_'):-len('.json')].split('_')]
+        except ValueError:
+            continue
+        workers[name] = (parts[0], parts[1] if len(parts) > 1 else 0)
+    return workers
+
+
+def exited(workers):
+    """
+        Return names of snapshots of exited workers: process is gone, or
+        a newer worker reused its pid.
+    """
+    newest = {}
+    for pid, started in workers.values():
+        newest[pid] = max(newest.get(pid, started), started)
+    return set(name for name, (pid, started) in workers.items()
+               if started < newest[pid] or not process_alive(pid))
+
+
+def labels(**values):
+    return '{' + ','.join(
+        '{0}="{1}"'.format(name, str(value).replace('\\', r'\\')
+                           .replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in sorted(values.items())) + '}'
+
+
+def number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def merge(snapshots, buckets):
+    """
+        Sum snapshots into one. Histograms of snapshots using other buckets
+        are left out.
+    """
+    buckets = list(buckets)
+    requests, durations, in_flight, values = {}, {}, {}, {}
+    for snapshot in snapshots:
+        for endpoint, method, status, count in snapshot['requests']:
+            key = (endpoint, method, status)
+            requests[key] = requests.get(key, 0) + count
+        for endpoint, count in snapshot['in_flight']:
+            in_flight[endpoint] = in_flight.get(endpoint, 0) + count
+        for name, kind, description, value in snapshot.get('values', []):
+            total = values.setdefault(name, [kind, description, 0])
+            total[2] += value
+        if list(snapshot['buckets']) != buckets:
+            continue
+        for endpoint, method, counts in snapshot['durations']:
+            total = durations.setdefault((endpoint, method),
+                                         [0] * len(counts))
+            for index, count in enumerate(counts):
+                total[index] += count
+    return {'buckets': buckets,
+            'requests': [list(key) + [count] for key, count
+                         in requests.items()],
+            'durations': [list(key) + [counts] for key, counts
+                          in durations.items()],
+            'in_flight': [[endpoint, count] for endpoint, count
+                          in in_flight.items()],
+            'values': [[name] + total for name, total in values.items()]}
+
+
+def render(snapshots, buckets):
+    """
+        Sum snapshots and format them in Prometheus text format.
+    """
+    total = merge(snapshots, buckets)
+    buckets = total['buckets']
+    lines = ['# HELP http_requests_total Requests answered, by endpoint, '
+             'method and status code.',
+             '# TYPE http_requests_total counter']
+    for endpoint, method, status, count in sorted(total['requests']):
+        lines.append('http_requests_total{0} {1}'.format(
+            labels(endpoint=endpoint, method=method, status=status), count))
+    lines += ['# HELP http_request_duration_seconds Latency of requests, by '
+              'endpoint and method.',
+              '# TYPE http_request_duration_seconds histogram']
+    for endpoint, method, counts in sorted(total['durations']):
+        cumulated = 0
+        for bound, count in zip(buckets + ['+Inf'], counts[:-1]):
+            cumulated += count
+            lines.append('http_request_duration_seconds_bucket{0} {1}'.format(
+                labels(endpoint=endpoint, method=method,
+                       le=bound if bound == '+Inf' else number(float(bound))),
+                cumulated))
+        lines.append('http_request_duration_seconds_sum{0} {1}'.format(
+            labels(endpoint=endpoint, method=method), number(counts[-1])))
+        lines.append('http_request_duration_seconds_count{0} {1}'.format(
+            labels(endpoint=endpoint, method=method), cumulated))
+    lines += ['# HELP http_requests_in_flight Requests being answered, by '
+              'endpoint.',
+              '# TYPE http_requests_in_flight gauge']
+    for endpoint, count in sorted(total['in_flight']):
+        lines.append('http_requests_in_flight{0} {1}'.format(
+            labels(endpoint=endpoint), count))
+    for name, kind, description, value in sorted(total['values']):
+        lines += ['# HELP {0} {1}'.format(name, description),
+                  '# TYPE {0} {1}'.format(name, kind),
+                  '{0} {1}'.format(name, number(value))]
+    return '\n'.join(lines) + '\n'
@@ -2,7 +2,9 @@
 
 
 from project import db
+from sqlalchemy import DDL, event
 import datetime
+import re
 
 
 ########################
@@ -18,6 +20,18 @@ class Task(db.Model):
     """
 
     __tablename__ = "tasks"
+    # Keyset pagination walks tasks on (due_date, task_id), tasks page
+    # walks open or closed tasks on the same key, ownership checks and
+    # per user counts look tasks up by (user_id, status).
+    # Ids are never reused on SQLite either (AUTOINCREMENT): archived and
+    # deleted tasks keep theirs inside tasks_archive and task_changes.
+    __table_args__ = (db.Index('ix_tasks_due_date_task_id',
+                               'due_date', 'task_id'),
+                      db.Index('ix_tasks_status_due_date',
+                               'status', 'due_date', 'task_id'),
+                      db.Index('ix_tasks_user_id_status',
+                               'user_id', 'status'),
+                      {'sqlite_autoincrement': True})
 
     task_id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
@@ -26,6 +40,11 @@ class Task(db.Model):
     posted_date = db.Column(db.Date, default=datetime.datetime.utcnow())
     status = db.Column(db.Integer, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'))
+    # Bumped by every UPDATE, even bulk ones, to build api ETags.
+    version = db.Column(db.Integer, nullable=False, default=1,
+                        onupdate=db.text('version + 1'))
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow,
+                           onupdate=datetime.datetime.utcnow)
 
     def __init__(self, name, due_date, priority, posted_date, status, user_id):
         # super().__init__()  # Python3
@@ -41,6 +60,35 @@ class Task(db.Model):
         return '<Task {0}>'.format(self.name)
 
 
+class TaskArchive(db.Model):
+
+    """
+        Model representing the tasks_archive table.
+        Same shape as tasks, holding tasks closed for a long time moved
+        there by the archive job, so tasks table and its indexes only hold
+        live tasks. Archived tasks are read only.
+    """
+
+    __tablename__ = "tasks_archive"
+    __table_args__ = (db.Index('ix_tasks_archive_status_due_date',
+                               'status', 'due_date', 'task_id'),)
+
+    task_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String, nullable=False)
+    due_date = db.Column(db.Date, nullable=False)
+    priority = db.Column(db.Integer, nullable=False)
+    posted_date = db.Column(db.Date)
+    status = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'))
+    version = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False)
+    poster = db.relationship('User')
+
+    def __repr__(self):
+        return '<TaskArchive {0}>'.format(self.name)
+
+
 class User(db.Model):
 
     """
@@ -56,6 +104,8 @@ class User(db.Model):
     password = db.Column(db.String, nullable=False)
     tasks = db.relationship('Task', backref='poster')
     role = db.Column(db.String, default='user')
+    # Bumped to revoke all api tokens of the user.
+    token_generation = db.Column(db.Integer, nullable=False, default=0)
 
     def __init__(self, name=None, email=None, password=None, role=None):
         # super().__init__()  # Python3
@@ -67,3 +117,235 @@ class User(db.Model):
 
     def __repr__(self):
         return '<User {0}>'.format(self.name)
+
+
+class TaskChange(db.Model):
+
+    """
+        Model representing the task_changes table.
+        Append only log of task writes, filled by database triggers so every
+        write path (bulk ones included) is recorded. Deleted tasks keep a
+        row here (tombstone) after their tasks row is gone. Tasks moved to
+        tasks_archive are logged as archived, not deleted.
+        On PostgreSQL, transactions do not commit in change_id order: the
+        feed walks changes on (txid, change_id) and only reads changes of
+        transactions older than every running one, so a cursor never moves
+        past a change committed later. SQLite runs one writer at a time, its
+        txid is left null.
+    """
+
+    __tablename__ = "task_changes"
+    __table_args__ = (db.Index('ix_task_changes_txid_change_id',
+                               'txid', 'change_id'),)
+
+    change_id = db.Column(db.Integer, primary_key=True)
+    # No foreign key: tombstones outlive their task.
+    task_id = db.Column(db.Integer, nullable=False)
+    # created, updated, completed, deleted or archived.
+    kind = db.Column(db.String, nullable=False)
+    changed_at = db.Column(db.DateTime)
+    # Transaction which logged the change (PostgreSQL only).
+    txid = db.Column(db.BigInteger)
+
+    def __repr__(self):
+        return '<TaskChange {0} {1} {2}>'.format(self.change_id, self.kind,
+                                                 self.task_id)
+
+
+# Triggers logging task writes into task_changes, created with tasks table.
+# An update turning status from open (1) to closed (0) is a completion.
+sqlite_change_triggers = [DDL("""
+    CREATE TRIGGER tasks_log_insert AFTER INSERT ON tasks BEGIN
+        INSERT INTO task_changes (task_id, kind, changed_at)
+        VALUES (NEW.task_id, 'created', CURRENT_TIMESTAMP);
+    END"""), DDL("""
+    CREATE TRIGGER tasks_log_update AFTER UPDATE ON tasks BEGIN
+        INSERT INTO task_changes (task_id, kind, changed_at)
+        VALUES (NEW.task_id,
+                CASE WHEN OLD.status = 1 AND NEW.status = 0
+                     THEN 'completed' ELSE 'updated' END,
+                CURRENT_TIMESTAMP);
+    END"""), DDL("""
+    CREATE TRIGGER tasks_log_delete AFTER DELETE ON tasks BEGIN
+        INSERT INTO task_changes (task_id, kind, changed_at)
+        VALUES (OLD.task_id,
+                CASE WHEN EXISTS (SELECT 1 FROM tasks_archive
+                                  WHERE task_id = OLD.task_id)
+                     THEN 'archived' ELSE 'deleted' END,
+                CURRENT_TIMESTAMP);
+    END""")]
+
+postgresql_change_triggers = [DDL("""
+    CREATE OR REPLACE FUNCTION tasks_log_change() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO task_changes (task_id, kind, changed_at, txid)
+            VALUES (OLD.task_id,
+                    CASE WHEN EXISTS (SELECT 1 FROM tasks_archive
+                                      WHERE task_id = OLD.task_id)
+                         THEN 'archived' ELSE 'deleted' END,
+                    now() at time zone 'utc', txid_current());
+            RETURN OLD;
+        END IF;
+        INSERT INTO task_changes (task_id, kind, changed_at, txid)
+        VALUES (NEW.task_id,
+                CASE WHEN TG_OP = 'INSERT' THEN 'created'
+                     WHEN OLD.status = 1 AND NEW.status = 0 THEN 'completed'
+                     ELSE 'updated' END,
+                now() at time zone 'utc', txid_current());
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql"""), DDL("""
+    CREATE TRIGGER tasks_log_change AFTER INSERT OR UPDATE OR DELETE ON tasks
+    FOR EACH ROW EXECUTE PROCEDURE tasks_log_change()""")]
+
+for trigger in sqlite_change_triggers:
+    event.listen(Task.__table__, 'after_create',
+                 trigger.execute_if(dialect='sqlite'))
+for trigger in postgresql_change_triggers:
+    event.listen(Task.__table__, 'after_create',
+                 trigger.execute_if(dialect='postgresql'))
+
+
+class UserTaskStats(db.Model):
+
+    """
+        Model representing the user_task_stats table.
+        Open and closed tasks counters of each user, kept up to date by
+        database triggers inside the transaction of every task write, so
+        counts are read without counting tasks.
+    """
+
+    __tablename__ = "user_task_stats"
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'),
+                        primary_key=True)
+    open_count = db.Column(db.Integer, nullable=False, default=0)
+    closed_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<UserTaskStats {0} {1}/{2}>'.format(
+            self.user_id, self.open_count, self.closed_count)
+
+
+# Triggers keeping user_task_stats up to date. A task is open if its status
+# is 1, closed otherwise. Users get their row when created. Archived tasks
+# still count as closed tasks of their user.
+sqlite_stats_triggers = [(User.__table__, DDL("""
+    CREATE TRIGGER users_stats_insert AFTER INSERT ON users BEGIN
+        INSERT INTO user_task_stats (user_id, open_count, closed_count)
+        VALUES (NEW.user_id, 0, 0);
+    END""")), (Task.__table__, DDL("""
+    CREATE TRIGGER tasks_stats_insert AFTER INSERT ON tasks BEGIN
+        UPDATE user_task_stats
+        SET open_count = open_count + (NEW.status = 1),
+            closed_count = closed_count + (NEW.status != 1)
+        WHERE user_id = NEW.user_id;
+    END""")), (Task.__table__, DDL("""
+    CREATE TRIGGER tasks_stats_update AFTER UPDATE OF status, user_id ON tasks
+    WHEN OLD.status != NEW.status OR OLD.user_id IS NOT NEW.user_id BEGIN
+        UPDATE user_task_stats
+        SET open_count = open_count - (OLD.status = 1),
+            closed_count = closed_count - (OLD.status != 1)
+        WHERE user_id = OLD.user_id;
+        UPDATE user_task_stats
+        SET open_count = open_count + (NEW.status = 1),
+            closed_count = closed_count + (NEW.status != 1)
+        WHERE user_id = NEW.user_id;
+    END""")), (Task.__table__, DDL("""
+    CREATE TRIGGER tasks_stats_delete AFTER DELETE ON tasks
+    WHEN NOT EXISTS (SELECT 1 FROM tasks_archive
+                     WHERE task_id = OLD.task_id) BEGIN
+        UPDATE user_task_stats
+        SET open_count = open_count - (OLD.status = 1),
+            closed_count = closed_count - (OLD.status != 1)
+        WHERE user_id = OLD.user_id;
+    END"""))]
+
+postgresql_stats_triggers = [(User.__table__, DDL("""
+    CREATE OR REPLACE FUNCTION users_stats_insert() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO user_task_stats (user_id, open_count, closed_count)
+        VALUES (NEW.user_id, 0, 0);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql""")), (User.__table__, DDL("""
+    CREATE TRIGGER users_stats_insert AFTER INSERT ON users
+    FOR EACH ROW EXECUTE PROCEDURE users_stats_insert()""")), (Task.__table__, DDL("""
+    CREATE OR REPLACE FUNCTION tasks_stats_change() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' OR (TG_OP = 'DELETE' AND NOT EXISTS (
+                SELECT 1 FROM tasks_archive WHERE task_id = OLD.task_id)) THEN
+            UPDATE user_task_stats
+            SET open_count = open_count - (OLD.status = 1)::int,
+                closed_count = closed_count - (OLD.status != 1)::int
+            WHERE user_id = OLD.user_id;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            UPDATE user_task_stats
+            SET open_count = open_count + (NEW.status = 1)::int,
+                closed_count = closed_count + (NEW.status != 1)::int
+            WHERE user_id = NEW.user_id;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql""")), (Task.__table__, DDL("""
+    CREATE TRIGGER tasks_stats_change AFTER INSERT OR DELETE
+    OR UPDATE OF status, user_id ON tasks
+    FOR EACH ROW EXECUTE PROCEDURE tasks_stats_change()"""))]
+
+for table, trigger in sqlite_stats_triggers:
+    event.listen(table, 'after_create', trigger.execute_if(dialect='sqlite'))
+for table, trigger in postgresql_stats_triggers:
+    event.listen(table, 'after_create',
+                 trigger.execute_if(dialect='postgresql'))
+
+
+# Full text index over task names, kept in sync on every write path.
+# SQLite: FTS5 table indexing tasks.name (external content, so names are not
+# stored twice) filled by triggers. PostgreSQL: GIN index over the tsvector
+# of the name, maintained by PostgreSQL itself.
+sqlite_search_ddl = [DDL("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+        name, content='tasks', content_rowid='task_id')"""), DDL("""
+    CREATE TRIGGER tasks_fts_insert AFTER INSERT ON tasks BEGIN
+        INSERT INTO tasks_fts (rowid, name) VALUES (NEW.task_id, NEW.name);
+    END"""), DDL("""
+    CREATE TRIGGER tasks_fts_update AFTER UPDATE OF name ON tasks BEGIN
+        INSERT INTO tasks_fts (tasks_fts, rowid, name)
+        VALUES ('delete', OLD.task_id, OLD.name);
+        INSERT INTO tasks_fts (rowid, name) VALUES (NEW.task_id, NEW.name);
+    END"""), DDL("""
+    CREATE TRIGGER tasks_fts_delete AFTER DELETE ON tasks BEGIN
+        INSERT INTO tasks_fts (tasks_fts, rowid, name)
+        VALUES ('delete', OLD.task_id, OLD.name);
+    END""")]
+
+postgresql_search_ddl = [DDL("""
+    CREATE INDEX ix_tasks_name_fts ON tasks
+    USING gin (to_tsvector('simple', name))""")]
+
+for statement in sqlite_search_ddl:
+    event.listen(Task.__table__, 'after_create',
+                 statement.execute_if(dialect='sqlite'))
+for statement in postgresql_search_ddl:
+    event.listen(Task.__table__, 'after_create',
+                 statement.execute_if(dialect='postgresql'))
+# The FTS5 table is not part of the metadata: drop it with tasks.
+event.listen(Task.__table__, 'after_drop',
+             DDL("DROP TABLE IF EXISTS tasks_fts").execute_if(dialect='sqlite'))
+
+
+def replace_triggers(connection, statements):
+    """
+        Run DDL statements on an existing database, dropping each trigger
+        first so migrations can run again.
+    """
+    for statement in statements:
+        match = re.search(r'CREATE TRIGGER (\w+)\s.*?\sON (\w+)',
+                          statement.statement, re.S)
+        if match is not None:
+            connection.execute('DROP TRIGGER IF EXISTS {0}{1}'.format(
+                match.group(1), ' ON ' + match.group(2)
+                if connection.dialect.name == 'postgresql' else ''))
+        connection.execute(statement)
@@ -0,0 +1,171 @@
+# -*- coding:Utf8 -*-
+
+
+"""
+    Password hashing service.
+    bcrypt is slow on purpose. Hashes and checks run inside a bounded pool
+    of threads (bcrypt releases the GIL) so a burst of logins can not keep
+    every request thread busy: when all workers are busy and the queue is
+    full, new demands are rejected at once with a 503.
+    Demands only queue up when a process answers many requests at once
+    (threaded or gevent gunicorn workers). A sync worker answers one
+    request at a time, which waits for its own bcrypt call: there the pool
+    never holds more than one demand and never answers 503.
+"""
+
+import os
+import threading
+
+try:
+    import queue
+except ImportError:  # Python2
+    import Queue as queue
+
+from werkzeug.exceptions import ServiceUnavailable
+
+
+class PasswordServiceBusy(ServiceUnavailable):
+
+    """
+        Raised when the password pool can not take another demand.
+    """
+
+    description = "error: Too many password checks in progress, please retry later."
+
+
+class _Job(object):
+
+    """
+        One bcrypt call waiting for a worker.
+    """
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args)
+        except Exception as error:
+            self.error = error
+        finally:
+            self.done.set()
+
+
+class PasswordService(object):
+
+    """
+        Run bcrypt of a Flask-Bcrypt object inside a bounded thread pool.
+        Configuration:
+            PASSWORD_HASH_WORKERS: bcrypt calls run at the same time.
+            PASSWORD_HASH_MAX_QUEUE: demands allowed to wait for a worker.
+            BCRYPT_LOG_ROUNDS: cost factor of new hashes.
+    """
+
+    def __init__(self, app=None, bcrypt=None):
+        self._lock = threading.Lock()
+        self._jobs = None
+        self._pid = None
+        self.workers = 0
+        # Demands queued or running, and demands rejected so far.
+        self.pending = 0
+        self.rejected = 0
+        if app is not None:
+            self.init_app(app, bcrypt)
+
+    def init_app(self, app, bcrypt):
+        self.app = app
+        self.bcrypt = bcrypt
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 2)
+        app.config.setdefault('PASSWORD_HASH_MAX_QUEUE', 8)
+
+    @property
+    def queue_depth(self):
+        """
+            Number of demands waiting for a free worker.
+        """
+        return max(0, self.pending - self.workers)
+
+    def register_metrics(self, metrics):
+        """
+            Expose pool load on /metrics of a RequestMetrics object.
+        """
+        metrics.register('password_hash_queue_depth', 'gauge',
+                         'Password demands waiting for a free worker.',
+                         lambda: self.queue_depth)
+        metrics.register('password_hash_pending', 'gauge',
+                         'Password demands queued or running.',
+                         lambda: self.pending)
+        metrics.register('password_hash_rejected_total', 'counter',
+                         'Password demands answered by 503.',
+                         lambda: self.rejected)
+
+    @property
+    def rounds(self):
+        return self.app.config.get('BCRYPT_LOG_ROUNDS', 12)
+
+    def _start(self):
+        """
+            Start workers on first use, and again inside each forked process
+            since threads do not survive a fork.
+        """
+        self._jobs = queue.Queue()
+        self._pid = os.getpid()
+        self.workers = self.app.config['PASSWORD_HASH_WORKERS']
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+
+    def _work(self):
+        while True:
+            self._jobs.get().run()
+
+    def _submit(self, func, *args):
+        """
+            Run func inside the pool and wait for its result.
+            Raise PasswordServiceBusy if the pool is saturated.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start()
+            if self.pending >= self.workers + self.app.config['PASSWORD_HASH_MAX_QUEUE']:
+                self.rejected += 1
+                raise PasswordServiceBusy()
+            self.pending += 1
+        job = _Job(func, args)
+        try:
+            self._jobs.put(job)
+            job.done.wait()
+        finally:
+            with self._lock:
+                self.pending -= 1
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def hash(self, password):
+        """
+            Return bcrypt hash of password using the configured cost factor.
+        """
+        return self._submit(self.bcrypt.generate_password_hash, password,
+                            self.rounds)
+
+    def check(self, pw_hash, password):
+        """
+            True if password matches pw_hash.
+        """
+        return self._submit(self.bcrypt.check_password_hash, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """
+            True if pw_hash was built with another cost factor than the
+            configured one ($2a$<cost>$...).
+        """
+        try:
+            return int(pw_hash.split('$')[2]) != self.rounds
+        except (AttributeError, IndexError, ValueError):
+            return False
@@ -0,0 +1,196 @@
+# -*- coding:Utf8 -*-
+
+
+"""
+    Database connection pools: pessimistic disconnect handling and live
+    statistics.
+    Engines are built with an instrumented subclass of the pool class the
+    driver would use, which measures how long getting a connection takes.
+    Pool events count checkouts, connections in use and connection
+    lifetimes. Statistics are per process: under gunicorn each worker has
+    its own pools.
+    Configuration (pool settings are the Flask-SQLAlchemy ones, None keeps
+    the driver default):
+        SQLALCHEMY_POOL_SIZE: connections kept open by the pool.
+        SQLALCHEMY_MAX_OVERFLOW: connections opened beyond pool size under
+            load, closed once given back.
+        SQLALCHEMY_POOL_TIMEOUT: seconds to wait for a connection before
+            failing.
+        SQLALCHEMY_POOL_RECYCLE: seconds before a connection is replaced.
+        SQLALCHEMY_POOL_PRE_PING: test connections when checked out and
+            replace dead ones, instead of failing the request.
+"""
+
+import threading
+import time
+
+from sqlalchemy import event, exc
+
+
+class PoolStats(object):
+
+    """
+        Counters of one connection pool, updated by its events.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._opened = {}
+        self.pool = None
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.disconnects = 0
+        self.timeouts = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.closed = 0
+        self.lifetime_total = 0.0
+        self.lifetime_max = 0.0
+
+    def connected(self, dbapi_connection):
+        with self._lock:
+            self.connects += 1
+            self._opened[id(dbapi_connection)] = time.time()
+
+    def disconnected(self, dbapi_connection):
+        with self._lock:
+            opened = self._opened.pop(id(dbapi_connection), None)
+            if opened is None:
+                return
+            lifetime = time.time() - opened
+            self.closed += 1
+            self.lifetime_total += lifetime
+            self.lifetime_max = max(self.lifetime_max, lifetime)
+
+    def checked_out(self, connection_record):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            connection_record.info['pool_checked_out'] = True
+
+    def checked_in(self, connection_record):
+        with self._lock:
+            self.checkins += 1
+            if connection_record.info.pop('pool_checked_out', False):
+                self.in_use -= 1
+
+    def waited(self, seconds):
+        with self._lock:
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        """
+            Return counters as a dict. Times are in milliseconds, lifetimes
+            in seconds.
+        """
+        with self._lock:
+            now = time.time()
+            data = {
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'disconnects': self.disconnects,
+                'timeouts': self.timeouts,
+                'in_use': self.in_use,
+                'peak_in_use': self.peak_in_use,
+                'open': len(self._opened),
+                'checkout_wait_avg_ms': round(
+                    1000 * self.wait_total / self.checkouts, 3)
+                if self.checkouts else 0.0,
+                'checkout_wait_max_ms': round(1000 * self.wait_max, 3),
+                'closed': self.closed,
+                'lifetime_avg_s': round(self.lifetime_total / self.closed, 3)
+                if self.closed else 0.0,
+                'lifetime_max_s': round(self.lifetime_max, 3),
+                'oldest_open_s': round(now - min(self._opened.values()), 3)
+                if self._opened else 0.0,
+            }
+        pool = self.pool
+        data['pool'] = type(pool).__name__ if pool is not None else None
+        # Only queue pools have a size and an overflow.
+        for name in ('size', 'overflow', 'checkedin'):
+            method = getattr(pool, name, None)
+            data[name] = method() if method is not None else None
+        return data
+
+
+class InstrumentedPool(object):
+
+    """
+        Pool mixin timing checkouts and closing of connections.
+        Subclasses are made by pool_class(): stats is a class attribute so
+        it outlives pools recreated by engine.dispose().
+    """
+
+    stats = None
+
+    def __init__(self, *args, **kwargs):
+        super(InstrumentedPool, self).__init__(*args, **kwargs)
+        self.stats.pool = self
+
+    def connect(self):
+        return self._timed(super(InstrumentedPool, self).connect)
+
+    def unique_connection(self):
+        return self._timed(super(InstrumentedPool, self).unique_connection)
+
+    def _timed(self, checkout):
+        start = time.time()
+        try:
+            return checkout()
+        except exc.TimeoutError:
+            self.stats.count('timeouts')
+            raise
+        finally:
+            self.stats.waited(time.time() - start)
+
+    def _close_connection(self, connection):
+        self.stats.disconnected(connection)
+        super(InstrumentedPool, self)._close_connection(connection)
+
+
+def pool_class(base, stats, pre_ping=False):
+    """
+        Return a subclass of pool class base recording into stats.
+    """
+    cls = type('Instrumented' + base.__name__, (InstrumentedPool, base),
+               {'stats': stats})
+
+    if pre_ping:
+        # Registered first: a dead connection is replaced before being
+        # counted as checked out.
+        @event.listens_for(cls, 'checkout')
+        def ping(dbapi_connection, connection_record, connection_proxy):
+            try:
+                cursor = dbapi_connection.cursor()
+                try:
+                    cursor.execute('SELECT 1')
+                finally:
+                    cursor.close()
+            except Exception:
+                stats.count('disconnects')
+                # Pool retries the checkout with a new connection.
+                raise exc.DisconnectionError()
+
+    @event.listens_for(cls, 'connect')
+    def connect(dbapi_connection, connection_record):
+        stats.connected(dbapi_connection)
+
+    @event.listens_for(cls, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        stats.checked_out(connection_record)
+
+    @event.listens_for(cls, 'checkin')
+    def checkin(dbapi_connection, connection_record):
+        stats.checked_in(connection_record)
+
+    return cls
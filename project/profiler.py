@@ -0,0 +1,154 @@
+# -*- coding:Utf8 -*-
+
+
+"""
+    Opt-in SQL profiler of requests.
+    Counts statements and database time of each request and sends them
+    inside a Server-Timing header. Statements run many times with the same
+    shape inside one request are logged as likely N+1 queries, statements
+    slower than a threshold are written to the slow query log.
+    Cursor listeners are only registered once the profiler is turned on:
+    when off, a request costs one config lookup.
+    Streamed responses (export, live feed) are only profiled until their
+    headers are sent.
+    Configuration:
+        SQL_PROFILER: profile requests.
+        SQL_PROFILER_REPEATED: statements of the same shape inside one
+            request before they are logged as a likely N+1.
+        SQL_PROFILER_SLOW_MS: statements slower than this are logged.
+        SQL_SLOW_QUERY_LOG: file of the slow query log, if set.
+"""
+
+import logging
+import re
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Logger of likely N+1 queries.
+logger = logging.getLogger('project.sql')
+# Logger of slow statements.
+slow_logger = logging.getLogger('project.sql.slow')
+
+literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+placeholders = re.compile(r"%\(\w+\)s|%s|(?<!:):\w+|\$\d+")
+lists = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+
+def normalize_sql(statement):
+    """
+        Return shape of a statement: literals and bound parameters become
+        ?, lists of them (?) and whitespace is collapsed.
+    """
+    shape = placeholders.sub('?', literals.sub('?', statement))
+    return ' '.join(lists.sub('(?)', shape).split())
+
+
+class RequestProfile(object):
+
+    """
+        Statements run by one request.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.shapes[normalize_sql(statement)] += 1
+
+    def repeated(self, threshold):
+        """
+            Return (count, shape) of statements run at least threshold
+            times, most run first.
+        """
+        return [(count, shape) for shape, count in self.shapes.most_common()
+                if count >= threshold]
+
+
+class SQLProfiler(object):
+
+    """
+        Profile statements run by each request while SQL_PROFILER is set.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('SQL_PROFILER', False)
+        app.config.setdefault('SQL_PROFILER_REPEATED', 5)
+        app.config.setdefault('SQL_PROFILER_SLOW_MS', 100)
+        app.config.setdefault('SQL_SLOW_QUERY_LOG', None)
+        if app.config['SQL_SLOW_QUERY_LOG']:
+            handler = logging.FileHandler(app.config['SQL_SLOW_QUERY_LOG'])
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            slow_logger.addHandler(handler)
+            slow_logger.setLevel(logging.INFO)
+        app.before_request(self.start)
+        app.after_request(self.finish)
+
+    def listen(self):
+        with self._lock:
+            if self._listening:
+                return
+            event.listen(Engine, 'before_cursor_execute', before_execute)
+            event.listen(Engine, 'after_cursor_execute', after_execute)
+            self._listening = True
+
+    def start(self):
+        if not self.app.config['SQL_PROFILER']:
+            return
+        self.listen()
+        g.sql_profile = RequestProfile()
+
+    def finish(self, response):
+        profile = getattr(g, 'sql_profile', None)
+        if profile is None:
+            return response
+        g.sql_profile = None
+        response.headers.add('Server-Timing',
+                             'db;dur={0:.3f};desc="{1} statements"'.format(
+                                 1000 * profile.duration, profile.count))
+        threshold = self.app.config['SQL_PROFILER_REPEATED']
+        for count, shape in profile.repeated(threshold):
+            logger.warning('Likely N+1 on %s %s: %d x %s', request.method,
+                           request.path, count, shape)
+        return response
+
+
+def current_profile():
+    if not has_request_context():
+        return None
+    return getattr(g, 'sql_profile', None)
+
+
+# Start time is kept on the execution context: it lives as long as the
+# statement, a failed one leaves nothing behind.
+def before_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and current_profile() is not None:
+        context._profiler_start = time.time()
+
+
+def after_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile()
+    start = getattr(context, '_profiler_start', None)
+    if profile is None or start is None:
+        return
+    duration = time.time() - start
+    profile.record(statement, duration)
+    if 1000 * duration >= current_app.config['SQL_PROFILER_SLOW_MS']:
+        slow_logger.warning('%.1f ms on %s %s: %s', 1000 * duration,
+                            request.method, request.path,
+                            normalize_sql(statement))
@@ -0,0 +1,130 @@
+# -*- coding:Utf8 -*-
+
+
+"""
+    Route reads of read-only requests to a replica database.
+    GET, HEAD and OPTIONS requests read from the replica, every other
+    request and every statement which writes (flush, INSERT, UPDATE, DELETE)
+    uses the primary. Once a session wrote, it stays on the primary.
+    A client whose request committed a write reads from the primary for a
+    while (the replica may lag), so users always read their own writes.
+    Outside requests (scripts, background threads) sessions use the primary.
+    Configuration:
+        SQLALCHEMY_REPLICA_URI: replica database, reads stay on the primary
+            if unset.
+        SQLALCHEMY_REPLICA_STICKY: seconds a client reads from the primary
+            after one of its writes.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import has_request_context, request, session
+from flask.ext.sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.sql.expression import UpdateBase
+
+from project.pools import PoolStats, pool_class
+
+READ_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+
+class RoutingSession(SignallingSession):
+
+    """
+        Session sending reads to the replica while info['replica'] is set.
+    """
+
+    def __init__(self, db, **options):
+        self._db = db
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            # Writes, then every later read, go to the primary.
+            self.info['wrote'] = True
+            self.info['replica'] = False
+        elif self.info.get('replica'):
+            return self._db.get_replica_engine(self.app)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    """
+        SQLAlchemy extension whose sessions route reads to a replica.
+        Engines use instrumented pools whose statistics are kept inside
+        pool_stats, by database ('primary' or 'replica').
+    """
+
+    def __init__(self, app=None, **kwargs):
+        self._replica_lock = threading.Lock()
+        self._replicas = {}
+        self.pool_stats = OrderedDict()
+        SQLAlchemy.__init__(self, app, **kwargs)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICA_URI', None)
+        app.config.setdefault('SQLALCHEMY_REPLICA_STICKY', 10)
+        app.config.setdefault('SQLALCHEMY_POOL_PRE_PING', False)
+        SQLAlchemy.init_app(self, app)
+
+        @app.before_request
+        def route_request():
+            self.session.info['replica'] = (
+                bool(app.config['SQLALCHEMY_REPLICA_URI']) and
+                request.method in READ_METHODS and
+                session.get('db_primary_until', 0) < time.time())
+
+        # Client which wrote reads from the primary until replica caught up.
+        @event.listens_for(RoutingSession, 'after_commit')
+        def after_commit(db_session):
+            wrote = db_session.info.pop('wrote', False)
+            if wrote and app.config['SQLALCHEMY_REPLICA_URI'] and \
+                    has_request_context():
+                session['db_primary_until'] = \
+                    time.time() + app.config['SQLALCHEMY_REPLICA_STICKY']
+
+        @event.listens_for(RoutingSession, 'after_rollback')
+        def after_rollback(db_session):
+            db_session.info.pop('wrote', None)
+
+    def create_session(self, options):
+        return RoutingSession(self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        SQLAlchemy.apply_driver_hacks(self, app, info, options)
+        self.instrument_pool(app, info, options, 'primary')
+
+    def instrument_pool(self, app, info, options, name):
+        """
+            Build engine with an instrumented subclass of the pool class
+            the driver would use.
+        """
+        base = options.get('poolclass') or \
+            info.get_dialect().get_pool_class(info)
+        stats = self.pool_stats[name] = PoolStats()
+        options['poolclass'] = pool_class(
+            base, stats, app.config['SQLALCHEMY_POOL_PRE_PING'])
+
+    def get_replica_engine(self, app=None):
+        """
+            Return engine of the replica database, None if none is set.
+            Pool options and driver fixes are the ones of the primary.
+        """
+        app = self.get_app(app)
+        uri = app.config['SQLALCHEMY_REPLICA_URI']
+        if not uri:
+            return None
+        with self._replica_lock:
+            engine = self._replicas.get(uri)
+            if engine is None:
+                info = make_url(uri)
+                options = {'convert_unicode': True}
+                self.apply_pool_defaults(app, options)
+                SQLAlchemy.apply_driver_hacks(self, app, info, options)
+                self.instrument_pool(app, info, options, 'replica')
+                engine = self._replicas[uri] = create_engine(info, **options)
+            return engine
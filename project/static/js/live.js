@@ -0,0 +1,34 @@
+// Keep task tables current with the server live feed, without reloading.
+$(function () {
+    var feed = $('script[data-feed]').data('feed');
+    if (!window.EventSource || !feed) {
+        return;
+    }
+    var openTasks = $('#open-tasks');
+    var closedTasks = $('#closed-tasks');
+    var source = new EventSource(feed);
+
+    function row(event) {
+        return $('tr[data-task-id="' + JSON.parse(event.data).task_id + '"]');
+    }
+
+    // Rows come from the server: action links depend on the viewer.
+    function refreshOpenTasks() {
+        $.get(openTasks.data('rows'), function (rows) {
+            openTasks.children('tbody').html(rows);
+        });
+    }
+
+    source.addEventListener('created', refreshOpenTasks);
+    source.addEventListener('updated', refreshOpenTasks);
+    source.addEventListener('completed', function (event) {
+        openTasks.find(row(event)).remove();
+    });
+    source.addEventListener('deleted', function (event) {
+        row(event).remove();
+    });
+    // Archived tasks leave closed tasks, history is only read when asked.
+    source.addEventListener('archived', function (event) {
+        closedTasks.find(row(event)).remove();
+    });
+});
@@ -0,0 +1,17 @@
+// Closed tasks are collapsed: fetch their rows by pages when asked.
+$(function () {
+    var more = $('#closed-tasks-more');
+    more.on('click', function (event) {
+        event.preventDefault();
+        more.hide();
+        $.get(more.attr('href'), function (rows, status, xhr) {
+            $('#closed-tasks').show().children('tbody').append(rows);
+            // Next page url is sent inside the Link header.
+            var next = /<([^>]+)>;\s*rel="next"/.exec(
+                xhr.getResponseHeader('Link') || '');
+            if (next) {
+                more.attr('href', next[1]).text('Show more closed tasks').show();
+            }
+        });
+    });
+});
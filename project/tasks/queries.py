@@ -0,0 +1,383 @@
+# -*- coding:Utf8 -*-
+
+
+"""
+    Shared write queries on tasks used by html views and api.
+    Each write is a single conditional statement: ownership is part of the
+    WHERE clause so the task is never fetched before being changed.
+    Every write path must call bump_tasks_version() inside its transaction.
+    Writes are also logged into task_changes by database triggers: the end
+    of this log is the version of the tasks collection.
+"""
+
+# Import
+import datetime
+import re
+from project import db
+from sqlalchemy import (and_, bindparam, case, column, func, literal_column,
+                        or_, select, table, tuple_, union_all)
+from sqlalchemy.orm import aliased
+from project.models import (Task, TaskArchive, TaskChange, User,
+                            UserTaskStats)
+
+
+def tasks_version():
+    """
+        Return (version, updated_at) of the whole tasks collection, read
+        from the end of the task changes log: writes never update a shared
+        row. On PostgreSQL a change committed out of change_id order leaves
+        the highest id unchanged, the last settled change is part of the
+        version so it still moves.
+    """
+    row = db.session.query(TaskChange.change_id, TaskChange.changed_at) \
+        .order_by(TaskChange.change_id.desc()).first()
+    if row is None:
+        return 0, None
+    version = row.change_id
+    if db.engine.dialect.name == 'postgresql':
+        version = '{0}.{1}'.format(version, last_change_id())
+    return version, row.changed_at
+
+
+def bump_tasks_version():
+    """
+        Mark the tasks collection as changed: the live feed is woken up
+        once this transaction commits. Nothing is written, the version is
+        moved by the changes logged by triggers.
+    """
+    db.session.info['tasks_changed'] = True
+
+
+def settled_changes(query):
+    """
+        Keep changes of transactions older than every running one: no
+        change can be committed before them anymore. SQLite runs one writer
+        at a time, all its committed changes are settled.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return query
+    return query.filter(TaskChange.txid < func.txid_snapshot_xmin(
+        func.txid_current_snapshot()))
+
+
+def change_order():
+    """
+        Return columns ordering the log of task changes (see TaskChange).
+    """
+    if db.engine.dialect.name == 'postgresql':
+        return [TaskChange.txid, TaskChange.change_id]
+    return [TaskChange.change_id]
+
+
+def last_change_id():
+    """
+        Return id of the last settled task change, 0 if none.
+    """
+    query = settled_changes(db.session.query(TaskChange.change_id))
+    return query.order_by(*[column.desc() for column in change_order()]) \
+        .limit(1).scalar() or 0
+
+
+def changes_since(change_id, limit=None):
+    """
+        Return (change_id, task_id, kind) of settled task changes logged
+        after change change_id, oldest first.
+    """
+    query = settled_changes(db.session.query(
+        TaskChange.change_id, TaskChange.task_id, TaskChange.kind))
+    if change_id and db.engine.dialect.name == 'postgresql':
+        cursor = TaskChange.__table__.alias('last_read')
+        txid = select([cursor.c.txid]).where(
+            cursor.c.change_id == change_id).as_scalar()
+        query = query.filter(tuple_(TaskChange.txid, TaskChange.change_id) >
+                             tuple_(txid, change_id))
+    else:
+        query = query.filter(TaskChange.change_id > change_id)
+    query = query.order_by(*change_order())
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+def change_expired(change_id):
+    """
+        True if change change_id was pruned from the log: changes logged
+        after it may be gone too.
+    """
+    return bool(change_id) and db.session.query(TaskChange.change_id).filter_by(
+        change_id=change_id).first() is None
+
+
+def prune_task_changes(before):
+    """
+        Delete task changes logged before `before`, except the last one so
+        up to date cursors stay valid. Return number of deleted changes.
+    """
+    deleted = db.session.query(TaskChange).filter(
+        TaskChange.changed_at < before,
+        TaskChange.change_id != last_change_id()).delete(
+        synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def task_counts(user_id):
+    """
+        Return (open, closed) tasks counts of user, read from the counters
+        kept by triggers instead of counting tasks.
+    """
+    row = db.session.query(UserTaskStats.open_count,
+                           UserTaskStats.closed_count).filter_by(
+        user_id=user_id).first()
+    return tuple(row) if row is not None else (0, 0)
+
+
+def rebuild_task_stats():
+    """
+        Rebuild counters of every user from tasks and archived tasks.
+        Nothing is committed.
+    """
+    stats = UserTaskStats.__table__
+    history = history_select().alias('history')
+    open_count = func.sum(case([(history.c.status == 1, 1)], else_=0))
+    closed_count = func.sum(case([(history.c.status != 1, 1)], else_=0))
+    db.session.execute(stats.delete())
+    db.session.execute(stats.insert().from_select(
+        ['user_id', 'open_count', 'closed_count'],
+        select([User.user_id, func.coalesce(open_count, 0),
+                func.coalesce(closed_count, 0)]).select_from(
+            User.__table__.outerjoin(
+                history, history.c.user_id == User.user_id)).group_by(
+            User.user_id)))
+
+
+def history_select():
+    """
+        Return SELECT of all tasks: live ones then archived ones, with tasks
+        columns.
+    """
+    columns = [column.name for column in Task.__table__.c]
+    archive = TaskArchive.__table__
+    return union_all(select([Task.__table__]),
+                     select([archive.c[name] for name in columns]))
+
+
+def tasks_history():
+    """
+        Return an entity usable like Task to read live and archived tasks
+        together.
+    """
+    return aliased(Task, history_select().alias('tasks_history'))
+
+
+def archive_closed_tasks(before, batch_size):
+    """
+        Move tasks closed and not changed since `before` into tasks_archive,
+        by batches of batch_size tasks: each batch is its own short
+        transaction so writers are never blocked for long.
+        Each batch walks the primary key from the last task seen, so the
+        whole job reads tasks once whatever the number of batches.
+        A task whose id is already archived (reused before ids were
+        AUTOINCREMENT on SQLite) stays in tasks.
+        Return number of tasks archived.
+    """
+    tasks, archive = Task.__table__, TaskArchive.__table__
+    columns = [column.name for column in tasks.c]
+    archived = 0
+    last = 0
+    while True:
+        ids = [row[0] for row in db.session.query(Task.task_id).filter(
+            Task.task_id > last, Task.status == 0,
+            or_(Task.updated_at < before, Task.updated_at.is_(None)),
+            ~db.session.query(TaskArchive.task_id).filter(
+                TaskArchive.task_id == Task.task_id).exists()).order_by(
+            Task.task_id).limit(batch_size)]
+        if not ids:
+            return archived
+        last = ids[-1]
+        # Row must be inside the archive before the DELETE: triggers use it
+        # to log the task as archived, and keep its user closed counter.
+        db.session.execute(archive.insert().from_select(
+            columns + ['archived_at'],
+            select([tasks.c[name] for name in columns] + [
+                bindparam('archived_at', datetime.datetime.utcnow(),
+                          type_=db.DateTime)]).where(tasks.c.task_id.in_(ids))))
+        db.session.execute(tasks.delete().where(tasks.c.task_id.in_(ids)))
+        bump_tasks_version()
+        db.session.commit()
+        archived += len(ids)
+
+
+def search_words(text):
+    """
+        Return words of a search demand. Any FTS operator or quote typed by
+        the user is dropped, so the demand can not break the FTS syntax.
+    """
+    return re.findall(r'\w+', text, re.UNICODE)
+
+
+def search_tasks(words, *entities):
+    """
+        Query for tasks entities (Task or its columns) whose name holds every
+        word (or a word starting with it), best ranked first.
+        Uses the FTS index of the database: FTS5 on SQLite, GIN tsvector
+        index on PostgreSQL. Other databases fall back to a LIKE scan.
+    """
+    query = db.session.query(*entities).select_from(Task)
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        fts = table('tasks_fts', column('rowid'))
+        # FTS5 matches and ranks through the table name itself.
+        fts_name = literal_column('tasks_fts')
+        terms = u' '.join(u'"{0}"*'.format(word) for word in words)
+        return query.join(fts, fts.c.rowid == Task.task_id) \
+            .filter(fts_name.match(terms)) \
+            .order_by(func.bm25(fts_name), Task.task_id)
+    if dialect == 'postgresql':
+        vector = func.to_tsvector('simple', Task.name)
+        tsquery = func.to_tsquery('simple', u' & '.join(
+            u'{0}:*'.format(word) for word in words))
+        return query.filter(vector.op('@@')(tsquery)) \
+            .order_by(func.ts_rank(vector, tsquery).desc(), Task.task_id)
+    return query.filter(and_(*[Task.name.ilike(u'%{0}%'.format(word))
+                               for word in words])).order_by(Task.task_id)
+
+
+def supports_returning():
+    """
+        True if database can send back changed rows (UPDATE/DELETE RETURNING).
+    """
+    return db.engine.dialect.implicit_returning
+
+
+def authorized(task_id, user_id, is_admin):
+    """
+        Return WHERE clause matching task_id if user can update or delete it.
+    """
+    criterion = Task.__table__.c.task_id == task_id
+    if not is_admin:
+        criterion &= Task.__table__.c.user_id == user_id
+    return criterion
+
+
+def missing_or_forbidden(task_id):
+    """
+        Tell why a conditional write matched nothing: 404 if task does not
+        exist, 403 if it belongs to another user.
+        Only run when the write failed, so the usual path stays one statement.
+    """
+    exists = db.session.query(Task.task_id).filter_by(task_id=task_id).first()
+    return 403 if exists else 404
+
+
+def run(statement, task_id):
+    """
+        Execute a conditional write and return (status, row).
+        row is the changed task if database supports RETURNING, None otherwise.
+    """
+    if supports_returning():
+        row = db.session.execute(statement.returning(*Task.__table__.c)).first()
+        if row is not None:
+            bump_tasks_version()
+            return 200, row
+    elif db.session.execute(statement).rowcount:
+        bump_tasks_version()
+        return 200, None
+    return missing_or_forbidden(task_id), None
+
+
+def update_task(task_id, values, user_id, is_admin):
+    """
+        Update task fields with values in a single statement.
+        Nothing is committed.
+    """
+    statement = Task.__table__.update().where(
+        authorized(task_id, user_id, is_admin)).values(**values)
+    return run(statement, task_id)
+
+
+def delete_task(task_id, user_id, is_admin):
+    """
+        Delete task in a single statement.
+        Nothing is committed.
+    """
+    statement = Task.__table__.delete().where(
+        authorized(task_id, user_id, is_admin))
+    return run(statement, task_id)
+
+
+def owned(ids, user_id, is_admin):
+    """
+        Return WHERE clause matching tasks among ids user can update or
+        delete.
+    """
+    criterion = Task.__table__.c.task_id.in_(ids)
+    if not is_admin:
+        criterion &= Task.__table__.c.user_id == user_id
+    return criterion
+
+
+def run_bulk(statement, ids, user_id, is_admin):
+    """
+        Execute a write on the tasks among ids user can change and return
+        ids of changed tasks, in ids order.
+        Without RETURNING (SQLite, one writer at a time), matching tasks are
+        read first and only those are written. If rowcount tells another
+        transaction changed some in between, changed tasks are the last
+        ones logged: the write holds the database lock.
+    """
+    if supports_returning():
+        changed = set(row[0] for row in db.session.execute(
+            statement.where(owned(ids, user_id, is_admin)).returning(
+                Task.__table__.c.task_id)))
+    else:
+        changed = set(row[0] for row in db.session.execute(
+            select([Task.__table__.c.task_id]).where(
+                owned(ids, user_id, is_admin))))
+        count = db.session.execute(statement.where(
+            owned(sorted(changed), user_id, is_admin))).rowcount \
+            if changed else 0
+        if count != len(changed):
+            changed = set(task_id for task_id, in db.session.query(
+                TaskChange.task_id).order_by(
+                TaskChange.change_id.desc()).limit(count))
+    if changed:
+        bump_tasks_version()
+    return [task_id for task_id in ids if task_id in changed]
+
+
+def update_tasks(ids, values, user_id, is_admin):
+    """
+        Update fields of many tasks with values in a single statement.
+        Nothing is committed.
+    """
+    return run_bulk(Task.__table__.update().values(**values), ids, user_id,
+                    is_admin)
+
+
+def delete_tasks(ids, user_id, is_admin):
+    """
+        Delete many tasks in a single statement.
+        Nothing is committed.
+    """
+    return run_bulk(Task.__table__.delete(), ids, user_id, is_admin)
+
+
+def insert_tasks(values):
+    """
+        Insert many tasks and return their ids, in values order.
+        With RETURNING this is one multi rows INSERT. Otherwise (SQLite,
+        no round trip) rows are inserted one by one to read their ids.
+        Nothing is committed.
+    """
+    if not values:
+        return []
+    if supports_returning():
+        ids = [row[0] for row in db.session.execute(
+            Task.__table__.insert().values(values).returning(
+                Task.__table__.c.task_id))]
+    else:
+        db.session.bulk_insert_mappings(Task, values, return_defaults=True)
+        ids = [task['task_id'] for task in values]
+    bump_tasks_version()
+    return ids
@@ -8,11 +8,17 @@
 # Import
 import datetime
 from functools import wraps
-from flask import (flash, redirect, render_template,
-                   request, session, url_for, Blueprint)
+from flask import (abort, current_app, flash, make_response, Markup, redirect,
+                   render_template, request, Response, session, url_for,
+                   Blueprint)
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
 from .forms import AddTaskForm
-from project import db
-from project.models import Task
+from project import db, fragments, live
+from project.models import Task, TaskArchive
+from .queries import (bump_tasks_version, changes_since, delete_task,
+                      search_tasks, search_words, task_counts, tasks_version,
+                      update_task)
 
 
 # Config
@@ -35,23 +41,171 @@ def login_required(test):
     return wrapper
 
 
-def open_tasks():
-    return db.session.query(Task).filter_by(
-        status='1').order_by(Task.due_date.asc())
+def page_cursor(name):
+    """
+        Return the (due_date, task_id) key of a page cursor sent inside the
+        query string, None if absent or malformed (first page is shown).
+    """
+    cursor = request.args.get(name)
+    if not cursor:
+        return None
+    try:
+        due_date, task_id = cursor.split('_')
+        return (datetime.datetime.strptime(due_date, '%Y-%m-%d').date(),
+                int(task_id))
+    except ValueError:
+        return None
 
 
-def closed_tasks():
-    return db.session.query(Task).filter_by(
-        status='0').order_by(Task.due_date.asc())
+def task_page(status, after=None, model=Task):
+    """
+        Return (tasks, next page cursor) for one page of tasks having status,
+        ordered by (due_date, task_id) with their poster joined.
+        Pages seek after the key of the previous one instead of using OFFSET,
+        so deep pages of a long history cost the same as the first one.
+        model is Task, or TaskArchive to read archived tasks.
+    """
+    per_page = current_app.config['TASKS_PER_PAGE']
+    query = db.session.query(model).options(joinedload(model.poster)).filter(
+        model.status == status).order_by(model.due_date.asc(),
+                                         model.task_id.asc())
+    if after is not None:
+        due_date, task_id = after
+        query = query.filter(model.due_date >= due_date,
+                             or_(model.due_date > due_date,
+                                 model.task_id > task_id))
+    tasks = query.limit(per_page + 1).all()
+    if len(tasks) <= per_page:
+        return tasks, None
+    last = tasks[per_page - 1]
+    return tasks[:per_page], '{0}_{1}'.format(last.due_date.isoformat(),
+                                              last.task_id)
+
+
+def task_rows(status, cursor_name, archived=False):
+    """
+        Return (rendered rows, next page cursor) of one page of tasks, or of
+        archived tasks.
+        Rows only depend on tasks version, page and viewer rights (action
+        links), so they are cached under those: any write changes the key.
+    """
+    cursor = page_cursor(cursor_name)
+    if session['role'] == "admin":
+        viewer = 'admin'
+    else:
+        viewer = 'user{0}'.format(session['user_id'])
+    key = 'tasks/{0}/{1}/{2}/{3}/{4}'.format(
+        tasks_version()[0], viewer, status, 'archive' if archived else 'live',
+        '{0}_{1}'.format(*cursor) if cursor else '')
+
+    def render():
+        tasks, next_cursor = task_page(status, cursor,
+                                       TaskArchive if archived else Task)
+        return (render_template('_task_page.html', tasks=tasks,
+                                open=status == 1, archived=archived),
+                next_cursor)
+    return fragments.get_or_render(key, render)
+
+
+def render_tasks(form, error=None):
+    """
+        Render tasks page with one page of open tasks.
+        Closed tasks are not queried: the page fetches them on demand.
+    """
+    open_rows, open_next = task_rows(1, 'open_after')
+    open_count, closed_count = task_counts(session['user_id'])
+    return render_template('tasks.html', form=form, error=error,
+                           open_count=open_count, closed_count=closed_count,
+                           open_rows=Markup(open_rows), open_next=open_next,
+                           first_page='open_after' in request.args,
+                           username=session['name'])
 
 
 # Routes
 @tasks_blueprint.route('/tasks/')
 @login_required
 def tasks():
-    return render_template('tasks.html', form=AddTaskForm(request.form),
-                           open_tasks=open_tasks(), closed_tasks=closed_tasks(),
-                           username=session['name'])
+    return render_tasks(AddTaskForm(request.form))
+
+
+@tasks_blueprint.route('/tasks/search/')
+@login_required
+def search():
+    """
+        Tasks whose name holds every searched word, best ranked first, by
+        pages of TASKS_PER_PAGE tasks.
+    """
+    query = request.args.get('q', '')
+    offset = request.args.get('offset', 0, type=int)
+    per_page = current_app.config['TASKS_PER_PAGE']
+    tasks, next_offset = [], None
+    words = search_words(query)
+    if words:
+        tasks = search_tasks(words, Task).options(joinedload(Task.poster)) \
+            .limit(per_page + 1).offset(max(offset, 0)).all()
+        if len(tasks) > per_page:
+            tasks, next_offset = tasks[:per_page], max(offset, 0) + per_page
+    return render_template('search.html', tasks=tasks, query=query,
+                           next_offset=next_offset, username=session['name'])
+
+
+@tasks_blueprint.route('/tasks/open/')
+@login_required
+def open_tasks():
+    """
+        HTML rows of one page of open tasks, used to refresh the tasks page
+        in place.
+    """
+    rows, _ = task_rows(1, 'open_after')
+    return rows
+
+
+@tasks_blueprint.route('/tasks/live/')
+@login_required
+def live_feed():
+    """
+        Server-Sent Events stream of task changes (created, updated,
+        completed, deleted, archived). A reconnecting client first gets
+        changes made after its Last-Event-ID. Not found unless LIVE_FEED
+        is set.
+    """
+    if not current_app.config['LIVE_FEED']:
+        abort(404)
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    subscription = live.subscribe()
+    backlog = []
+    if last_event_id is not None:
+        backlog = changes_since(last_event_id,
+                                current_app.config['LIVE_FEED_BACKLOG'])
+    # Stream stays open for minutes: give database connection back now.
+    db.session.remove()
+    return Response(live.stream(subscription, backlog),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
+
+
+@tasks_blueprint.route('/tasks/closed/')
+@login_required
+def closed_tasks():
+    """
+        HTML rows of one page of closed tasks, appended to the tasks page.
+        Next page url is sent inside the `Link` header. Archived tasks come
+        after live closed ones (history).
+    """
+    archived = bool(request.args.get('archive'))
+    rows, next_cursor = task_rows(0, 'after', archived)
+    response = make_response(rows)
+    next_url = None
+    if next_cursor is not None:
+        next_url = url_for('tasks.closed_tasks', after=next_cursor,
+                           archive=1 if archived else None)
+    elif not archived and db.session.query(TaskArchive.task_id).first():
+        # Live closed tasks are all shown: go on with archived ones.
+        next_url = url_for('tasks.closed_tasks', archive=1)
+    if next_url is not None:
+        response.headers['Link'] = '<{0}>; rel="next"'.format(next_url)
+    return response
 
 
 @tasks_blueprint.route('/add/', methods=['POST'])
@@ -68,36 +222,38 @@ def new_task():
                             '1',
                             session["user_id"])
             db.session.add(new_task)
+            bump_tasks_version()
             db.session.commit()
             flash("New entry was successfully posted, Thanks.")
             return redirect(url_for('tasks.tasks'))
-    return render_template('tasks.html', form=form, error=error,
-                           open_tasks=open_tasks(), closed_tasks=closed_tasks())
+    return render_tasks(form, error)
 
 
 @tasks_blueprint.route('/complete/<int:task_id>/', )
 @login_required
 def complete(task_id):
-    new_id = task_id
-    task = db.session.query(Task).filter_by(task_id=new_id)
-    if session['user_id'] == task.first().user_id or session['role'] == "admin":
-        task.update({"status": "0"})
+    status, _ = update_task(task_id, {"status": "0"}, session['user_id'],
+                            session['role'] == "admin")
+    if status == 200:
         db.session.commit()
         flash('The task was marked as complete. Well done !')
-    else:
+    elif status == 403:
         flash('You can only update tasks that belong to you.')
+    else:
+        flash('That task does not exist.')
     return redirect(url_for('tasks.tasks'))
 
 
 @tasks_blueprint.route('/delete/<int:task_id>/', )
 @login_required
 def delete_entry(task_id):
-    new_id = task_id
-    task = db.session.query(Task).filter_by(task_id=new_id)
-    if session['user_id'] == task.first().user_id or session['role'] == "admin":
-        task.delete()
+    status, _ = delete_task(task_id, session['user_id'],
+                            session['role'] == "admin")
+    if status == 200:
         db.session.commit()
         flash('The task was deleted. Why not add a new one?')
-    else:
+    elif status == 403:
         flash('You can only delete tasks that belong to you.')
+    else:
+        flash('That task does not exist.')
     return redirect(url_for('tasks.tasks'))
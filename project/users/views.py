@@ -13,7 +13,7 @@ from sqlalchemy.exc import IntegrityError
 
 # Forms
 from .forms import RegisterForm, LoginForm
-from project import db, bcrypt
+from project import db, passwords
 from project.models import User
 
 
@@ -46,7 +46,7 @@ def register():
         if form.validate_on_submit():
             new_user = User(form.name.data,
                             form.email.data,
-                            bcrypt.generate_password_hash(form.password.data))
+                            passwords.hash(form.password.data))
             try:
                 db.session.add(new_user)
                 db.session.commit()
@@ -65,8 +65,13 @@ def login():
     if request.method == "POST":
         if form.validate_on_submit():
             user = User.query.filter_by(name=request.form['name']).first()
-            if user is not None and bcrypt.check_password_hash(user.password,
-                                                               request.form['password']):
+            if user is not None and passwords.check(user.password,
+                                                    request.form['password']):
+                # Cost factor changed since password was hashed: hash it
+                # again while clear password is known.
+                if passwords.needs_rehash(user.password):
+                    user.password = passwords.hash(request.form['password'])
+                    db.session.commit()
                 flash("Welcome ! You were successfully logged in.")
                 session['logged_in'] = True
                 session['user_id'] = user.user_id
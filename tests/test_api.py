@@ -1,12 +1,14 @@
 # -*- coding:Utf8 -*-
 # tests/test_api.py
 
+import json
 import unittest
 
-from datetime import date
+from datetime import date, datetime, timedelta
 
-from project import app, db, bcrypt
-from project.models import Task, User
+from project import app, db, bcrypt, fragments
+from project.models import Task, TaskArchive, User
+from project.tasks.queries import archive_closed_tasks, prune_task_changes
 
 
 class APITests(unittest.TestCase):
@@ -26,6 +28,7 @@ class APITests(unittest.TestCase):
         app.config.from_object('project._config.TestConfig')
         self.app = app.test_client()
         db.create_all()
+        fragments.clear()
 
         self.assertEquals(app.debug, False)
 
@@ -72,6 +75,14 @@ class APITests(unittest.TestCase):
         return self.app.post('/', data=dict(name=name, password=password),
                              follow_redirects=True)
 
+    def post_json(self, url, data):
+        return self.app.post(url, data=json.dumps(data),
+                             content_type='application/json')
+
+    def send_json(self, method, url, data):
+        return self.app.open(url, method=method, data=json.dumps(data),
+                             content_type='application/json')
+
     def register(self, name='Tester', email='mail@monMail.com',
                  password="python",
                  confirm="python"):
@@ -91,6 +102,85 @@ class APITests(unittest.TestCase):
         self.assertIn(b'Run around in circles', response.data)
         self.assertIn(b'Purchase Real Python', response.data)
 
+    def test_collection_endpoint_is_paginated_using_cursor(self):
+        self.create_user()
+        self.add_tasks()
+        response1 = self.app.get("api/v1/tasks/?limit=1")
+        self.assertEquals(response1.status_code, 200)
+        self.assertIn(b'Run around in circles', response1.data)
+        self.assertNotIn(b'Purchase Real Python', response1.data)
+        self.assertIn('rel="next"', response1.headers['Link'])
+        # Follow the next link given by the first page.
+        next_url = response1.headers['Link'].split(';')[0].strip('<>')
+        response2 = self.app.get(next_url.replace('http://localhost', ''))
+        self.assertEquals(response2.status_code, 200)
+        self.assertIn(b'Purchase Real Python', response2.data)
+        self.assertNotIn(b'Run around in circles', response2.data)
+        # Last page does not link to another one.
+        self.assertNotIn('Link', response2.headers)
+
+    def test_collection_endpoint_caps_page_size(self):
+        self.create_user()
+        app.config['API_TASKS_MAX_PER_PAGE'] = 1
+        try:
+            self.add_tasks()
+            response = self.app.get("api/v1/tasks/?limit=500")
+            self.assertEquals(response.status_code, 200)
+            self.assertNotIn(b'Purchase Real Python', response.data)
+            self.assertIn('limit=1', response.headers['Link'])
+        finally:
+            app.config['API_TASKS_MAX_PER_PAGE'] = 100
+
+    def test_collection_endpoint_rejects_invalid_cursor_or_limit(self):
+        self.create_user()
+        self.add_tasks()
+        response1 = self.app.get("api/v1/tasks/?cursor=notACursor")
+        self.assertEquals(response1.status_code, 400)
+        self.assertIn(b'Invalid pagination cursor', response1.data)
+        response2 = self.app.get("api/v1/tasks/?limit=0")
+        self.assertEquals(response2.status_code, 400)
+        self.assertIn(b'limit must be a positive number', response2.data)
+
+    def test_collection_endpoint_filters_sorts_and_restricts_fields(self):
+        self.create_user()
+        self.add_tasks()
+        db.session.add(Task("Closed task", date(2016, 1, 1), 3,
+                            date(2015, 12, 1), 0, 1))
+        db.session.commit()
+        response1 = self.app.get("api/v1/tasks/?status=1&sort=-due_date&fields=name,due_date")
+        self.assertEquals(response1.status_code, 200)
+        self.assertEquals(json.loads(response1.data.decode('utf-8')),
+                          [{'task name': 'Purchase Real Python', 'due date': '2016-02-23'},
+                           {'task name': 'Run around in circles', 'due date': '2015-10-22'}])
+        response2 = self.app.get("api/v1/tasks/?priority_max=5&due_after=01/12/2015")
+        data = json.loads(response2.data.decode('utf-8'))
+        self.assertEquals([task['task name'] for task in data], ['Closed task'])
+
+    def test_collection_endpoint_keeps_filters_and_sort_when_paginated(self):
+        self.create_user()
+        self.add_tasks()
+        self.add_tasks()
+        response1 = self.app.get("api/v1/tasks/?limit=1&sort=-task_id&fields=task_id")
+        self.assertEquals(json.loads(response1.data.decode('utf-8')), [{'task_id': 4}])
+        next_url = response1.headers['Link'].split(';')[0].strip('<>')
+        self.assertIn('sort=-task_id', next_url)
+        response2 = self.app.get(next_url.replace('http://localhost', ''))
+        self.assertEquals(json.loads(response2.data.decode('utf-8')), [{'task_id': 3}])
+        # A cursor can not be reused with another sort.
+        cursor = next_url.split('cursor=')[1].split('&')[0]
+        response3 = self.app.get("api/v1/tasks/?cursor={0}".format(cursor))
+        self.assertEquals(response3.status_code, 400)
+
+    def test_collection_endpoint_rejects_unknown_sort_or_fields(self):
+        response1 = self.app.get("api/v1/tasks/?sort=name")
+        self.assertEquals(response1.status_code, 400)
+        self.assertIn(b'sort must be one of: due_date, task_id', response1.data)
+        response2 = self.app.get("api/v1/tasks/?fields=name,password")
+        self.assertEquals(response2.status_code, 400)
+        self.assertIn(b'Unknown fields: password', response2.data)
+        response3 = self.app.get("api/v1/tasks/?status=open")
+        self.assertEquals(response3.status_code, 400)
+
     def test_resource_endpoint_returns_correct_data(self):
         self.create_user()
         self.add_tasks()
@@ -110,6 +200,69 @@ class APITests(unittest.TestCase):
         self.assertIn(b'Element does not exist', response.data)
 
 
+# TEST CONDITIONAL GET
+
+    def test_resource_endpoint_answers_304_while_task_unchanged(self):
+        self.register()
+        self.login()
+        self.add_tasks()
+        response1 = self.app.get('api/v1/tasks/2')
+        etag = response1.headers['ETag']
+        self.assertIn('Last-Modified', response1.headers)
+        response2 = self.app.get('api/v1/tasks/2', headers={'If-None-Match': etag})
+        self.assertEquals(response2.status_code, 304)
+        self.assertEquals(response2.data, b'')
+        self.assertEquals(response2.headers['ETag'], etag)
+        # Any update gives a new version of the task.
+        self.app.put('api/v1/tasks/2', data={"priority": 2})
+        response3 = self.app.get('api/v1/tasks/2', headers={'If-None-Match': etag})
+        self.assertEquals(response3.status_code, 200)
+        self.assertNotEquals(response3.headers['ETag'], etag)
+        self.assertIn(b'"priority": 2', response3.data)
+
+    def test_resource_endpoint_does_not_answer_304_for_a_deleted_task(self):
+        self.register()
+        self.login()
+        self.add_tasks()
+        response1 = self.app.get('api/v1/tasks/2')
+        etag = response1.headers['ETag']
+        self.app.delete('api/v1/tasks/2')
+        # The new task must not take the id of the deleted one.
+        db.session.add(Task("Write a new task", date(2016, 3, 1), 10,
+                            date(2016, 2, 20), 1, 1))
+        db.session.commit()
+        response2 = self.app.get('api/v1/tasks/2', headers={'If-None-Match': etag})
+        self.assertEquals(response2.status_code, 404)
+
+    def test_resource_endpoint_answers_304_if_not_modified_since(self):
+        self.create_user()
+        self.add_tasks()
+        response1 = self.app.get('api/v1/tasks/2')
+        response2 = self.app.get('api/v1/tasks/2', headers={
+            'If-Modified-Since': response1.headers['Last-Modified']})
+        self.assertEquals(response2.status_code, 304)
+
+    def test_collection_endpoint_answers_304_while_no_task_written(self):
+        self.create_user()
+        self.add_tasks()
+        response1 = self.app.get('api/v1/tasks/?limit=1')
+        etag = response1.headers['ETag']
+        response2 = self.app.get('api/v1/tasks/?limit=1', headers={'If-None-Match': etag})
+        self.assertEquals(response2.status_code, 304)
+        # Another page has its own ETag.
+        response3 = self.app.get('api/v1/tasks/?limit=2', headers={'If-None-Match': etag})
+        self.assertEquals(response3.status_code, 200)
+        # Any write through the api changes the collection version.
+        self.app.post('api/v1/tasks/', data={"name": "Add a new task using POST API",
+                                             "user_name": "Tester",
+                                             "password": "python",
+                                             "due_date": "22/09/2055",
+                                             "priority": 2})
+        response4 = self.app.get('api/v1/tasks/?limit=1', headers={'If-None-Match': etag})
+        self.assertEquals(response4.status_code, 200)
+        self.assertNotEquals(response4.headers['ETag'], etag)
+
+
 # TEST POST
 
     def test_existing_user_can_post_task_using_api(self):
@@ -170,6 +323,30 @@ class APITests(unittest.TestCase):
         self.assertEquals(response2.mimetype, 'application/json')
         self.assertIn(b'error: priority must be between 1 and 10 included', response2.data)
 
+    def test_existing_user_can_post_task_using_api_with_json_body(self):
+        self.create_user()
+        response = self.post_json('api/v1/tasks/',
+                                  {"name": "Add a new task using JSON",
+                                   "user_name": "Tester",
+                                   "password": "python",
+                                   "due_date": "22/09/2055",
+                                   "priority": 2})
+        self.assertEquals(response.status_code, 201)
+        self.assertIn(b'"name": "Add a new task using JSON"', response.data)
+        self.assertIn(b'"due_date": "2055-09-22"', response.data)
+
+    def test_existing_user_cannot_post_task_using_api_with_wrong_date(self):
+        self.create_user()
+        response = self.app.post('api/v1/tasks/',
+                                 data={"name": "Add a new task using POST API",
+                                       "user_name": "Tester",
+                                       "password": "python",
+                                       "due_date": "2055-09-22",
+                                       "priority": 2})
+        self.assertEquals(response.status_code, 400)
+        self.assertIn(b'Use this format: DD/MM/YYYY', response.data)
+        self.assertEquals(db.session.query(Task).count(), 0)
+
     def test_existing_user_cannot_post_task_using_api_without_required_data(self):
         # Test if all required field are inside the request.
         # Add a user.
@@ -185,6 +362,123 @@ class APITests(unittest.TestCase):
         self.assertIn(b'Missing required parameter in the JSON body or the post body or the query string', response1.data)
 
 
+# TEST TOKENS
+
+    def get_token(self, name='Tester', password='python'):
+        response = self.app.post('api/v1/tokens',
+                                 data={"user_name": name, "password": password})
+        return json.loads(response.data.decode('utf-8')).get('token')
+
+    def test_existing_user_can_post_task_using_api_token(self):
+        self.create_user()
+        token = self.get_token()
+        response = self.app.post('api/v1/tasks/',
+                                 data={"name": "Add a new task using a token",
+                                       "due_date": "22/09/2055",
+                                       "priority": 2},
+                                 headers={'Authorization': 'Bearer ' + token})
+        self.assertEquals(response.status_code, 201)
+        self.assertIn(b'"name": "Add a new task using a token"', response.data)
+        self.assertEquals(db.session.query(Task).first().user_id, 1)
+
+    def test_token_is_not_given_for_wrong_password(self):
+        self.create_user()
+        response = self.app.post('api/v1/tokens',
+                                 data={"user_name": "Tester", "password": "crackcrack"})
+        self.assertEquals(response.status_code, 401)
+        self.assertIsNone(self.get_token(password='crackcrack'))
+
+    def test_revoked_or_expired_or_forged_token_is_rejected(self):
+        self.create_user()
+        token = self.get_token()
+        task = {"name": "Add a new task using a token",
+                "due_date": "22/09/2055",
+                "priority": 2}
+        # Forged token.
+        response1 = self.app.post('api/v1/tasks/', data=task,
+                                  headers={'Authorization': 'Bearer ' + token[:-2]})
+        self.assertEquals(response1.status_code, 401)
+        # Revoked token.
+        response2 = self.app.delete('api/v1/tokens',
+                                    headers={'Authorization': 'Bearer ' + token})
+        self.assertEquals(response2.status_code, 200)
+        response3 = self.app.post('api/v1/tasks/', data=task,
+                                  headers={'Authorization': 'Bearer ' + token})
+        self.assertEquals(response3.status_code, 401)
+        self.assertIn(b'Token is invalid, expired or revoked.', response3.data)
+        # Expired token.
+        app.config['API_TOKEN_EXPIRATION'] = -1
+        try:
+            response4 = self.app.post('api/v1/tasks/', data=task, headers={
+                'Authorization': 'Bearer ' + self.get_token()})
+            self.assertEquals(response4.status_code, 401)
+        finally:
+            app.config['API_TOKEN_EXPIRATION'] = 3600
+        self.assertEquals(db.session.query(Task).count(), 0)
+
+
+# TEST BULK POST
+
+    def test_existing_user_can_post_many_tasks_using_bulk_api(self):
+        self.create_user()
+        response = self.post_json('api/v1/tasks/bulk',
+                                  {"user_name": "Tester",
+                                   "password": "python",
+                                   "tasks": [{"name": "First bulk task",
+                                              "due_date": "22/09/2055",
+                                              "priority": 2},
+                                             {"name": "Second bulk task",
+                                              "due_date": "23/09/2055",
+                                              "priority": 3}]})
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(response.mimetype, 'application/json')
+        self.assertIn(b'"Tasks created":', response.data)
+        self.assertIn(b'"name": "First bulk task"', response.data)
+        self.assertIn(b'"due_date": "2055-09-23"', response.data)
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEquals([(task['task_id'], task['name'])
+                           for task in data['Tasks created']],
+                          [(1, 'First bulk task'), (2, 'Second bulk task')])
+        self.assertEquals(db.session.query(Task).count(), 2)
+
+    def test_bulk_api_creates_nothing_if_one_task_is_invalid(self):
+        self.create_user()
+        response = self.post_json('api/v1/tasks/bulk',
+                                  {"user_name": "Tester",
+                                   "password": "python",
+                                   "tasks": [{"name": "Valid bulk task",
+                                              "due_date": "22/09/2055",
+                                              "priority": 2},
+                                             {"name": "Invalid bulk task",
+                                              "due_date": "22/09/2055",
+                                              "priority": 333}]})
+        self.assertEquals(response.status_code, 400)
+        self.assertIn(b'"index": 1', response.data)
+        self.assertIn(b'error: priority must be between 1 and 10 included', response.data)
+        self.assertEquals(db.session.query(Task).count(), 0)
+
+    def test_empty_list_of_tasks_is_rejected_by_bulk_api(self):
+        self.create_user()
+        response = self.post_json('api/v1/tasks/bulk',
+                                  {"user_name": "Tester",
+                                   "password": "python",
+                                   "tasks": []})
+        self.assertEquals(response.status_code, 400)
+        self.assertIn(b'must be a non empty list of tasks', response.data)
+
+    def test_non_existing_user_cannot_post_many_tasks_using_bulk_api(self):
+        self.create_user()
+        response = self.post_json('api/v1/tasks/bulk',
+                                  {"user_name": "Tester",
+                                   "password": "crackcrack",
+                                   "tasks": [{"name": "First bulk task",
+                                              "due_date": "22/09/2055",
+                                              "priority": 2}]})
+        self.assertEquals(response.status_code, 401)
+        self.assertIn(b'User does not exist', response.data)
+        self.assertEquals(db.session.query(Task).count(), 0)
+
+
 # TEST PUT
 
     def test_logged_user_can_update_task_using_api_if_owner(self):
@@ -250,6 +544,26 @@ class APITests(unittest.TestCase):
         self.assertEquals(response.mimetype, 'application/json')
         self.assertIn(b'A user can only update or delete it own tasks.', response.data)
 
+    def test_logged_user_cannot_update_or_delete_missing_task_using_api(self):
+        self.register()
+        self.login()
+        self.add_tasks()
+        response1 = self.app.put('api/v1/tasks/209', data={"name": "Updated"})
+        self.assertEquals(response1.status_code, 404)
+        self.assertIn(b'Element does not exist', response1.data)
+        response2 = self.app.delete('api/v1/tasks/209')
+        self.assertEquals(response2.status_code, 404)
+        self.assertIn(b'Element does not exist', response2.data)
+
+    def test_logged_user_can_update_task_using_api_without_priority(self):
+        self.register()
+        self.login()
+        self.add_tasks()
+        response = self.app.put('api/v1/tasks/2', data={"status": 0})
+        self.assertEquals(response.status_code, 200)
+        self.assertIn(b'"status": 0', response.data)
+        self.assertIn(b'"name": "Purchase Real Python"', response.data)
+
     def test_logged_admin_can_update_task_using_api_if_not_owner(self):
         # Register a user and add tasks.
         self.register()
@@ -342,5 +656,277 @@ class APITests(unittest.TestCase):
         self.assertNotIn(b'Purchase Real Python', response2.data)
 
 
+# TEST EXPORT
+
+    def test_export_endpoint_streams_tasks_as_ndjson(self):
+        self.create_user()
+        self.add_tasks()
+        response = self.app.get('api/v1/tasks/export')
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.mimetype, 'application/x-ndjson')
+        lines = response.data.decode('utf-8').splitlines()
+        self.assertEquals(len(lines), 2)
+        self.assertEquals(json.loads(lines[1])['name'], 'Purchase Real Python')
+        self.assertEquals(json.loads(lines[1])['due_date'], '2016-02-23')
+
+    def test_export_endpoint_streams_filtered_tasks_as_csv(self):
+        self.create_user()
+        self.add_tasks()
+        response = self.app.get('api/v1/tasks/export?format=csv&due_after=01/01/2016')
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.mimetype, 'text/csv')
+        lines = response.data.decode('utf-8').splitlines()
+        self.assertEquals(lines[0], 'task_id,name,due_date,priority,posted_date,status,user_id')
+        self.assertEquals(lines[1], '2,Purchase Real Python,2016-02-23,10,2016-02-07,1,1')
+        self.assertEquals(len(lines), 2)
+        response2 = self.app.get('api/v1/tasks/export?status=0')
+        self.assertEquals(response2.data, b'')
+
+    def test_export_endpoint_rejects_wrong_arguments(self):
+        response1 = self.app.get('api/v1/tasks/export?format=xml')
+        self.assertEquals(response1.status_code, 400)
+        response2 = self.app.get('api/v1/tasks/export?due_before=2016-01-01')
+        self.assertEquals(response2.status_code, 400)
+        self.assertIn(b'due_before must use this format: DD/MM/YYYY', response2.data)
+
+
+# TEST BULK PUT AND DELETE
+
+    def test_logged_user_can_update_many_tasks_using_bulk_api(self):
+        self.register()
+        self.register(name='Jérémy', email='jeremy@monMail.com',
+                      password='notOwner', confirm='notOwner')
+        self.add_tasks()
+        self.add_tasks(user_id=2)
+        self.login()
+        response = self.send_json('PUT', 'api/v1/tasks/bulk',
+                                  {"ids": [1, 2, 3, 209],
+                                   "patch": {"status": 0, "priority": 4}})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.mimetype, 'application/json')
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEquals(data['Tasks updated'], [1, 2])
+        self.assertEquals([task['task_id'] for task in data['Tasks rejected']], [3, 209])
+        self.assertIn(b'Element does not exist', response.data)
+        self.assertIn(b'A user can only update or delete it own tasks.', response.data)
+        statuses = dict(db.session.query(Task.task_id, Task.status))
+        self.assertEquals(statuses, {1: 0, 2: 0, 3: 1, 4: 1})
+
+    def test_logged_user_cannot_update_many_tasks_with_wrong_patch(self):
+        self.register()
+        self.login()
+        self.add_tasks()
+        response = self.send_json('PUT', 'api/v1/tasks/bulk',
+                                  {"ids": [1, 2], "patch": {"priority": 54}})
+        self.assertEquals(response.status_code, 400)
+        self.assertIn(b'error: priority must be between 1 and 10 included', response.data)
+
+    def test_logged_user_cannot_update_many_tasks_with_unknown_field(self):
+        self.register()
+        self.login()
+        self.add_tasks()
+        response = self.send_json('PUT', 'api/v1/tasks/bulk',
+                                  {"ids": [1, 2], "patch": {"user_id": 2}})
+        self.assertEquals(response.status_code, 400)
+        self.assertIn(b'Field `user_id` can not be updated.', response.data)
+
+    def test_not_logged_user_cannot_delete_many_tasks_using_bulk_api(self):
+        self.register()
+        self.add_tasks()
+        response = self.send_json('DELETE', 'api/v1/tasks/bulk', {"ids": [1, 2]})
+        self.assertEquals(response.status_code, 401)
+        self.assertEquals(db.session.query(Task).count(), 2)
+
+    def test_logged_admin_can_delete_many_tasks_using_bulk_api(self):
+        self.register()
+        self.add_tasks()
+        self.create_admin_user()
+        self.login(name="Superman", password="allpowerful")
+        response = self.send_json('DELETE', 'api/v1/tasks/bulk', {"ids": [1, 2]})
+        self.assertEquals(response.status_code, 200)
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEquals(data['Tasks deleted'], [1, 2])
+        self.assertEquals(data['Tasks rejected'], [])
+        self.assertEquals(db.session.query(Task).count(), 0)
+
+
+# TEST CHANGES FEED
+
+    def test_changes_feed_returns_changes_after_cursor_with_tombstones(self):
+        self.register()
+        self.add_tasks()
+        self.create_admin_user()
+        self.login(name="Superman", password="allpowerful")
+        self.send_json('PUT', 'api/v1/tasks/1', {"priority": 3})
+        self.send_json('DELETE', 'api/v1/tasks/bulk', {"ids": [2]})
+        response = self.app.get('api/v1/tasks/changes?since=0')
+        self.assertEquals(response.status_code, 200)
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEquals(data['cursor'], 4)
+        self.assertEquals(data['more'], False)
+        self.assertEquals([(change['task_id'], change['change'])
+                           for change in data['changes']],
+                          [(1, 'updated'), (2, 'deleted')])
+        self.assertEquals(data['changes'][0]['task']['priority'], 3)
+        self.assertEquals(data['changes'][1]['task'], None)
+        response = self.app.get('api/v1/tasks/changes?since=4')
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEquals((data['changes'], data['cursor']), ([], 4))
+
+    def test_changes_feed_is_paginated_using_limit(self):
+        self.create_user()
+        self.add_tasks()
+        response = self.app.get('api/v1/tasks/changes?since=0&limit=1')
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEquals([change['task_id'] for change in data['changes']], [1])
+        self.assertEquals((data['cursor'], data['more']), (1, True))
+        response = self.app.get('api/v1/tasks/changes?since=1&limit=1')
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEquals([change['task_id'] for change in data['changes']], [2])
+
+    def test_changes_feed_long_poll_returns_empty_when_wait_expires(self):
+        self.create_user()
+        self.add_tasks()
+        response = self.app.get('api/v1/tasks/changes?since=2&wait=1')
+        self.assertEquals(response.status_code, 200)
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEquals((data['changes'], data['cursor']), ([], 2))
+
+    def test_changes_feed_answers_410_for_pruned_cursor(self):
+        self.create_user()
+        self.add_tasks()
+        self.assertEquals(prune_task_changes(datetime.utcnow() + timedelta(days=1)), 1)
+        response = self.app.get('api/v1/tasks/changes?since=1')
+        self.assertEquals(response.status_code, 410)
+        self.assertIn(b'read tasks again', response.data)
+        # Last change is kept: an up to date cursor stays valid.
+        response = self.app.get('api/v1/tasks/changes?since=2')
+        self.assertEquals(response.status_code, 200)
+
+    def test_changes_feed_cannot_use_wrong_cursor(self):
+        response = self.app.get('api/v1/tasks/changes?since=abc')
+        self.assertEquals(response.status_code, 400)
+        self.assertIn(b'since must be an integer', response.data)
+
+
+# TEST HISTORY
+
+    def archive_first_task(self):
+        db.session.query(Task).filter_by(task_id=1).update({'status': 0})
+        db.session.commit()
+        archive_closed_tasks(datetime.utcnow() + timedelta(minutes=1), 10)
+
+    def test_collection_endpoint_reads_archived_tasks_only_for_history(self):
+        self.create_user()
+        self.add_tasks()
+        self.archive_first_task()
+        response = self.app.get('api/v1/tasks/')
+        self.assertNotIn(b'Run around in circles', response.data)
+        self.assertIn(b'Purchase Real Python', response.data)
+        response = self.app.get('api/v1/tasks/?history=1&limit=1')
+        self.assertEquals(response.status_code, 200)
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEquals([task['task name'] for task in data], ['Run around in circles'])
+        next_url = response.headers['Link'].split('>')[0].lstrip('<')
+        response = self.app.get(next_url.replace('http://localhost', ''))
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEquals([task['task name'] for task in data], ['Purchase Real Python'])
+
+    def test_archived_task_is_readable_from_its_id(self):
+        self.create_user()
+        self.add_tasks()
+        self.archive_first_task()
+        self.assertEquals(db.session.query(TaskArchive).count(), 1)
+        response = self.app.get('api/v1/tasks/1')
+        self.assertEquals(response.status_code, 200)
+        self.assertIn(b'Run around in circles', response.data)
+
+    def test_export_includes_archived_tasks_for_history(self):
+        self.create_user()
+        self.add_tasks()
+        self.archive_first_task()
+        response = self.app.get('api/v1/tasks/export?history=1&format=csv')
+        self.assertIn(b'Run around in circles', response.data)
+        response = self.app.get('api/v1/tasks/export?format=csv')
+        self.assertNotIn(b'Run around in circles', response.data)
+
+
+# TEST POOL STATS
+
+    def test_admin_can_read_pool_stats(self):
+        self.create_admin_user()
+        self.login(name="Superman", password="allpowerful")
+        response = self.app.get('api/v1/internal/pools')
+        self.assertEquals(response.status_code, 200)
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertGreater(data['primary']['checkouts'], 0)
+        self.assertEquals(data['primary']['pool'], 'InstrumentedNullPool')
+
+    def test_user_cannot_read_pool_stats(self):
+        response = self.app.get('api/v1/internal/pools')
+        self.assertEquals(response.status_code, 401)
+        self.register()
+        self.login()
+        response = self.app.get('api/v1/internal/pools')
+        self.assertEquals(response.status_code, 403)
+
+
+# TEST SEARCH
+
+    def search_names(self, url):
+        response = self.app.get(url)
+        self.assertEquals(response.status_code, 200)
+        return [task['task name']
+                for task in json.loads(response.data.decode('utf-8'))]
+
+    def test_search_returns_tasks_holding_every_word_best_ranked_first(self):
+        self.create_user()
+        self.add_tasks()
+        db.session.add(Task("Purchase milk", date(2016, 3, 1), 5,
+                            date(2016, 2, 7), 1, 1))
+        db.session.commit()
+        self.assertEquals(self.search_names('api/v1/tasks/search?q=purchase'),
+                          ['Purchase milk', 'Purchase Real Python'])
+        self.assertEquals(self.search_names('api/v1/tasks/search?q=purchase+python'),
+                          ['Purchase Real Python'])
+        # Last words match as prefixes.
+        self.assertEquals(self.search_names('api/v1/tasks/search?q=circ'),
+                          ['Run around in circles'])
+        self.assertEquals(self.search_names('api/v1/tasks/search?q=swim'), [])
+
+    def test_search_is_paginated_using_offset(self):
+        self.create_user()
+        self.add_tasks()
+        response = self.app.get('api/v1/tasks/search?q=r&limit=1')
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEquals(len(data), 1)
+        next_url = response.headers['Link'].split('>')[0].lstrip('<')
+        self.assertIn('offset=1', next_url)
+        response = self.app.get(next_url.replace('http://localhost', ''))
+        self.assertNotIn('Link', response.headers)
+        names = [data[0]['task name']] + [
+            task['task name'] for task in json.loads(response.data.decode('utf-8'))]
+        self.assertEquals(sorted(names),
+                          ['Purchase Real Python', 'Run around in circles'])
+
+    def test_search_rejects_empty_query_or_negative_offset(self):
+        response = self.app.get('api/v1/tasks/search?q=+-+')
+        self.assertEquals(response.status_code, 400)
+        self.assertIn(b'q must hold at least one word', response.data)
+        response = self.app.get('api/v1/tasks/search?q=run&offset=-1')
+        self.assertEquals(response.status_code, 400)
+
+    def test_search_index_follows_renamed_and_deleted_tasks(self):
+        self.register()
+        self.login()
+        self.add_tasks()
+        self.send_json('PUT', 'api/v1/tasks/1', {"name": "Walk the dog"})
+        self.assertEquals(self.search_names('api/v1/tasks/search?q=circles'), [])
+        self.assertEquals(self.search_names('api/v1/tasks/search?q=dog'),
+                          ['Walk the dog'])
+        self.app.delete('api/v1/tasks/1')
+        self.assertEquals(self.search_names('api/v1/tasks/search?q=dog'), [])
+
+
 if __name__ == '__main__':
     unittest.main()
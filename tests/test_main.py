@@ -2,9 +2,13 @@
 from __future__ import unicode_literals  # Python2 unicode
 
 
+import json
+import os
+import shutil
+import tempfile
 import unittest
 
-from project import app, db
+from project import app, db, errors, fragments
 # from project.models import User
 
 
@@ -23,8 +27,12 @@ class MainTests(unittest.TestCase):
             Start server without the debug mode.
         """
         app.config.from_object('project._config.TestConfig')
+        self.log_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.log_dir, 'error.log')
+        app.config['ERROR_LOG'] = self.log_path
         self.app = app.test_client()
         db.create_all()
+        fragments.clear()
 
         self.assertEquals(app.debug, False)
 
@@ -34,6 +42,8 @@ class MainTests(unittest.TestCase):
             Clean environnement.
         """
         db.drop_all()
+        errors.flush()
+        shutil.rmtree(self.log_dir)
 
     def login(self, name='Jérémy', password='python'):
         return self.app.post('/', data=dict(name=name, password=password),
@@ -46,6 +56,32 @@ class MainTests(unittest.TestCase):
         self.assertEquals(response.status_code, 404)
         self.assertIn(b'Sorry your lost. There\xe2\x80\x99s nothing here.', response.data)
 
+    def test_404_error_is_logged_as_json_line(self):
+        self.app.get('/This-route-does-not-exist')
+        self.app.get('/Nor-this-one')
+        errors.flush()
+        with open(self.log_path) as log_file:
+            lines = [json.loads(line) for line in log_file]
+        self.assertEquals([line['url'] for line in lines],
+                          ['http://localhost/This-route-does-not-exist',
+                           'http://localhost/Nor-this-one'])
+        self.assertEquals(lines[0]['status'], 404)
+        self.assertEquals(lines[0]['level'], 'WARNING')
+        self.assertIn('endpoint', lines[0])
+        self.assertGreaterEqual(lines[0]['latency_ms'], 0)
+
+    def test_error_log_is_rotated_when_too_big(self):
+        app.config['ERROR_LOG_MAX_BYTES'] = 1
+        for index in range(3):
+            self.app.get('/missing-{0}'.format(index))
+            errors.flush()
+        with open(self.log_path) as log_file:
+            self.assertIn('missing-2', log_file.read())
+        with open(self.log_path + '.1') as log_file:
+            self.assertIn('missing-1', log_file.read())
+        with open(self.log_path + '.2') as log_file:
+            self.assertIn('missing-0', log_file.read())
+
 # Can’t pass right now. Explain later.
     # def test_500_error(self):
     #     bad_user = User(name='Jeremy', email='jeremy@realpython.com', password='django')
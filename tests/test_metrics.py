@@ -0,0 +1,170 @@
+# -*- coding:Utf8 -*-
+
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from project import app, db, fragments, metrics, passwords
+from project.metrics import RequestMetrics
+
+
+class MetricsTests(unittest.TestCase):
+
+    """
+        Request metrics unit test.
+    """
+
+# USEFUL FUNCTIONS
+
+    def setUp(self):
+        """
+            Executing prior to each tasks.
+            Create environnement where tests will be executing.
+            Start from empty metrics.
+        """
+        app.config.from_object('project._config.TestConfig')
+        self.app = app.test_client()
+        db.create_all()
+        fragments.clear()
+        metrics.clear()
+
+        self.assertEquals(app.debug, False)
+
+    def tearDown(self):
+        """
+            Executing after each task.
+            Clean environnement.
+        """
+        db.session.remove()
+        db.drop_all()
+
+# HELPER METHODS
+
+    def scrape(self):
+        response = self.app.get('metrics')
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.mimetype, 'text/plain')
+        return response.data.decode('utf-8').splitlines()
+
+# TEST METRICS
+
+    def test_requests_are_counted_by_endpoint_and_status(self):
+        self.app.get('/')
+        self.app.get('/')
+        self.app.get('/nowhere/')
+        lines = self.scrape()
+        self.assertIn('http_requests_total{endpoint="users.login",'
+                      'method="GET",status="200"} 2', lines)
+        self.assertIn('http_requests_total{endpoint="unmatched",'
+                      'method="GET",status="404"} 1', lines)
+        # Only the scrape itself is running.
+        self.assertIn('http_requests_in_flight{endpoint="metrics"} 1', lines)
+        self.assertIn('http_requests_in_flight{endpoint="users.login"} 0', lines)
+
+    def test_latency_histogram_is_cumulative(self):
+        metrics.observe('tasks.tasks', 'GET', 200, 0.02)
+        metrics.observe('tasks.tasks', 'GET', 200, 0.3)
+        lines = self.scrape()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', lines)
+        for bound, count in (('0.01', 0), ('0.025', 1), ('0.25', 1),
+                             ('0.5', 2), ('+Inf', 2)):
+            self.assertIn('http_request_duration_seconds_bucket{endpoint='
+                          '"tasks.tasks",le="' + bound + '",method="GET"} ' +
+                          str(count), lines)
+        self.assertIn('http_request_duration_seconds_count{endpoint='
+                      '"tasks.tasks",method="GET"} 2', lines)
+        self.assertIn('http_request_duration_seconds_sum{endpoint='
+                      '"tasks.tasks",method="GET"} 0.32', lines)
+
+    def test_metrics_of_every_worker_are_summed(self):
+        directory = tempfile.mkdtemp()
+        app.config['METRICS_DIR'] = directory
+        try:
+            # Snapshot left by an exited worker.
+            worker = RequestMetrics()
+            worker.observe('users.login', 'GET', 200, 0.01)
+            worker.in_flight['users.login'] = 3
+            worker.register('password_hash_rejected_total', 'counter',
+                            'Password demands answered by 503.', lambda: 2)
+            worker.register('password_hash_queue_depth', 'gauge',
+                            'Password demands waiting for a free worker.',
+                            lambda: 5)
+            with open(os.path.join(directory, 'metrics_999999999_1.json'),
+                      'w') as snapshot_file:
+                json.dump(worker.snapshot(), snapshot_file)
+            self.app.get('/')
+            lines = self.scrape()
+            # Merged into the snapshot of exited workers: still counted.
+            names = sorted(os.listdir(directory))
+            self.assertIn('metrics_exited.json', names)
+            self.assertNotIn('metrics_999999999_1.json', names)
+            self.assertEquals([line for line in self.scrape()
+                               if 'users.login' in line], [
+                line for line in lines if 'users.login' in line])
+        finally:
+            app.config['METRICS_DIR'] = None
+            shutil.rmtree(directory)
+        self.assertIn('http_requests_total{endpoint="users.login",'
+                      'method="GET",status="200"} 2', lines)
+        self.assertIn('http_request_duration_seconds_count{endpoint='
+                      '"users.login",method="GET"} 2', lines)
+        self.assertIn('http_requests_in_flight{endpoint="users.login"} 0', lines)
+        # Counters of exited workers are kept, their gauges dropped.
+        self.assertIn('password_hash_rejected_total {0}'.format(
+            passwords.rejected + 2), lines)
+        self.assertIn('password_hash_queue_depth 0', lines)
+
+    def test_snapshot_of_a_reused_pid_is_not_overwritten(self):
+        directory = tempfile.mkdtemp()
+        app.config['METRICS_DIR'] = directory
+        try:
+            # Exited worker whose pid is now the one of this process.
+            worker = RequestMetrics()
+            worker.observe('users.login', 'GET', 200, 0.01)
+            with open(os.path.join(directory, 'metrics_{0}_1.json'.format(
+                    os.getpid())), 'w') as snapshot_file:
+                json.dump(worker.snapshot(), snapshot_file)
+            self.app.get('/')
+            lines = self.scrape()
+        finally:
+            app.config['METRICS_DIR'] = None
+            shutil.rmtree(directory)
+        self.assertIn('http_requests_total{endpoint="users.login",'
+                      'method="GET",status="200"} 2', lines)
+
+    def test_snapshots_are_written_by_a_thread(self):
+        directory = tempfile.mkdtemp()
+        app.config['METRICS_DIR'] = directory
+        app.config['METRICS_FLUSH_INTERVAL'] = 0.01
+        try:
+            self.app.get('/')
+            # Thread may still sleep the interval of an earlier test.
+            deadline = time.time() + 10
+            snapshots = []
+            while not snapshots and time.time() < deadline:
+                time.sleep(0.01)
+                snapshots = [name for name in os.listdir(directory)
+                             if name.endswith('.json')]
+        finally:
+            app.config['METRICS_DIR'] = None
+            shutil.rmtree(directory)
+        self.assertEquals(len(snapshots), 1)
+        self.assertTrue(snapshots[0].startswith(
+            'metrics_{0}_'.format(os.getpid())))
+
+    def test_password_pool_load_is_exposed(self):
+        lines = self.scrape()
+        self.assertIn('# TYPE password_hash_queue_depth gauge', lines)
+        self.assertIn('password_hash_queue_depth 0', lines)
+        self.assertIn('password_hash_pending 0', lines)
+        self.assertIn('# TYPE password_hash_rejected_total counter', lines)
+        self.assertIn('password_hash_rejected_total {0}'.format(
+            passwords.rejected), lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
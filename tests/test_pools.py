@@ -0,0 +1,77 @@
+# -*- coding:Utf8 -*-
+
+
+import unittest
+
+from sqlalchemy import create_engine, exc
+from sqlalchemy.pool import QueuePool
+
+from project.pools import PoolStats, pool_class
+
+
+class PoolTests(unittest.TestCase):
+
+    """
+        Connection pool instrumentation unit test.
+    """
+
+# USEFUL FUNCTIONS
+
+    def setUp(self):
+        """
+            Executing prior to each tasks.
+            Create an engine whose pool holds one connection plus one extra.
+        """
+        self.stats = PoolStats()
+        self.engine = create_engine(
+            'sqlite://', poolclass=pool_class(QueuePool, self.stats, True),
+            pool_size=1, max_overflow=1, pool_timeout=0.1)
+
+    def tearDown(self):
+        """
+            Executing after each task.
+            Clean environnement.
+        """
+        self.engine.dispose()
+
+# TEST POOL STATS
+
+    def test_stats_count_connections_in_use_and_overflow(self):
+        first, second = self.engine.connect(), self.engine.connect()
+        data = self.stats.snapshot()
+        self.assertEqual((data['in_use'], data['overflow'], data['open']),
+                         (2, 1, 2))
+        self.assertRaises(exc.TimeoutError, self.engine.connect)
+        second.close()
+        first.close()
+        data = self.stats.snapshot()
+        self.assertEqual((data['checkouts'], data['in_use'],
+                          data['peak_in_use'], data['timeouts']), (2, 0, 2, 1))
+        # Extra connection is closed once given back, the other one is kept.
+        self.assertEqual((data['closed'], data['open'], data['checkedin']),
+                         (1, 1, 1))
+        self.assertGreaterEqual(data['checkout_wait_max_ms'], 100)
+        self.assertEqual(data['pool'], 'InstrumentedQueuePool')
+
+    def test_pre_ping_replaces_dead_connection(self):
+        connection = self.engine.connect()
+        dbapi_connection = connection.connection.connection
+        connection.close()
+        dbapi_connection.close()
+        self.assertEqual(self.engine.execute('SELECT 1').scalar(), 1)
+        data = self.stats.snapshot()
+        self.assertEqual((data['disconnects'], data['connects'],
+                          data['in_use']), (1, 2, 0))
+
+    def test_stats_outlive_disposed_pool(self):
+        self.engine.connect().close()
+        self.engine.dispose()
+        self.engine.connect().close()
+        data = self.stats.snapshot()
+        self.assertEqual((data['checkouts'], data['connects'], data['closed']),
+                         (2, 2, 1))
+        self.assertIs(self.stats.pool, self.engine.pool)
+
+
+if __name__ == '__main__':
+    unittest.main()
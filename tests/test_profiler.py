@@ -0,0 +1,119 @@
+# -*- coding:Utf8 -*-
+
+
+import unittest
+from logging.handlers import BufferingHandler
+
+from project import app, db, bcrypt, fragments
+from project.models import User
+from project.profiler import logger, normalize_sql
+
+
+class ProfilerTests(unittest.TestCase):
+
+    """
+        SQL profiler unit test.
+    """
+
+# USEFUL FUNCTIONS
+
+    def setUp(self):
+        """
+            Executing prior to each tasks.
+            Create environnement where tests will be executing.
+            Turn profiler on and catch its logs (slow query log included).
+        """
+        app.config.from_object('project._config.TestConfig')
+        app.config['SQL_PROFILER'] = True
+        self.app = app.test_client()
+        db.create_all()
+        fragments.clear()
+        self.logs = BufferingHandler(100)
+        logger.addHandler(self.logs)
+
+        self.assertEquals(app.debug, False)
+
+    def tearDown(self):
+        """
+            Executing after each task.
+            Clean environnement.
+        """
+        logger.removeHandler(self.logs)
+        app.config['SQL_PROFILER'] = False
+        db.session.remove()
+        db.drop_all()
+
+# HELPER METHODS
+
+    def messages(self):
+        return [record.getMessage() for record in self.logs.buffer]
+
+    def create_user(self):
+        db.session.add(User("Tester", "mail@mail.fr",
+                            bcrypt.generate_password_hash("python")))
+        db.session.commit()
+
+# TEST PROFILER
+
+    def test_statement_shape_hides_values_and_lists(self):
+        self.assertEquals(
+            normalize_sql("SELECT name FROM tasks\n WHERE task_id IN (?, ?, ?)"
+                          " AND name = 'it''s' AND priority > 10 LIMIT ?"),
+            "SELECT name FROM tasks WHERE task_id IN (?) AND name = ?"
+            " AND priority > ? LIMIT ?")
+        self.assertEquals(
+            normalize_sql("SELECT tasks_1.name FROM tasks AS tasks_1 "
+                          "WHERE tasks_1.user_id = %(user_id_1)s"),
+            "SELECT tasks_1.name FROM tasks AS tasks_1 WHERE tasks_1.user_id = ?")
+
+    def test_profiled_request_sends_server_timing(self):
+        self.create_user()
+        response = self.app.get('api/v1/tasks/')
+        self.assertEquals(response.status_code, 200)
+        timing = response.headers['Server-Timing']
+        self.assertTrue(timing.startswith('db;dur='))
+        # Tasks version then one page of tasks.
+        self.assertIn('desc="2 statements"', timing)
+
+    def test_request_is_not_profiled_when_profiler_is_off(self):
+        app.config['SQL_PROFILER'] = False
+        response = self.app.get('api/v1/tasks/')
+        self.assertNotIn('Server-Timing', response.headers)
+
+    def test_repeated_statements_are_logged_as_likely_n_plus_one(self):
+        self.create_user()
+        with app.test_request_context('/tasks/'):
+            app.preprocess_request()
+            for user_id in range(5):
+                db.session.query(User).filter_by(user_id=user_id).first()
+            db.session.query(User).count()
+            app.process_response(app.response_class())
+        messages = self.messages()
+        self.assertEquals(len(messages), 1)
+        self.assertIn('Likely N+1 on GET /tasks/: 5 x SELECT', messages[0])
+        self.assertIn('WHERE users.user_id = ? LIMIT ? OFFSET ?', messages[0])
+
+    def test_statements_differing_by_values_are_counted_as_one_shape(self):
+        self.create_user()
+        with app.test_request_context('/tasks/'):
+            app.preprocess_request()
+            for count in range(1, 6):
+                db.session.query(User).filter(
+                    User.user_id.in_(range(count))).all()
+            app.process_response(app.response_class())
+        messages = self.messages()
+        self.assertEquals(len(messages), 1)
+        self.assertIn('5 x SELECT', messages[0])
+        self.assertIn('WHERE users.user_id IN (?)', messages[0])
+
+    def test_slow_statements_are_logged(self):
+        app.config['SQL_PROFILER_SLOW_MS'] = 0
+        self.app.get('api/v1/tasks/')
+        messages = self.messages()
+        self.assertEquals(len(messages), 2)
+        self.assertIn('ms on GET /api/v1/tasks/: SELECT', messages[1])
+        self.assertIn('LIMIT ? OFFSET ?', messages[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
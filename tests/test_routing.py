@@ -0,0 +1,119 @@
+# -*- coding:Utf8 -*-
+
+
+import json
+import os
+import unittest
+
+from datetime import date
+
+from sqlalchemy.orm import sessionmaker
+
+from project import app, db, bcrypt, fragments
+from project._config import basedir
+from project.models import Task, User
+
+TEST_REPLICA_DB = 'test_replica.db'  # Replica used for testing
+
+
+class RoutingTests(unittest.TestCase):
+
+    """
+        Read replica routing unit test.
+        Primary and replica are two distinct SQLite files holding distinct
+        tasks, so each answer tells which database was read.
+    """
+
+# USEFUL FUNCTIONS
+
+    def setUp(self):
+        """
+            Executing prior to each tasks.
+            Create primary and replica databases, each with its own task.
+        """
+        app.config.from_object('project._config.TestConfig')
+        app.config['SQLALCHEMY_REPLICA_URI'] = \
+            'sqlite:///' + os.path.join(basedir, TEST_REPLICA_DB)
+        self.app = app.test_client()
+        db.create_all()
+        db.Model.metadata.create_all(bind=db.get_replica_engine(app))
+        fragments.clear()
+        self.add_task(db.session, "Primary task")
+        self.add_task(sessionmaker(bind=db.get_replica_engine(app))(),
+                      "Replica task")
+
+        self.assertEquals(app.debug, False)
+
+    def tearDown(self):
+        """
+            Executing after each task.
+            Clean environnement.
+        """
+        db.session.remove()
+        db.drop_all()
+        replica = db.get_replica_engine(app)
+        db.Model.metadata.drop_all(bind=replica)
+        replica.dispose()
+        os.remove(os.path.join(basedir, TEST_REPLICA_DB))
+        app.config['SQLALCHEMY_REPLICA_URI'] = None
+
+# HELPER METHODS
+
+    def add_task(self, session, name):
+        session.add(User("Tester", "mail@mail.fr",
+                         bcrypt.generate_password_hash("python")))
+        session.commit()
+        session.add(Task(name, date(2015, 10, 22), 10, date(2015, 10, 5), 1, 1))
+        session.commit()
+
+    def task_names(self, client):
+        response = client.get('api/v1/tasks/')
+        self.assertEquals(response.status_code, 200)
+        return [task['task name']
+                for task in json.loads(response.data.decode('utf-8'))]
+
+    def post_task(self, client):
+        response = client.post('api/v1/tasks/',
+                               data={"name": "Posted task",
+                                     "user_name": "Tester",
+                                     "password": "python",
+                                     "due_date": "22/09/2055",
+                                     "priority": 2})
+        self.assertEquals(response.status_code, 201)
+
+# TEST ROUTING
+
+    def test_read_only_request_reads_from_replica(self):
+        self.assertEquals(self.task_names(self.app), ['Replica task'])
+
+    def test_sessions_outside_requests_use_primary(self):
+        self.assertEquals([row[0] for row in db.session.query(Task.name)],
+                          ['Primary task'])
+
+    def test_writes_go_to_primary_and_writer_reads_its_own_writes(self):
+        self.post_task(self.app)
+        self.assertEquals(sorted(row[0] for row in db.session.query(Task.name)),
+                          ['Posted task', 'Primary task'])
+        # Writer sticks to the primary, other clients still read the replica.
+        self.assertEquals(self.task_names(self.app),
+                          ['Primary task', 'Posted task'])
+        self.assertEquals(self.task_names(app.test_client()), ['Replica task'])
+
+    def test_writer_reads_from_replica_again_once_window_is_over(self):
+        app.config['SQLALCHEMY_REPLICA_STICKY'] = 0
+        self.post_task(self.app)
+        self.assertEquals(self.task_names(self.app), ['Replica task'])
+
+    def test_read_only_request_which_writes_stays_on_primary(self):
+        with app.test_request_context('/tasks/', method='GET'):
+            app.preprocess_request()
+            self.assertEquals(db.session.query(Task.name).scalar(),
+                              'Replica task')
+            db.session.execute(Task.__table__.update().values(name='Renamed'))
+            self.assertEquals(db.session.query(Task.name).scalar(), 'Renamed')
+            db.session.commit()
+        self.assertEquals(db.session.query(Task.name).scalar(), 'Renamed')
+
+
+if __name__ == '__main__':
+    unittest.main()
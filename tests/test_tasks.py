@@ -3,9 +3,14 @@ from __future__ import unicode_literals  # Python2 unicode
 
 
 import unittest
+from datetime import date, datetime, timedelta
 
-from project import app, db, bcrypt
-from project.models import User, Task
+from sqlalchemy import event
+
+from project import app, db, bcrypt, fragments, live
+from project.models import User, Task, TaskArchive, TaskChange, UserTaskStats
+from project.tasks.queries import (archive_closed_tasks, bump_tasks_version,
+                                   rebuild_task_stats, task_counts)
 
 
 class TasksTests(unittest.TestCase):
@@ -24,6 +29,7 @@ class TasksTests(unittest.TestCase):
         app.config.from_object('project._config.TestConfig')
         self.app = app.test_client()
         db.create_all()
+        fragments.clear()
 
         self.assertEquals(app.debug, False)
 
@@ -62,6 +68,33 @@ class TasksTests(unittest.TestCase):
         db.session.add(new_user)
         db.session.commit()
 
+    def count_queries(self, url):
+        """
+            Return number of SQL statements run to answer a GET on url.
+        """
+        statements = []
+
+        def count(*args):
+            statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            self.app.get(url)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        return len(statements)
+
+    def create_tasks_of_many_users(self, count, start=0):
+        for index in range(start, start + count):
+            user = User(name='User{0}'.format(index),
+                        email='user{0}@monMail.com'.format(index),
+                        password='unused')
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Task('Task{0}'.format(index), date(2015, 1, 22), 1,
+                                date(2015, 1, 20), index % 2, user.user_id))
+        bump_tasks_version()
+        db.session.commit()
+
     def create_task(self):
         return self.app.post('add/',
                              data=dict(name='Go to the bank',
@@ -132,6 +165,14 @@ class TasksTests(unittest.TestCase):
         self.assertNotIn(b'The task was marked as complete. Well done !', response.data)
         self.assertIn(b'You can only update tasks that belong to you.', response.data)
 
+    def test_users_cannot_complete_or_delete_tasks_that_do_not_exist(self):
+        self.register()
+        self.login()
+        response1 = self.app.get("complete/209/", follow_redirects=True)
+        self.assertIn(b'That task does not exist.', response1.data)
+        response2 = self.app.get("delete/209/", follow_redirects=True)
+        self.assertIn(b'That task does not exist.', response2.data)
+
     def test_users_cannot_delete_tasks_that_are_not_created_by_them(self):
         self.create_user()
         self.login()
@@ -252,6 +293,255 @@ class TasksTests(unittest.TestCase):
         self.assertIn(b'complete/2/', response.data)
         self.assertIn(b'delete/2/', response.data)
 
+
+# TEST QUERY COUNT
+
+    def test_tasks_page_query_count_does_not_grow_with_tasks(self):
+        self.register()
+        self.login()
+        self.create_tasks_of_many_users(2)
+        few = self.count_queries('tasks/')
+        self.create_tasks_of_many_users(40, start=2)
+        many = self.count_queries('tasks/')
+        self.assertEqual(few, many)
+        response = self.app.get('tasks/')
+        self.assertIn(b'User41', response.data)
+
+
+# TEST PAGINATION
+
+    def test_closed_tasks_are_not_rendered_with_tasks_page(self):
+        self.register()
+        self.login()
+        self.create_tasks_of_many_users(4)
+        response = self.app.get('tasks/')
+        self.assertIn(b'Task1', response.data)
+        self.assertNotIn(b'Task0', response.data)
+        self.assertIn(b'/tasks/closed/', response.data)
+
+    def test_closed_tasks_are_loaded_by_pages(self):
+        app.config['TASKS_PER_PAGE'] = 2
+        self.register()
+        self.login()
+        self.create_tasks_of_many_users(10)
+        response = self.app.get('tasks/closed/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Task0', response.data)
+        self.assertIn(b'Task2', response.data)
+        self.assertNotIn(b'Task1', response.data)
+        self.assertNotIn(b'Task4', response.data)
+        next_url = response.headers['Link'].split('>')[0].lstrip('<')
+        response = self.app.get(next_url)
+        self.assertIn(b'Task4', response.data)
+        self.assertIn(b'Task6', response.data)
+        self.assertNotIn(b'Task2', response.data)
+        next_url = response.headers['Link'].split('>')[0].lstrip('<')
+        response = self.app.get(next_url)
+        self.assertIn(b'Task8', response.data)
+        self.assertNotIn('Link', response.headers)
+
+    def test_open_tasks_are_paginated(self):
+        app.config['TASKS_PER_PAGE'] = 2
+        self.register()
+        self.login()
+        self.create_tasks_of_many_users(6)
+        response = self.app.get('tasks/')
+        self.assertIn(b'Task1', response.data)
+        self.assertIn(b'Task3', response.data)
+        self.assertNotIn(b'Task5', response.data)
+        self.assertIn(b'open_after=2015-01-22_4', response.data)
+        response = self.app.get('tasks/?open_after=2015-01-22_4')
+        self.assertIn(b'Task5', response.data)
+        self.assertNotIn(b'Task3', response.data)
+        self.assertNotIn(b'Next open tasks', response.data)
+        self.assertIn(b'First page', response.data)
+
+
+# TEST FRAGMENT CACHE
+
+    def test_task_tables_are_cached_until_next_write(self):
+        self.register()
+        self.login()
+        self.create_tasks_of_many_users(4)
+        fragments.clear()
+        self.app.get('tasks/')
+        self.app.get('tasks/')
+        self.assertEqual((fragments.hits, fragments.misses), (1, 1))
+        # A write bumps tasks version, so the table is rendered again.
+        response = self.create_task()
+        self.assertIn(b'Go to the bank', response.data)
+        self.assertEqual((fragments.hits, fragments.misses), (1, 2))
+
+    def test_task_tables_are_cached_per_viewer_rights(self):
+        self.register()
+        self.login()
+        self.create_task()
+        self.logout()
+        self.create_admin_user()
+        self.login('Superman', 'allpowerful')
+        response = self.app.get('tasks/')
+        self.assertIn(b'complete/1/', response.data)
+        self.logout()
+        self.register(name='Escroc', email='mail2@monMail.com')
+        self.login(name='Escroc')
+        response = self.app.get('tasks/')
+        self.assertIn(b'Go to the bank', response.data)
+        self.assertNotIn(b'complete/1/', response.data)
+
+
+# TEST LIVE FEED
+
+    def test_task_writes_are_logged_as_changes(self):
+        self.register()
+        self.login()
+        self.create_task()
+        self.app.get('complete/1/', follow_redirects=True)
+        self.app.get('delete/1/', follow_redirects=True)
+        changes = db.session.query(TaskChange.task_id, TaskChange.kind).order_by(
+            TaskChange.change_id).all()
+        self.assertEqual(changes, [(1, 'created'), (1, 'completed'),
+                                   (1, 'deleted')])
+
+    def test_live_feed_is_off_by_default(self):
+        self.register()
+        self.login()
+        response = self.app.get('tasks/')
+        self.assertNotIn(b'/tasks/live/', response.data)
+        response = self.app.get('tasks/live/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_live_feed_sends_changes_missed_since_last_event_id(self):
+        app.config['LIVE_FEED'] = True
+        self.register()
+        self.login()
+        self.create_task()
+        self.create_task()
+        response = self.app.get('tasks/live/', headers={'Last-Event-ID': '1'},
+                                buffered=False)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        chunks = iter(response.response)
+        self.assertEqual(next(chunks), b'retry: 3000\n\n')
+        self.assertEqual(next(chunks),
+                         b'id: 2\nevent: created\ndata: {"task_id": 2}\n\n')
+        response.close()
+
+    def test_commits_are_broadcast_to_subscriptions(self):
+        self.register()
+        self.login()
+        subscription = live.subscribe()
+        try:
+            self.create_task()
+            changes = subscription.get(timeout=5)
+        finally:
+            live.unsubscribe(subscription)
+        self.assertEqual([tuple(change) for change in changes],
+                         [(1, 1, 'created')])
+
+
+# TEST TASK COUNTERS
+
+    def test_task_counters_follow_task_writes(self):
+        self.register()
+        self.login()
+        self.create_task()
+        self.create_task()
+        self.assertEqual(task_counts(1), (2, 0))
+        self.app.get('complete/1/', follow_redirects=True)
+        self.assertEqual(task_counts(1), (1, 1))
+        self.app.get('delete/2/', follow_redirects=True)
+        self.assertEqual(task_counts(1), (0, 1))
+        # Reopen
+        db.session.query(Task).filter_by(task_id=1).update({'status': 1})
+        db.session.commit()
+        self.assertEqual(task_counts(1), (1, 0))
+        response = self.app.get('tasks/')
+        self.assertIn(b'You have 1 open and 0 closed tasks.', response.data)
+
+    def test_task_counters_can_be_rebuilt(self):
+        self.create_tasks_of_many_users(3)
+        db.session.query(UserTaskStats).update({'open_count': 42})
+        db.session.commit()
+        rebuild_task_stats()
+        db.session.commit()
+        counts = [task_counts(user_id) for user_id in (1, 2, 3)]
+        self.assertEqual(counts, [(0, 1), (1, 0), (0, 1)])
+
+
+# TEST ARCHIVE
+
+    def archive_all_closed_tasks(self):
+        return archive_closed_tasks(datetime.utcnow() + timedelta(minutes=1), 2)
+
+    def test_closed_tasks_are_moved_to_archive_by_batches(self):
+        self.create_tasks_of_many_users(6)
+        self.assertEqual(self.archive_all_closed_tasks(), 3)
+        self.assertEqual(sorted(row[0] for row in db.session.query(Task.name)),
+                         ['Task1', 'Task3', 'Task5'])
+        self.assertEqual(sorted(row[0] for row in db.session.query(TaskArchive.name)),
+                         ['Task0', 'Task2', 'Task4'])
+        kinds = [row[0] for row in db.session.query(TaskChange.kind).filter(
+            TaskChange.task_id == 1)]
+        self.assertEqual(kinds, ['created', 'archived'])
+        # Archived tasks still count as closed tasks of their user.
+        self.assertEqual(task_counts(1), (0, 1))
+        rebuild_task_stats()
+        db.session.commit()
+        self.assertEqual(task_counts(1), (0, 1))
+
+    def test_ids_of_archived_tasks_are_not_reused(self):
+        self.create_tasks_of_many_users(3)
+        self.assertEqual(self.archive_all_closed_tasks(), 2)
+        self.create_tasks_of_many_users(1, start=3)
+        self.assertEqual([row[0] for row in db.session.query(Task.task_id)
+                          .order_by(Task.task_id)], [2, 4])
+
+    def test_task_whose_id_is_already_archived_stays_live(self):
+        self.create_tasks_of_many_users(2)
+        db.session.add(TaskArchive(task_id=1, name='Old task',
+                                   due_date=date(2014, 1, 1), priority=1,
+                                   status=0, version=1,
+                                   archived_at=datetime.utcnow()))
+        db.session.commit()
+        self.assertEqual(self.archive_all_closed_tasks(), 0)
+        self.assertEqual(db.session.query(Task.name).filter_by(
+            task_id=1).scalar(), 'Task0')
+
+    def test_recently_closed_tasks_are_not_archived(self):
+        self.create_tasks_of_many_users(2)
+        self.assertEqual(archive_closed_tasks(datetime.utcnow() - timedelta(days=1), 2), 0)
+        self.assertEqual(db.session.query(TaskArchive).count(), 0)
+
+    def test_closed_tasks_history_goes_on_with_archived_tasks(self):
+        self.register()
+        self.login()
+        self.create_tasks_of_many_users(4)
+        self.archive_all_closed_tasks()
+        response = self.app.get('tasks/closed/')
+        self.assertNotIn(b'Task0', response.data)
+        next_url = response.headers['Link'].split('>')[0].lstrip('<')
+        self.assertIn('archive=1', next_url)
+        response = self.app.get(next_url)
+        self.assertIn(b'Task0', response.data)
+        self.assertIn(b'Task2', response.data)
+        self.assertIn(b'Archived', response.data)
+        self.assertNotIn(b'Delete', response.data)
+
+
+# TEST SEARCH
+
+    def test_search_page_shows_tasks_matching_words(self):
+        self.register()
+        self.login()
+        self.create_tasks_of_many_users(12)
+        response = self.app.get('tasks/search/?q=task1')
+        self.assertEqual(response.status_code, 200)
+        for name in (b'Task1<', b'Task10<', b'Task11<'):
+            self.assertIn(name, response.data)
+        self.assertNotIn(b'Task2<', response.data)
+        response = self.app.get('tasks/search/?q=swim')
+        self.assertIn(b'No task found.', response.data)
+
+
 # Run all tests
 if __name__ == '__main__':
     unittest.main()
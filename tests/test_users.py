@@ -2,9 +2,11 @@
 from __future__ import unicode_literals  # Python2 unicode
 
 
+import threading
+import time
 import unittest
 
-from project import app, db, bcrypt
+from project import app, db, bcrypt, fragments, passwords
 from project.models import User
 
 
@@ -24,6 +26,7 @@ class UserTests(unittest.TestCase):
         app.config.from_object('project._config.TestConfig')
         self.app = app.test_client()
         db.create_all()
+        fragments.clear()
 
         self.assertEquals(app.debug, False)
 
@@ -153,6 +156,46 @@ class UserTests(unittest.TestCase):
         self.assertNotIn(b'You were logged out.', response.data)
 
 
+# TEST PASSWORDS
+
+    def test_password_is_rehashed_at_login_if_cost_factor_changed(self):
+        db.session.add(User(name='Jérémy', email='mail@monMail.com',
+                            password=bcrypt.generate_password_hash('python', 4)))
+        db.session.commit()
+        response = self.login()
+        self.assertIn(b'Welcome ! You were successfully logged in.', response.data)
+        user = db.session.query(User).filter_by(name='Jérémy').first()
+        self.assertFalse(passwords.needs_rehash(user.password))
+        self.assertTrue(passwords.check(user.password, 'python'))
+
+    def test_login_is_rejected_when_password_pool_is_saturated(self):
+        app.config['PASSWORD_HASH_MAX_QUEUE'] = 1
+        self.create_user()
+        passwords.check(db.session.query(User).first().password, 'python')
+        rejected = passwords.rejected
+        # Keep every worker busy and fill the queue with blocked demands.
+        release = threading.Event()
+        blockers = [threading.Thread(target=passwords._submit,
+                                     args=(release.wait,))
+                    for _ in range(passwords.workers + 1)]
+        for blocker in blockers:
+            blocker.start()
+        try:
+            deadline = time.time() + 5
+            while passwords.queue_depth < 1 and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(passwords.queue_depth, 1)
+            response = self.login()
+        finally:
+            release.set()
+            for blocker in blockers:
+                blocker.join()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(passwords.rejected, rejected + 1)
+        self.assertEqual(passwords.queue_depth, 0)
+        self.assertEqual(self.login().status_code, 200)
+
+
 # TEST REPR
 
     def test_user_repr(self):